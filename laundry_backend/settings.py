@@ -60,13 +60,57 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "laundry_backend.wsgi.application"
-
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+ASGI_APPLICATION = "laundry_backend.asgi.application"
+
+# Database profile: DATABASE_PROFILE=postgres reads the connection from
+# POSTGRES_* variables (requires psycopg); the default "sqlite" profile is
+# tuned for concurrent access: WAL lets readers proceed during writes,
+# synchronous=NORMAL is safe under WAL, writers wait up to
+# SQLITE_BUSY_TIMEOUT seconds instead of failing with "database is locked",
+# and IMMEDIATE transactions take the write lock up front so they can't
+# deadlock upgrading from a read lock.
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "sqlite")
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", "60"))
+
+if DATABASE_PROFILE == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "laundry"),
+            "USER": os.environ.get("POSTGRES_USER", "laundry"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+            "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            # Keep connections open between requests and verify them before reuse
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "connect_timeout": int(os.environ.get("POSTGRES_CONNECT_TIMEOUT", "5")),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                # Run on every new connection
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024)))};"
+                ),
+                "timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", "20")),
+                "transaction_mode": "IMMEDIATE",
+            },
+            # A file rather than the default in-memory database, so tests
+            # with concurrent writers get WAL and the busy timeout too
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+        }
     }
-}
 
 AUTH_PASSWORD_VALIDATORS = []
 
@@ -95,10 +139,72 @@ REST_FRAMEWORK = {
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework.authentication.TokenAuthentication",
+        "users.authentication.CachingTokenAuthentication",
     ],
 }
 
+# Cursor pagination for list endpoints (see utils/pagination.py). Set
+# PAGINATION_LEGACY_ARRAY=1 to keep returning bare arrays by default.
+PAGINATION_PAGE_SIZE = int(os.environ.get("PAGINATION_PAGE_SIZE", "50"))
+PAGINATION_MAX_PAGE_SIZE = int(os.environ.get("PAGINATION_MAX_PAGE_SIZE", "200"))
+PAGINATION_LEGACY_ARRAY = os.environ.get("PAGINATION_LEGACY_ARRAY", "0") == "1"
+
+# Public pricing endpoint: browsers/clients may reuse the response for this
+# many seconds, then revalidate with If-None-Match / If-Modified-Since.
+PRICING_CACHE_MAX_AGE = int(os.environ.get("PRICING_CACHE_MAX_AGE", "60"))
+
+# Nearest-driver lookups (GET /api/drivers/nearest/) use an in-memory grid
+# index of available drivers; set DRIVER_SPATIAL_INDEX_ENABLED=0 to always
+# query the database instead. DRIVER_INDEX_CELL_DEGREES is its finest cell
+# (coarser grids are kept for sparse areas).
+DRIVER_SPATIAL_INDEX_ENABLED = os.environ.get("DRIVER_SPATIAL_INDEX_ENABLED", "1") == "1"
+DRIVER_INDEX_CELL_DEGREES = float(os.environ.get("DRIVER_INDEX_CELL_DEGREES", "0.01"))
+DRIVER_INDEX_REBUILD_SECONDS = int(os.environ.get("DRIVER_INDEX_REBUILD_SECONDS", "300"))
+
+# Driver location pings (POST /api/drivers/locations/) are buffered in
+# memory and flushed in bulk at this interval.
+DRIVER_LOCATION_FLUSH_SECONDS = float(os.environ.get("DRIVER_LOCATION_FLUSH_SECONDS", "5"))
+DRIVER_LOCATION_HISTORY = os.environ.get("DRIVER_LOCATION_HISTORY", "1") == "1"
+
+# Real-time streams (GET /api/stream/). The default broker passes events
+# between processes (web, outbox worker, dispatcher, ASGI workers) through the
+# database; utils.events.InProcessBroker skips the table but only reaches
+# clients connected to the publishing process.
+EVENT_BROKER = os.environ.get("EVENT_BROKER", "utils.events.DatabaseBroker")
+EVENT_POLL_INTERVAL_SECONDS = float(os.environ.get("EVENT_POLL_INTERVAL_SECONDS", "0.5"))
+EVENT_RETENTION_SECONDS = int(os.environ.get("EVENT_RETENTION_SECONDS", "300"))
+EVENT_STREAM_HEARTBEAT_SECONDS = int(os.environ.get("EVENT_STREAM_HEARTBEAT_SECONDS", "15"))
+EVENT_SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("EVENT_SUBSCRIBER_QUEUE_SIZE", "100"))
+
+# Customers tracking their driver (GET /api/requests/<id>/track/) get at most
+# one position update per interval, and only once the driver has moved.
+DRIVER_TRACKING_MIN_INTERVAL_SECONDS = float(os.environ.get("DRIVER_TRACKING_MIN_INTERVAL_SECONDS", "5"))
+DRIVER_TRACKING_MIN_MOVE_METERS = float(os.environ.get("DRIVER_TRACKING_MIN_MOVE_METERS", "10"))
+
+# Token -> user lookups are cached per process (LRU with TTL); a token revoked
+# in one worker stays valid in the others for up to AUTH_TOKEN_CACHE_TTL
+# seconds. Set AUTH_TOKEN_SHARED_CACHE to a shared CACHES alias (e.g. Redis)
+# to cache there instead and make revocation immediate across workers.
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get("AUTH_TOKEN_CACHE_TTL", "60"))
+AUTH_TOKEN_SHARED_CACHE = os.environ.get("AUTH_TOKEN_SHARED_CACHE") or None
+
+# Admins with digest delivery get at most one digest email per interval;
+# run `manage.py flush_notification_digest` from cron (or with --loop).
+NOTIFICATION_DIGEST_INTERVAL_MINUTES = int(os.environ.get("NOTIFICATION_DIGEST_INTERVAL_MINUTES", "60"))
+NOTIFICATION_DIGEST_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_DIGEST_RETENTION_DAYS", "7"))
+# Events younger than this wait for the next flush so in-flight transactions aren't skipped.
+NOTIFICATION_DIGEST_SETTLE_SECONDS = int(os.environ.get("NOTIFICATION_DIGEST_SETTLE_SECONDS", "60"))
+
+# /api/stats/ reads hourly/daily rollups refreshed by
+# `manage.py rollup_request_stats`; events younger than this are left for the
+# next run so in-flight transactions aren't skipped.
+ROLLUP_SETTLE_SECONDS = int(os.environ.get("ROLLUP_SETTLE_SECONDS", "60"))
+
+# Lines validated and inserted per transaction by `manage.py import_requests`
+# and POST /api/requests/bulk-import/.
+REQUEST_IMPORT_BATCH_SIZE = int(os.environ.get("REQUEST_IMPORT_BATCH_SIZE", "2000"))
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
 ALLOWED_HOSTS = ["*"]  # For development only
@@ -126,3 +232,13 @@ AWS_SES_CONFIGURATION_SET = os.environ.get("AWS_SES_CONFIGURATION_SET")
 # # For local development only (print emails to console):
 # if DEBUG:
 #     EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+#
+# To measure connection reuse locally, use the counting stand-in backend:
+#     EMAIL_BACKEND = "utils.mail_backends.CountingEmailBackend"
+
+# Notification outbox: emails and in-app notifications are queued in the
+# database and delivered by `python manage.py run_notification_worker`.
+# Set NOTIFICATION_OUTBOX_ENABLED=0 to deliver inline after commit instead.
+NOTIFICATION_OUTBOX_ENABLED = os.environ.get("NOTIFICATION_OUTBOX_ENABLED", "1") == "1"
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("NOTIFICATION_OUTBOX_MAX_ATTEMPTS", "8"))
+NOTIFICATION_OUTBOX_BACKOFF_SECONDS = int(os.environ.get("NOTIFICATION_OUTBOX_BACKOFF_SECONDS", "30"))
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from .models import LaundryRequest, Driver
-from .models import PricingItem
+from .models import PricingItem, RequestStatusEvent
+from .timeline import record_transition
+from utils.events import publish_request_event
 
 @admin.register(Driver)
 class DriverAdmin(admin.ModelAdmin):
@@ -22,7 +24,7 @@ class LaundryRequestAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'updated_at')
     fieldsets = (
         ('Customer Information', {
-            'fields': ('customer', 'customer_name', 'phone', 'address')
+            'fields': ('customer', 'customer_name', 'phone', 'address', 'pickup_latitude', 'pickup_longitude')
         }),
         ('Request Details', {
             'fields': ('items_description', 'pickup_time', 'status', 'driver')
@@ -33,6 +35,27 @@ class LaundryRequestAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Keep the status event log and projections in step with admin edits
+        if not change:
+            record_transition(obj.pk, '', obj.status, to_driver_id=obj.driver_id, actor=request.user, source='admin')
+        elif {'status', 'driver'} & set(form.changed_data):
+            record_transition(obj.pk, form.initial.get('status', ''), obj.status,
+                              form.initial.get('driver'), obj.driver_id, actor=request.user, source='admin')
+            publish_request_event(obj, 'request.status', old_status=form.initial.get('status', ''))
+
+
+@admin.register(RequestStatusEvent)
+class RequestStatusEventAdmin(admin.ModelAdmin):
+    list_display = ('request', 'from_status', 'to_status', 'driver', 'actor', 'source', 'created_at')
+    list_filter = ('to_status', 'source')
+    raw_id_fields = ('request', 'driver', 'actor')
+    date_hierarchy = 'created_at'
+
+    def has_change_permission(self, request, obj=None):
+        return False  # append-only
+
 
 @admin.register(PricingItem)
 class PricingItemAdmin(admin.ModelAdmin):
@@ -0,0 +1,291 @@
+"""Batch dispatch of pending laundry requests to available drivers.
+
+Each cycle loads every dispatchable pending request and every driver with
+spare capacity, scores candidate (request, driver) pairs and commits the
+chosen assignments in bulk together with their notification outbox rows.
+
+Scoring is a travel cost: straight-line distance plus a penalty for every
+minute the driver would arrive after the requested pickup time. Candidate
+pairs are limited to each request's nearest drivers (found with the grid
+index from spatial.py, with cells sized to the fleet's density), which
+keeps the assignment graph sparse. It is
+solved with the Hungarian method's successive shortest augmenting paths
+(Dijkstra over reduced costs, drivers with several free slots acting as
+several columns): requests are added oldest first, each one is served
+whenever some re-shuffle of earlier assignments frees a candidate driver
+for it, and the result has the minimum total cost among assignments that
+serve the same requests.
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+import heapq
+import logging
+import math
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from utils.conf import Setting
+from utils.events import publish_request_event
+from utils.outbox import enqueue_notifications
+from .models import Driver, LaundryRequest
+from .spatial import CELL_DEGREES, DriverGridIndex
+from .timeline import Transition, record_transitions
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('assigned', 'picked_up', 'in_progress')
+
+# Tunables (override in settings.py)
+MAX_ACTIVE_PER_DRIVER = Setting('DISPATCH_MAX_ACTIVE_PER_DRIVER', 1)
+CANDIDATES_PER_REQUEST = Setting('DISPATCH_CANDIDATES_PER_REQUEST', 8)
+MAX_DISTANCE_KM = Setting('DISPATCH_MAX_DISTANCE_KM', 30)
+# Only requests whose pickup is due within this horizon are dispatched
+HORIZON_MINUTES = Setting('DISPATCH_HORIZON_MINUTES', 120)
+AVERAGE_SPEED_KMH = Setting('DISPATCH_AVERAGE_SPEED_KMH', 25)
+LATE_PENALTY_KM_PER_MINUTE = Setting('DISPATCH_LATE_PENALTY_KM_PER_MINUTE', 0.5)
+# Smallest grid cell the dispatch index shrinks to in dense areas (~100 m)
+MIN_CELL_DEGREES = 0.001
+
+
+@dataclass
+class Assignment:
+    request_id: int
+    driver_id: int
+    distance_km: float
+    cost: float
+
+
+def dispatchable_requests(now, limit=None):
+    """Pending, unassigned requests with a pickup position that are due within the horizon"""
+    horizon = now + timedelta(minutes=HORIZON_MINUTES.value)
+    qs = LaundryRequest.objects.filter(
+        Q(pickup_time__isnull=True) | Q(pickup_time__lte=horizon),
+        status='pending',
+        driver__isnull=True,
+        pickup_latitude__isnull=False,
+        pickup_longitude__isnull=False,
+    ).order_by('created_at').values_list('id', 'pickup_latitude', 'pickup_longitude', 'pickup_time')
+    if limit:
+        qs = qs[:limit]
+    return list(qs)
+
+
+def driver_capacity():
+    """{driver_id: (lat, lng, free_slots)} for available, located drivers below their active-load cap"""
+    rows = Driver.objects.filter(
+        is_available=True, latitude__isnull=False, longitude__isnull=False,
+    ).annotate(
+        active=Count('laundryrequest', filter=Q(laundryrequest__status__in=ACTIVE_STATUSES)),
+    ).values_list('id', 'latitude', 'longitude', 'active')
+    return {
+        driver_id: (float(lat), float(lng), MAX_ACTIVE_PER_DRIVER.value - active)
+        for driver_id, lat, lng, active in rows
+        if active < MAX_ACTIVE_PER_DRIVER.value
+    }
+
+
+def plan_assignments(requests, drivers, now):
+    """Choose (request, driver) pairs for one cycle.
+
+    `requests` is a list of (id, lat, lng, pickup_time), oldest first, and
+    `drivers` maps driver id to (lat, lng, free_slots). Returns a list of
+    Assignment.
+    """
+    costs = candidate_costs(requests, drivers, now)
+    matcher = _MinCostMatcher(costs, {driver_id: slots for driver_id, (_, _, slots) in drivers.items()})
+    for request_id, _, _, _ in requests:
+        if request_id in costs:
+            matcher.augment(request_id)
+    return [
+        Assignment(request_id, driver_id, costs[request_id][driver_id][1], costs[request_id][driver_id][0])
+        for request_id, driver_id in matcher.match.items()
+    ]
+
+
+def grid_cell_degrees(drivers):
+    """Cell size that puts about DISPATCH_CANDIDATES_PER_REQUEST drivers in a cell of the area the fleet covers.
+
+    A fixed cell size makes every nearest-driver query scan more drivers as
+    the fleet in a city grows; shrinking cells with density keeps it flat.
+    """
+    if not drivers:
+        return CELL_DEGREES.value
+    lats = [float(lat) for lat, _, _ in drivers.values()]
+    lngs = [float(lng) for _, lng, _ in drivers.values()]
+    area = max(max(lats) - min(lats), MIN_CELL_DEGREES) * max(max(lngs) - min(lngs), MIN_CELL_DEGREES)
+    cell = math.sqrt(area * CANDIDATES_PER_REQUEST.value / len(drivers))
+    return min(max(cell, MIN_CELL_DEGREES), CELL_DEGREES.value)
+
+
+def candidate_costs(requests, drivers, now):
+    """{request_id: {driver_id: (cost, distance_km)}} for each request's nearest drivers"""
+    index = DriverGridIndex(grid_cell_degrees(drivers))
+    for driver_id, (lat, lng, _) in drivers.items():
+        index.update(driver_id, lat, lng)
+
+    costs = {}  # request_id -> {driver_id: (cost, distance)}
+    for request_id, lat, lng, pickup_time in requests:
+        nearest = index.nearest(float(lat), float(lng), k=CANDIDATES_PER_REQUEST.value, radius_km=MAX_DISTANCE_KM.value)
+        options = {}
+        for distance, driver_id in nearest:
+            cost = distance
+            if pickup_time is not None:
+                arrival = now + timedelta(hours=distance / AVERAGE_SPEED_KMH.value)
+                late_minutes = (arrival - pickup_time).total_seconds() / 60
+                if late_minutes > 0:
+                    cost += late_minutes * LATE_PENALTY_KM_PER_MINUTE.value
+            options[driver_id] = (cost, distance)
+        if options:
+            costs[request_id] = options
+    return costs
+
+
+class _MinCostMatcher:
+    """Sparse min-cost bipartite matching with driver capacities.
+
+    Keeps dual potentials so every reduced cost stays non-negative, which
+    lets each augmentation be a Dijkstra search that stops at the first
+    driver with a free slot.
+    """
+
+    def __init__(self, costs, free):
+        self.costs = costs
+        self.free = free
+        self.match = {}  # request_id -> driver_id
+        self.members = {driver_id: set() for driver_id in free}
+        self.request_potential = dict.fromkeys(costs, 0.0)
+        self.driver_potential = dict.fromkeys(free, 0.0)
+        # Drivers a failed search exhausted: free slots only shrink and no
+        # later augmenting path can pass through them, so they stay dead
+        self.dead = set()
+
+    def augment(self, request_id):
+        """Serve `request_id` along the cheapest augmenting path; returns False if none exists"""
+        costs, match = self.costs, self.match
+        u, v = self.request_potential, self.driver_potential
+        request_dist = {request_id: 0.0}
+        driver_dist = {}
+        driver_parent = {}  # driver -> request it was reached from
+        done_requests, done_drivers = set(), set()
+        dead = self.dead
+        heap = [(0.0, 0, request_id)]  # (dist, kind, id); kind 0 = request, 1 = driver
+        target = None
+        while heap:
+            dist, kind, node = heapq.heappop(heap)
+            if kind == 0:
+                if node in done_requests:
+                    continue
+                done_requests.add(node)
+                for driver_id, (cost, _) in costs[node].items():
+                    if driver_id == match.get(node) or driver_id in done_drivers or driver_id in dead:
+                        continue
+                    nd = dist + cost + u[node] - v[driver_id]
+                    if nd < driver_dist.get(driver_id, float('inf')):
+                        driver_dist[driver_id] = nd
+                        driver_parent[driver_id] = node
+                        heapq.heappush(heap, (nd, 1, driver_id))
+            else:
+                if node in done_drivers:
+                    continue
+                done_drivers.add(node)
+                if self.free[node] > 0:
+                    target = node
+                    break
+                # Full driver: try moving one of its requests elsewhere
+                for other in self.members[node]:
+                    if other in done_requests:
+                        continue
+                    nd = dist - costs[other][node][0] + v[node] - u[other]
+                    if nd < request_dist.get(other, float('inf')):
+                        request_dist[other] = nd
+                        heapq.heappush(heap, (nd, 0, other))
+        if target is None:
+            dead.update(done_drivers)
+            return False
+
+        # Shift potentials by the search distances, capped at the path length
+        length = driver_dist[target]
+        for node in done_requests:
+            u[node] += request_dist[node] - length
+        for node in done_drivers:
+            v[node] += driver_dist[node] - length
+
+        self.free[target] -= 1
+        driver_id = target
+        while True:
+            moved = driver_parent[driver_id]
+            previous = match.get(moved)
+            match[moved] = driver_id
+            self.members[driver_id].add(moved)
+            if moved == request_id:
+                return True
+            self.members[previous].discard(moved)
+            driver_id = previous
+
+
+def commit_assignments(plan, now=None):
+    """Persist a plan in one transaction and queue driver-assignment notifications.
+
+    Requests that stopped being pending/unassigned since planning (e.g. a
+    staff member assigned them by hand) are skipped, and so are pairs whose
+    driver went unavailable or filled up meanwhile: availability and active
+    load are read again under the row locks. Returns the committed
+    assignments.
+    """
+    if not plan:
+        return []
+    now = now or timezone.now()
+    by_request = {a.request_id: a for a in plan}
+    with transaction.atomic():
+        rows = list(
+            LaundryRequest.objects.select_for_update()
+            .filter(pk__in=by_request, status='pending', driver__isnull=True)
+            .order_by('created_at')
+        )
+        driver_ids = {by_request[row.pk].driver_id for row in rows}
+        drivers = dict(
+            Driver.objects.select_for_update()
+            .filter(pk__in=driver_ids, is_available=True).values_list('id', 'user_id')
+        )
+        free = dict.fromkeys(drivers, MAX_ACTIVE_PER_DRIVER.value)
+        active = (
+            LaundryRequest.objects.filter(driver_id__in=drivers, status__in=ACTIVE_STATUSES)
+            .order_by().values_list('driver').annotate(n=Count('id'))
+        )
+        for driver_id, count in active:
+            free[driver_id] -= count
+        assigned = []
+        for row in rows:
+            driver_id = by_request[row.pk].driver_id
+            if free.get(driver_id, 0) <= 0:
+                continue
+            free[driver_id] -= 1
+            row.driver_id = driver_id
+            row.status = 'assigned'
+            row.updated_at = now
+            assigned.append(row)
+        LaundryRequest.objects.bulk_update(assigned, ['driver', 'status', 'updated_at'])
+        record_transitions(
+            [Transition(row.pk, 'pending', 'assigned', None, row.driver_id) for row in assigned],
+            source='dispatch', now=now,
+        )
+        enqueue_notifications('driver_assignment', [{'request_id': row.pk} for row in assigned])
+        for row in assigned:
+            publish_request_event(row, 'request.assigned', driver_user_id=drivers[row.driver_id])
+    return [by_request[row.pk] for row in assigned]
+
+
+def run_dispatch_cycle(limit=None, dry_run=False):
+    """Plan and (unless dry_run) commit one dispatch cycle. Returns (pending, plan, committed)."""
+    now = timezone.now()
+    requests = dispatchable_requests(now, limit=limit)
+    if not requests:
+        return 0, [], []
+    drivers = driver_capacity()
+    plan = plan_assignments(requests, drivers, now)
+    committed = [] if dry_run else commit_assignments(plan, now)
+    logger.info('Dispatch cycle: %s pending, %s drivers, %s planned, %s committed',
+                len(requests), len(drivers), len(plan), len(committed))
+    return len(requests), plan, committed
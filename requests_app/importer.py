@@ -0,0 +1,179 @@
+"""Bulk import of laundry requests from NDJSON.
+
+One JSON object per line, with the fields of LaundryRequestSerializer plus
+a `customer_id` or `customer_email` and an optional historical
+`created_at`; the `export?output=ndjson` format round-trips (unknown keys
+such as `id` or `driver_name` are ignored). Lines are read as a stream and
+handled in batches: each batch is validated with the serializer rules,
+customers and drivers are resolved with one query each, and the valid rows
+are inserted with bulk_create and logged via record_transitions() in a
+single transaction. Invalid lines are skipped and reported with their line
+number; committed batches stay committed, so an interrupted import resumes
+from the last reported line (or byte offset) instead of starting over.
+"""
+import json
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from rest_framework.exceptions import ValidationError
+
+from utils.conf import Setting
+from .models import Driver, LaundryRequest
+from .serializers import LaundryRequestImportSerializer
+from .timeline import Transition, record_transitions
+
+BATCH_SIZE = Setting('REQUEST_IMPORT_BATCH_SIZE', 2000)
+
+# `offset` is the byte position after the batch's last line, for seeking on resume
+BatchResult = namedtuple('BatchResult', 'last_line offset created errors')
+
+
+def read_lines(stream, line=0, offset=0):
+    """Yield (line_number, end_offset, raw) for the non-blank lines of a binary stream.
+
+    `line` and `offset` are where the stream is positioned, e.g. after
+    seeking to a checkpoint; numbering continues from there.
+    """
+    for raw in iter(stream.readline, b''):
+        line += 1
+        offset += len(raw)
+        if raw.strip():
+            yield line, offset, raw
+
+
+def validate_lines(lines):
+    """Validate raw lines; returns ([(line, validated_data)], [(line, errors)])"""
+    serializer = LaundryRequestImportSerializer()
+    valid, errors = [], []
+    for line, raw in lines:
+        try:
+            data = json.loads(raw)
+        except ValueError as exc:
+            errors.append((line, {'non_field_errors': [f'Invalid JSON: {exc}']}))
+            continue
+        if not isinstance(data, dict):
+            errors.append((line, {'non_field_errors': ['Expected a JSON object']}))
+            continue
+        try:
+            valid.append((line, serializer.run_validation(data)))
+        except ValidationError as exc:
+            errors.append((line, exc.detail))
+    return valid, errors
+
+
+def resolve_references(valid):
+    """Attach customer and driver ids with one query each; returns (rows, errors)"""
+    customer_ids = {data['customer_id'] for _, data in valid if data.get('customer_id')}
+    emails = {
+        data['customer_email'].lower() for _, data in valid
+        if not data.get('customer_id') and data.get('customer_email')
+    }
+    known_customers = set()
+    by_email = {}
+    if customer_ids or emails:
+        users = (
+            get_user_model().objects.annotate(email_lower=Lower('email'))
+            .filter(Q(id__in=customer_ids) | Q(email_lower__in=emails))
+            .order_by('id').values_list('id', 'email_lower')
+        )
+        for user_id, email in users:
+            known_customers.add(user_id)
+            by_email.setdefault(email, user_id)  # emails aren't unique; oldest account wins
+    driver_ids = {data['driver_id'] for _, data in valid if data.get('driver_id')}
+    known_drivers = set(Driver.objects.filter(id__in=driver_ids).values_list('id', flat=True)) if driver_ids else set()
+
+    rows, errors = [], []
+    for line, data in valid:
+        customer_id = data.pop('customer_id', None)
+        email = data.pop('customer_email', '')
+        if customer_id:
+            if customer_id not in known_customers:
+                errors.append((line, {'customer_id': [f'Invalid pk "{customer_id}" - object does not exist.']}))
+                continue
+        else:
+            customer_id = by_email.get(email.lower())
+            if customer_id is None:
+                errors.append((line, {'customer_email': [f'No user with email {email}.']}))
+                continue
+        driver_id = data.get('driver_id')
+        if driver_id and driver_id not in known_drivers:
+            errors.append((line, {'driver_id': [f'Invalid pk "{driver_id}" - object does not exist.']}))
+            continue
+        data['customer_id'] = customer_id
+        rows.append((line, data))
+    return rows, errors
+
+
+def backdate_created_at(requests, stamps):
+    """Apply historical created_at values after bulk_create (the field is auto_now_add).
+
+    One parameterised UPDATE executed for the whole batch; bulk_update's
+    CASE expression costs more to build than the insert itself.
+    """
+    params = []
+    for laundry_request, stamp in zip(requests, stamps):
+        if stamp:
+            laundry_request.created_at = stamp
+            params.append((connection.ops.adapt_datetimefield_value(stamp), laundry_request.pk))
+    if params:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {connection.ops.quote_name(LaundryRequest._meta.db_table)} SET created_at = %s WHERE id = %s',
+                params,
+            )
+
+
+def import_batch(lines, actor=None, dry_run=False):
+    """Validate and insert one batch of (line_number, raw) pairs.
+
+    Returns (created, errors) with errors as [(line_number, detail)].
+    """
+    valid, errors = validate_lines(lines)
+    rows, missing = resolve_references(valid)
+    errors = sorted(errors + missing, key=lambda error: error[0])
+    if dry_run or not rows:
+        return len(rows), errors
+
+    stamps = [data.pop('created_at', None) for _, data in rows]
+    with transaction.atomic():
+        requests = LaundryRequest.objects.bulk_create([LaundryRequest(**data) for _, data in rows])
+        backdate_created_at(requests, stamps)
+        record_transitions(
+            [Transition(r.pk, '', r.status, None, r.driver_id, r.created_at) for r in requests],
+            actor=actor, source='import',
+        )
+    return len(requests), errors
+
+
+def import_lines(lines, batch_size=None, actor=None, dry_run=False, on_batch=None):
+    """Import (line_number, end_offset, raw) items, as yielded by read_lines().
+
+    `on_batch(BatchResult)` is called after each batch has committed.
+    Returns (created, failed, last_line). `batch_size` defaults to
+    REQUEST_IMPORT_BATCH_SIZE.
+    """
+    batch_size = batch_size or BATCH_SIZE.value
+    created = failed = last_line = 0
+    batch = []
+    offset = None
+
+    def flush():
+        nonlocal created, failed
+        batch_created, errors = import_batch(batch, actor=actor, dry_run=dry_run)
+        created += batch_created
+        failed += len(errors)
+        if on_batch:
+            on_batch(BatchResult(last_line, offset, batch_created, errors))
+        batch.clear()
+
+    for line, offset, raw in lines:
+        batch.append((line, raw))
+        last_line = line
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return created, failed, last_line
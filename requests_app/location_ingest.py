@@ -0,0 +1,215 @@
+"""Buffered ingestion of high-frequency driver location pings.
+
+Pings are accepted into an in-process buffer instead of being written one
+by one. Every DRIVER_LOCATION_FLUSH_SECONDS the buffer is flushed: the
+latest position of each driver is written with a single bulk UPDATE and
+every ping is appended to the DriverLocation history with a single bulk
+INSERT, and the new positions of tracked drivers are published with one
+more. Pings for drivers that have since been deleted are dropped, and a
+flush that fails (e.g. the database is locked) puts its pings back to be
+retried with the next one. Pings still in the buffer when a process dies
+are lost, which is acceptable for positions that are superseded seconds
+later.
+"""
+import atexit
+import datetime
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.db import close_old_connections, transaction
+
+from utils.conf import Setting
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = Setting('DRIVER_LOCATION_FLUSH_SECONDS', 5)
+KEEP_HISTORY = Setting('DRIVER_LOCATION_HISTORY', True)
+COORD_QUANTUM = Decimal('0.000001')
+# History rows kept across failed flushes before the oldest are dropped
+MAX_RETRY_HISTORY = 100000
+
+
+class LocationBuffer:
+    """Coalesces pings per driver and flushes them to the database in bulk"""
+
+    def __init__(self, flush_seconds=None, keep_history=None):
+        # None follows DRIVER_LOCATION_FLUSH_SECONDS / DRIVER_LOCATION_HISTORY as they are when used
+        self._flush_seconds = flush_seconds
+        self._keep_history = keep_history
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._latest = {}  # driver_id -> (lat, lng, recorded_at)
+        self._history = []  # [(driver_id, lat, lng, recorded_at)]
+        self._thread = None
+        self._stopped = threading.Event()
+        self.last_flush = time.monotonic()
+
+    @property
+    def flush_seconds(self):
+        return FLUSH_SECONDS.value if self._flush_seconds is None else self._flush_seconds
+
+    @property
+    def keep_history(self):
+        return KEEP_HISTORY.value if self._keep_history is None else self._keep_history
+
+    def add(self, driver_id, points):
+        """Buffer `points` ([(lat, lng, recorded_at)]) for one driver"""
+        with self._lock:
+            latest = self._latest.get(driver_id)
+            for lat, lng, recorded_at in points:
+                if latest is None or recorded_at >= latest[2]:
+                    latest = (lat, lng, recorded_at)
+                if self.keep_history:
+                    self._history.append((driver_id, lat, lng, recorded_at))
+            self._latest[driver_id] = latest
+        self._ensure_flusher()
+
+    def pending(self):
+        with self._lock:
+            return len(self._latest), len(self._history)
+
+    def flush(self):
+        """Write buffered positions; returns (drivers_updated, history_rows)"""
+        from .models import Driver, DriverLocation
+        from .spatial import move_driver
+        from utils.events import publish_driver_positions
+
+        with self._flush_lock:
+            with self._lock:
+                latest, self._latest = self._latest, {}
+                history, self._history = self._history, []
+                self.last_flush = time.monotonic()
+            if not latest:
+                return 0, 0
+            try:
+                existing = set(Driver.objects.filter(pk__in=latest).values_list('id', flat=True))
+                if len(existing) < len(latest):
+                    latest, history = self._drop_deleted(existing, latest, history)
+                    if not latest:
+                        return 0, 0
+                drivers = [
+                    Driver(pk=driver_id, latitude=lat, longitude=lng, last_location_update=recorded_at)
+                    for driver_id, (lat, lng, recorded_at) in latest.items()
+                ]
+                with transaction.atomic():
+                    # One UPDATE ... CASE statement touching only the position columns
+                    Driver.objects.bulk_update(drivers, ['latitude', 'longitude', 'last_location_update'])
+                    if history:
+                        DriverLocation.objects.bulk_create(
+                            [DriverLocation(driver_id=driver_id, latitude=lat, longitude=lng, recorded_at=recorded_at)
+                             for driver_id, lat, lng, recorded_at in history],
+                            batch_size=1000,
+                        )
+                    # One INSERT for all tracked drivers' positions
+                    publish_driver_positions(
+                        (driver_id, lat, lng, recorded_at) for driver_id, (lat, lng, recorded_at) in latest.items()
+                    )
+            except Exception:
+                logger.exception('Failed to flush %s driver locations; retrying with the next flush', len(latest))
+                self._requeue(latest, history)
+                return 0, 0
+            for driver_id, (lat, lng, _) in latest.items():
+                move_driver(driver_id, lat, lng)
+            return len(drivers), len(history)
+
+    def _drop_deleted(self, existing, latest, history):
+        missing = set(latest) - existing
+        logger.warning('Dropping location pings for deleted driver(s) %s', sorted(missing))
+        # Forget memoised ids so a re-created driver profile is looked up again
+        for user_id, driver_id in list(_driver_ids.items()):
+            if driver_id in missing:
+                _driver_ids.pop(user_id, None)
+        latest = {driver_id: position for driver_id, position in latest.items() if driver_id in existing}
+        history = [row for row in history if row[0] in existing]
+        return latest, history
+
+    def _requeue(self, latest, history):
+        """Merge a failed flush back in, keeping any newer position buffered since"""
+        with self._lock:
+            for driver_id, position in latest.items():
+                current = self._latest.get(driver_id)
+                if current is None or position[2] > current[2]:
+                    self._latest[driver_id] = position
+            self._history = (history + self._history)[-MAX_RETRY_HISTORY:]
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='driver-location-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_seconds):
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception('Driver location flusher failed')
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+
+buffer = LocationBuffer()
+atexit.register(buffer.flush)
+
+
+_driver_ids = {}
+
+
+def driver_id_for_user(user):
+    """Driver id for `user`, memoised per process so pings don't cost a lookup"""
+    from .models import Driver
+
+    driver_id = _driver_ids.get(user.pk)
+    if driver_id is None:
+        driver_id = Driver.objects.filter(user=user).values_list('id', flat=True).first()
+        if driver_id is not None:
+            _driver_ids[user.pk] = driver_id
+    return driver_id
+
+
+def parse_points(data, max_points=100):
+    """Validate a ping payload into [(lat, lng, recorded_at)].
+
+    Accepts either {"points": [...]} or a single point object. Each point has
+    latitude/longitude (or lat/lng) and an optional ISO-8601 recorded_at.
+    Raises ValueError with a client-facing message on bad input.
+    """
+    from django.utils import timezone
+    from django.utils.dateparse import parse_datetime
+
+    raw = data.get('points') if isinstance(data, dict) and 'points' in data else [data]
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('points must be a non-empty list')
+    if len(raw) > max_points:
+        raise ValueError(f'At most {max_points} points per request')
+    now = timezone.now()
+    points = []
+    for i, point in enumerate(raw):
+        if not isinstance(point, dict):
+            raise ValueError(f'points[{i}] must be an object')
+        try:
+            lat = Decimal(str(point.get('latitude', point.get('lat')))).quantize(COORD_QUANTUM)
+            lng = Decimal(str(point.get('longitude', point.get('lng')))).quantize(COORD_QUANTUM)
+        except Exception:
+            raise ValueError(f'points[{i}] needs numeric latitude and longitude')
+        if not (lat.is_finite() and lng.is_finite()) or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError(f'points[{i}] is out of range')
+        recorded_at = now
+        if point.get('recorded_at'):
+            recorded_at = parse_datetime(str(point['recorded_at']))
+            if recorded_at is None:
+                raise ValueError(f'points[{i}].recorded_at is not an ISO-8601 datetime')
+            if timezone.is_naive(recorded_at):
+                recorded_at = timezone.make_aware(recorded_at, datetime.timezone.utc)
+            # Don't let a skewed device clock move positions into the future
+            recorded_at = min(recorded_at, now)
+        points.append((lat, lng, recorded_at))
+    return points
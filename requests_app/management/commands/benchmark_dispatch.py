@@ -0,0 +1,51 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from requests_app.dispatch import candidate_costs, plan_assignments
+
+
+class Command(BaseCommand):
+    help = ('Time plan_assignments on synthetic fleets of growing size, split into the nearest-driver '
+            'candidate search and the min-cost matching. Touches no database rows.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,500,1000,2000,5000', help='Comma-separated driver counts')
+        parser.add_argument('--requests-per-driver', type=float, default=1.5,
+                            help='Pending requests generated per driver')
+        parser.add_argument('--slots', type=int, default=1, help='Free slots per driver')
+        parser.add_argument('--spread', type=float, default=0.3, help='Degrees of lat/lng the city spans')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per size')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        self.stdout.write(f'{"drivers":>8} {"requests":>9} {"assigned":>9} {"mean km":>8} '
+                          f'{"candidates":>11} {"matching":>11} {"total":>11}')
+        for size in (int(value) for value in options['sizes'].split(',')):
+            rng = random.Random(size)
+            spread = options['spread']
+
+            def position():
+                return 6.45 + rng.uniform(0, spread), 3.35 + rng.uniform(0, spread)
+
+            drivers = {driver_id: (*position(), options['slots']) for driver_id in range(size)}
+            requests = [
+                (request_id, *position(), now + timedelta(minutes=rng.randint(0, 120)) if rng.random() < 0.5 else None)
+                for request_id in range(int(size * options['requests_per_driver']))
+            ]
+            search, total = [], []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                candidate_costs(requests, drivers, now)
+                search.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                plan = plan_assignments(requests, drivers, now)
+                total.append(time.perf_counter() - started)
+            search, total = statistics.median(search) * 1000, statistics.median(total) * 1000
+            mean_km = statistics.mean(a.distance_km for a in plan) if plan else 0
+            self.stdout.write(f'{size:>8} {len(requests):>9} {len(plan):>9} {mean_km:>8.2f} '
+                              f'{search:>8.1f} ms {max(total - search, 0):>8.1f} ms {total:>8.1f} ms')
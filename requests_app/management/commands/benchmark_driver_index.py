@@ -0,0 +1,54 @@
+import heapq
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from requests_app.spatial import DriverGridIndex, haversine_km
+
+
+def full_scan(drivers, lat, lng, k):
+    """The naive k-nearest query: distance to every driver"""
+    return heapq.nsmallest(k, ((haversine_km(lat, lng, dlat, dlng), driver_id)
+                               for driver_id, (dlat, dlng) in drivers.items()))
+
+
+class Command(BaseCommand):
+    help = ('Time k-nearest driver queries on the grid index against a full scan, for a dense city '
+            'fleet and for drivers spread over the globe. Touches no database rows.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated driver counts')
+        parser.add_argument('--queries', type=int, default=200, help='Queries timed per size and layout')
+        parser.add_argument('--k', type=int, default=5, help='Drivers returned per query')
+
+    def handle(self, *args, **options):
+        k, count = options['k'], options['queries']
+        layouts = {
+            # Lagos-sized city, half a degree across
+            'city': lambda rng: (6.5 + rng.uniform(-0.25, 0.25), 3.4 + rng.uniform(-0.25, 0.25)),
+            'global': lambda rng: (rng.uniform(-60, 60), rng.uniform(-180, 180)),
+        }
+        self.stdout.write(f'{"layout":<8} {"drivers":>8} {"grid":>12} {"full scan":>12} {"speedup":>8}')
+        for layout, position in layouts.items():
+            for size in (int(value) for value in options['sizes'].split(',')):
+                rng = random.Random(size)
+                drivers = {driver_id: position(rng) for driver_id in range(size)}
+                index = DriverGridIndex()
+                for driver_id, (lat, lng) in drivers.items():
+                    index.update(driver_id, lat, lng)
+                points = [position(rng) for _ in range(count)]
+
+                started = time.perf_counter()
+                grid = [index.nearest(lat, lng, k=k) for lat, lng in points]
+                grid_us = (time.perf_counter() - started) / count * 1e6
+                started = time.perf_counter()
+                scan = [full_scan(drivers, lat, lng, k) for lat, lng in points]
+                scan_us = (time.perf_counter() - started) / count * 1e6
+
+                mismatches = sum(
+                    [round(d, 9) for d, _ in a] != [round(d, 9) for d, _ in b] for a, b in zip(grid, scan)
+                )
+                self.stdout.write(f'{layout:<8} {size:>8} {grid_us:>9.1f} us {scan_us:>9.1f} us '
+                                  f'{scan_us / grid_us:>7.0f}x'
+                                  + (f'  ({mismatches} mismatched results)' if mismatches else ''))
@@ -0,0 +1,82 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from requests_app.location_ingest import LocationBuffer, parse_points
+from requests_app.models import Driver, DriverLocation
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Measure driver location pings/second through the buffered ingest path (parse, buffer, '
+            'bulk flush) against writing each ping as it arrives. Runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=500, help='Drivers sending pings')
+        parser.add_argument('--pings', type=int, default=50000, help='Pings sent through the buffered path')
+        parser.add_argument('--direct-pings', type=int, default=2000,
+                            help='Pings written one by one for the baseline (it is much slower)')
+        parser.add_argument('--points-per-request', type=int, default=1, help='Points in each ping payload')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write('Rolled back the benchmark rows')
+
+    def run(self, options):
+        rng = random.Random(0)
+        drivers = Driver.objects.bulk_create([Driver(name=f'Bench {i}') for i in range(options['drivers'])])
+        driver_ids = [driver.pk for driver in drivers]
+        base = timezone.now() - timedelta(hours=1)
+        per_request = options['points_per_request']
+
+        def payload(i):
+            return {'points': [
+                {'latitude': 6.4 + rng.random() / 10, 'longitude': 3.3 + rng.random() / 10,
+                 'recorded_at': (base + timedelta(milliseconds=i * per_request + j)).isoformat()}
+                for j in range(per_request)
+            ]}
+
+        # Baseline: one UPDATE and one INSERT per ping, as the request path did before buffering
+        count = options['direct_pings'] // per_request
+        started = time.perf_counter()
+        for i in range(count):
+            for lat, lng, recorded_at in parse_points(payload(i)):
+                driver_id = driver_ids[i % len(driver_ids)]
+                Driver.objects.filter(pk=driver_id).update(
+                    latitude=lat, longitude=lng, last_location_update=recorded_at)
+                DriverLocation.objects.create(driver_id=driver_id, latitude=lat, longitude=lng,
+                                              recorded_at=recorded_at)
+        direct = time.perf_counter() - started
+        self.report('write per ping', count * per_request, direct)
+
+        # The flusher thread would write on its own connection, outside this
+        # transaction, so keep it asleep and flush by hand
+        buffer = LocationBuffer(flush_seconds=3600)
+        count = options['pings'] // per_request
+        payloads = [payload(i) for i in range(count)]
+        started = time.perf_counter()
+        for i, data in enumerate(payloads):
+            buffer.add(driver_ids[i % len(driver_ids)], parse_points(data))
+        ingest = time.perf_counter() - started
+        started = time.perf_counter()
+        updated, history = buffer.flush()
+        flush = time.perf_counter() - started
+        buffer._stopped.set()
+
+        self.report('buffered ingest (request path)', count * per_request, ingest)
+        self.stdout.write(f'{"flush":<32} {flush * 1000:10.1f} ms for {updated} drivers, {history} history rows')
+        self.report('buffered ingest + flush', count * per_request, ingest + flush)
+
+    def report(self, label, pings, seconds):
+        self.stdout.write(f'{label:<32} {pings / seconds:10.0f} pings/s ({pings} pings in {seconds:.2f}s)')
@@ -0,0 +1,88 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from requests_app import pricing_cache
+from requests_app.models import PricingItem
+from requests_app.serializers import PricingItemSerializer
+from requests_app.views import PricingAPIView
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _UncachedPricingView(PricingAPIView):
+    """GET /api/pricing/ before the cache: query and serialize on every request"""
+
+    def get(self, request):
+        return Response(PricingItemSerializer(PricingItem.objects.order_by('ordering', 'slug'), many=True).data)
+
+
+class Command(BaseCommand):
+    help = ('Compare queries and latency of GET /api/pricing/ when serialized on every request, '
+            'cold (both cache tiers empty), warm, and revalidated with If-None-Match (304). '
+            'Runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=50, help='Pricing items in the catalog')
+        parser.add_argument('--requests', type=int, default=2000, help='Timed requests per mode')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['items'], options['requests'])
+                raise _Rollback
+        except _Rollback:
+            pricing_cache._local_entry = None
+            self.stdout.write('Rolled back the benchmark rows')
+
+    def run(self, item_count, count):
+        PricingItem.objects.all().delete()
+        PricingItem.objects.bulk_create([
+            PricingItem(slug=f'bench-{i}', label=f'Benchmark item {i}', price=Decimal('9.99'),
+                        description='Benchmark pricing item ' * 4, icon='*', ordering=i)
+            for i in range(item_count)
+        ])
+        pricing_cache.invalidate_pricing()
+
+        factory = APIRequestFactory()
+        view = PricingAPIView.as_view()
+        etag = pricing_cache.get_pricing()['etag']
+
+        def empty_caches():
+            pricing_cache._local_entry = None
+            cache.delete(pricing_cache.PAYLOAD_KEY.format(pricing_cache.current_version(pricing_cache.VERSION_NAME)))
+
+        modes = [
+            ('serialize every time', _UncachedPricingView.as_view(), None, {}, 200),
+            ('cold', view, empty_caches, {}, 200),
+            ('warm', view, None, {}, 200),
+            ('If-None-Match (304)', view, None, {'HTTP_IF_NONE_MATCH': etag}, 304),
+        ]
+        self.stdout.write(f'{"mode":<22} {"queries/request":>16} {"median":>10} {"bytes":>8}')
+        for label, handler, reset, headers, expected in modes:
+            timings = []
+            queries = 0
+            for _ in range(count):
+                if reset:
+                    reset()
+                request = factory.get('/api/pricing/', **headers)
+                reset_queries()  # the query log is capped, so keep it short
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = handler(request)
+                    response.render()
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries += len(captured.captured_queries)
+                if response.status_code != expected:
+                    raise CommandError(f'{label}: expected {expected}, got {response.status_code}')
+            self.stdout.write(f'{label:<22} {queries / count:>16.2f} {statistics.median(timings):>7.3f} ms '
+                              f'{len(response.content):>8}')
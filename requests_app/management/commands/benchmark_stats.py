@@ -0,0 +1,135 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from requests_app.importer import backdate_created_at
+from requests_app.models import Driver, LaundryRequest, RequestRollup, RequestStatusEvent
+from requests_app.rollups import reset_rollups, rollup_all
+from requests_app.views import StatsAPIView
+from users.models import User
+
+SERVICE_TYPES = [choice for choice, _ in LaundryRequest._meta.get_field('service_type').choices]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Grow the request table in steps and time GET /api/stats/ (served from the rollups) at each '
+            'size, next to the same 24h summary aggregated straight from the event log. The stats cost '
+            'follows the rollup rows in range (buckets x service types x drivers), not the table size. '
+            'Runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='2000,50000,200000', help='Comma-separated request counts')
+        parser.add_argument('--days', type=int, default=30, help='Spread requests over this many days')
+        parser.add_argument('--drivers', type=int, default=20)
+        parser.add_argument('--calls', type=int, default=20, help='Timed calls per size and range')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write('Rolled back the benchmark rows')
+
+    def run(self, options):
+        rng = random.Random(23)
+        admin = User.objects.create_user('stats-bench-admin', 'stats-bench@example.com', is_staff=True)
+        customer = User.objects.create_user('stats-bench-customer', 'stats-bench-customer@example.com')
+        drivers = Driver.objects.bulk_create([Driver(name=f'Benchmark driver {i}') for i in range(options['drivers'])])
+        reset_rollups()
+
+        factory = APIRequestFactory()
+        view = StatsAPIView.as_view()
+        now = timezone.now()
+        # Everything is older than the rollup settle delay
+        newest = now - timedelta(minutes=5)
+        span = timedelta(days=options['days']).total_seconds()
+        ranges = [
+            ('hour', now - timedelta(days=1)),
+            ('day', now - timedelta(days=options['days'])),
+        ]
+
+        def call(period, since):
+            request = factory.get('/api/stats/', {'period': period, 'since': since.isoformat()})
+            force_authenticate(request, user=admin)
+            response = view(request)
+            if response.status_code != 200:
+                raise CommandError(f'/api/stats/ returned {response.status_code}')
+            response.render()
+            return response
+
+        def from_event_log(period, since):
+            return list(
+                RequestStatusEvent.objects.filter(created_at__gte=since)
+                .values('to_status', 'request__service_type', 'driver_id').annotate(n=Count('id'))
+            )
+
+        self.stdout.write(f'{"requests":>9} {"events":>9} {"rollup events/s":>16} '
+                          f'{"stats 24h":>12} {"stats 30d":>12} {"rows 30d":>9} {"event log 24h":>14} {"queries":>8}')
+        total = 0
+        for size in (int(value) for value in options['sizes'].split(',')):
+            if size <= total:
+                continue
+            events = self.add_requests(size - total, customer, drivers, newest, span, rng)
+            total = size
+            started = time.perf_counter()
+            processed = rollup_all()
+            rate = processed / (time.perf_counter() - started)
+            if processed != events:
+                raise CommandError(f'Rolled up {processed} of {events} events')
+
+            timings = {}
+            queries = 0
+            for label, target in (('hour', call), ('day', call), ('log', from_event_log)):
+                period, since = ranges[0] if label != 'day' else ranges[1]
+                samples = []
+                for _ in range(options['calls']):
+                    reset_queries()  # the query log is capped, so keep it short
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        target(period, since)
+                        samples.append((time.perf_counter() - started) * 1000)
+                    if label == 'hour':
+                        queries = len(captured.captured_queries)
+                timings[label] = statistics.median(samples)
+            rows = RequestRollup.objects.filter(period='day', bucket_start__gte=ranges[1][1] - timedelta(days=1)).count()
+            self.stdout.write(f'{total:>9} {RequestStatusEvent.objects.count():>9} {rate:>16.0f} '
+                              f'{timings["hour"]:>9.2f} ms {timings["day"]:>9.2f} ms {rows:>9} '
+                              f'{timings["log"]:>11.2f} ms {queries:>8}')
+
+    def add_requests(self, count, customer, drivers, newest, span, rng):
+        """Insert `count` requests with created/assigned/(completed|cancelled) events; returns events added"""
+        stamps = [newest - timedelta(seconds=rng.uniform(0, span)) for _ in range(count)]
+        requests = LaundryRequest.objects.bulk_create([
+            LaundryRequest(customer=customer, customer_name='Benchmark', phone='1', address='1 Road',
+                           service_type=rng.choice(SERVICE_TYPES), driver=rng.choice(drivers), status='completed')
+            for _ in range(count)
+        ], batch_size=2000)
+        backdate_created_at(requests, stamps)
+
+        events = []
+        for laundry_request, created_at in zip(requests, stamps):
+            assigned_at = min(newest, created_at + timedelta(minutes=rng.uniform(1, 30)))
+            closed_at = min(newest, assigned_at + timedelta(minutes=rng.uniform(20, 240)))
+            final = 'completed' if rng.random() < 0.9 else 'cancelled'
+            events += [
+                RequestStatusEvent(request=laundry_request, from_status='', to_status='pending', created_at=created_at),
+                RequestStatusEvent(request=laundry_request, from_status='pending', to_status='assigned',
+                                   driver_id=laundry_request.driver_id, created_at=assigned_at),
+                RequestStatusEvent(request=laundry_request, from_status='assigned', to_status=final,
+                                   driver_id=laundry_request.driver_id, created_at=closed_at),
+            ]
+        RequestStatusEvent.objects.bulk_create(events, batch_size=2000)
+        return len(events)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from requests_app.models import LaundryRequest
+from utils.export import OUTPUTS, REQUEST_COLUMNS, export_stream, filter_requests, write_export
+
+
+class Command(BaseCommand):
+    help = 'Stream laundry requests as CSV or NDJSON to a file or stdout, in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=OUTPUTS, default='csv', help='Export format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the export with gzip')
+        parser.add_argument('--file', default='-', help='Destination path ("-" for stdout)')
+        parser.add_argument('--since', help='Only requests created at or after this ISO date/datetime')
+        parser.add_argument('--until', help='Only requests created at or before this ISO date/datetime')
+        parser.add_argument('--status', help='Comma-separated statuses to include')
+        parser.add_argument('--driver', help='Driver id, or "none" for unassigned requests')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per query')
+
+    def handle(self, *args, **options):
+        try:
+            queryset = filter_requests(
+                LaundryRequest.objects.all(), since=options['since'], until=options['until'],
+                status=options['status'], driver=options['driver'],
+            )
+            stream = export_stream(queryset, REQUEST_COLUMNS, output=options['output'],
+                                   compress=options['gzip'], chunk_size=options['chunk_size'])
+            write_export(stream, options['file'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
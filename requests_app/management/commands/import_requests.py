@@ -0,0 +1,78 @@
+import gzip
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from requests_app.importer import BATCH_SIZE, import_lines, read_lines
+
+
+class Command(BaseCommand):
+    help = 'Load laundry requests from an NDJSON file (one request per line), in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='NDJSON file, optionally .gz ("-" for stdin)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE.value,
+                            help='Lines validated and inserted per transaction')
+        parser.add_argument('--checkpoint', metavar='PATH',
+                            help='Record progress here after every batch and resume from it when it exists')
+        parser.add_argument('--start-line', type=int, default=0,
+                            help='Skip this many lines first (ignored when resuming from a checkpoint)')
+        parser.add_argument('--errors', metavar='PATH',
+                            help='Write rejected lines as NDJSON {"line", "errors"} instead of to stderr')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only; write nothing')
+
+    def handle(self, *args, **options):
+        path = options['file']
+        checkpoint = options['checkpoint']
+        line = offset = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as fh:
+                state = json.load(fh)
+            line, offset = state['line'], state['offset']
+            self.stdout.write(f'Resuming after line {line}')
+
+        if path == '-':
+            if offset:
+                raise CommandError('Cannot resume from a checkpoint when reading stdin')
+            stream = sys.stdin.buffer
+        else:
+            try:
+                stream = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+            except OSError as exc:
+                raise CommandError(str(exc))
+            stream.seek(offset)
+        lines = read_lines(stream, line=line, offset=offset)
+        if not offset and options['start_line']:
+            lines = (item for item in lines if item[0] > options['start_line'])
+
+        error_file = open(options['errors'], 'a') if options['errors'] else None
+
+        def on_batch(result):
+            for error_line, detail in result.errors:
+                if error_file:
+                    error_file.write(json.dumps({'line': error_line, 'errors': detail}) + '\n')
+                else:
+                    self.stderr.write(f'line {error_line}: {json.dumps(detail)}')
+            if checkpoint and not options['dry_run']:
+                with open(checkpoint + '.tmp', 'w') as fh:
+                    json.dump({'line': result.last_line, 'offset': result.offset}, fh)
+                os.replace(checkpoint + '.tmp', checkpoint)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'... line {result.last_line}: {result.created} created, {len(result.errors)} rejected')
+
+        try:
+            created, failed, last_line = import_lines(
+                lines, batch_size=options['batch_size'], dry_run=options['dry_run'], on_batch=on_batch,
+            )
+        except KeyboardInterrupt:
+            raise CommandError('Import interrupted; committed batches are kept'
+                               + (', rerun to resume from the checkpoint' if checkpoint else ''))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+            if error_file:
+                error_file.close()
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(f'{verb} {created} request(s); rejected {failed} line(s); read through line {last_line or line}')
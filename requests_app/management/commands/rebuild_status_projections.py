@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from requests_app.timeline import rebuild_projections
+
+
+class Command(BaseCommand):
+    help = 'Recompute status counts, driver loads and time-in-state histograms from requests and the status event log'
+
+    def handle(self, *args, **options):
+        statuses, drivers, buckets = rebuild_projections()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt projections: {statuses} status count(s), {drivers} driver load(s), {buckets} histogram bucket(s)'
+        ))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from requests_app.rollups import reset_rollups, rollup_all
+
+
+class Command(BaseCommand):
+    help = 'Fold new request status events into the hourly/daily rollups served by /api/stats/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Events processed per transaction')
+        parser.add_argument('--loop', type=float, default=None, metavar='SECONDS',
+                            help='Keep running, rolling up new events every SECONDS')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Discard existing rollups and rebuild them from the whole event log')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            reset_rollups()
+            self.stdout.write('Rollups cleared; rebuilding from the event log')
+        try:
+            while True:
+                close_old_connections()
+                processed = rollup_all(batch_size=options['batch_size'])
+                if processed or options['loop'] is None:
+                    self.stdout.write(f'Rolled up {processed} event(s)')
+                if options['loop'] is None:
+                    break
+                time.sleep(options['loop'])
+        except KeyboardInterrupt:
+            self.stdout.write('Rollup loop stopped')
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from requests_app.dispatch import run_dispatch_cycle
+from utils.events import get_broker
+
+
+class Command(BaseCommand):
+    help = 'Automatically assign pending laundry requests to the nearest available drivers in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help='Seconds between dispatch cycles')
+        parser.add_argument('--once', action='store_true',
+                            help='Run a single cycle and exit (useful for cron)')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Maximum number of pending requests considered per cycle')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the planned assignments without saving them')
+
+    def handle(self, *args, **options):
+        if not get_broker().cross_process:
+            self.stderr.write(self.style.WARNING(
+                f'EVENT_BROKER {settings.EVENT_BROKER} only delivers within this process; '
+                'events published here will not reach stream clients'
+            ))
+        try:
+            while True:
+                close_old_connections()
+                started = time.perf_counter()
+                pending, plan, committed = run_dispatch_cycle(limit=options['limit'], dry_run=options['dry_run'])
+                elapsed = (time.perf_counter() - started) * 1000
+                if options['dry_run']:
+                    for a in plan:
+                        self.stdout.write(f'request {a.request_id} -> driver {a.driver_id} ({a.distance_km:.2f} km)')
+                if pending:
+                    self.stdout.write(
+                        f'Dispatch cycle: {pending} pending, {len(plan)} planned, '
+                        f'{len(committed)} assigned in {elapsed:.0f} ms'
+                    )
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Dispatcher stopped')
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0004_pricingitem'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='laundryrequest',
+            index=models.Index(fields=['created_at', 'id'], name='requests_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='laundryrequest',
+            index=models.Index(fields=['customer', 'created_at'], name='requests_customer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='laundryrequest',
+            index=models.Index(fields=['driver', 'created_at'], name='requests_driver_created_idx'),
+        ),
+    ]
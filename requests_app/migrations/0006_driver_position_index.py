@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0005_laundryrequest_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='driver',
+            index=models.Index(fields=['is_available', 'latitude', 'longitude'], name='driver_available_pos_idx'),
+        ),
+    ]
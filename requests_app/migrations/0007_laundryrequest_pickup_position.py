@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0006_driver_position_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='laundryrequest',
+            name='pickup_latitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='laundryrequest',
+            name='pickup_longitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='laundryrequest',
+            index=models.Index(fields=['status', 'created_at'], name='requests_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+ACTIVE_STATUSES = ('assigned', 'picked_up', 'in_progress')
+
+
+def seed_projections(apps, schema_editor):
+    """Start the status counts and driver loads from the existing requests"""
+    LaundryRequest = apps.get_model('requests_app', 'LaundryRequest')
+    RequestStatusCount = apps.get_model('requests_app', 'RequestStatusCount')
+    DriverLoad = apps.get_model('requests_app', 'DriverLoad')
+    RequestStatusCount.objects.bulk_create([
+        RequestStatusCount(status=row['status'], count=row['n'])
+        for row in LaundryRequest.objects.order_by().values('status').annotate(n=models.Count('id'))
+    ])
+    DriverLoad.objects.bulk_create([
+        DriverLoad(driver_id=row['driver'], active=row['n'])
+        for row in LaundryRequest.objects.filter(status__in=ACTIVE_STATUSES, driver__isnull=False)
+        .order_by().values('driver').annotate(n=models.Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0008_driverlocation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=20, unique=True)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DriverLoad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('active', models.IntegerField(default=0)),
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='load', to='requests_app.driver')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatusDurationBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=20)),
+                ('upper_seconds', models.PositiveIntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('status', 'upper_seconds'), name='status_duration_bucket_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RequestStatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, max_length=20)),
+                ('to_status', models.CharField(max_length=20)),
+                ('source', models.CharField(blank=True, max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('driver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='requests_app.driver')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_events', to='requests_app.laundryrequest')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['request', 'created_at'], name='status_event_request_idx')],
+            },
+        ),
+        migrations.RunPython(seed_projections, migrations.RunPython.noop),
+    ]
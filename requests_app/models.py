@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class Driver(models.Model):
@@ -17,10 +18,48 @@ class Driver(models.Model):
     is_available = models.BooleanField(default=True)
     last_location_update = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Bounding-box prefilter for the nearest-driver fallback query
+        indexes = [
+            models.Index(fields=['is_available', 'latitude', 'longitude'], name='driver_available_pos_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class DriverLocation(models.Model):
+    """Append-only history of driver positions, used for route replay.
+
+    Written in bulk by the location ingestion buffer (see location_ingest.py).
+    """
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='locations')
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    recorded_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', 'recorded_at'], name='driverlocation_replay_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.driver_id} @ {self.latitude},{self.longitude} ({self.recorded_at})"
+
+
+class LaundryRequestQuerySet(models.QuerySet):
+    def compare_and_set(self, pk, expected, **changes):
+        """Atomically apply `changes` to one request if it still matches `expected`.
+
+        Issues a single `UPDATE ... SET <changes> WHERE id=<pk> AND <expected>`
+        touching only the given columns, so concurrent writers can neither
+        both win a transition nor overwrite each other's unrelated fields.
+        Returns True if this caller's update was applied.
+        """
+        changes.setdefault('updated_at', timezone.now())
+        return self.filter(pk=pk, **expected).update(**changes) == 1
+
+
 class LaundryRequest(models.Model):
     STATUS_CHOICES = [
         ("pending", "Pending"),
@@ -30,6 +69,15 @@ class LaundryRequest(models.Model):
         ("completed", "Completed"),
         ("cancelled", "Cancelled"),
     ]
+
+    # Status changes a driver (or staff) may make through update_status
+    STATUS_TRANSITIONS = {
+        'assigned': ('picked_up', 'cancelled'),
+        'picked_up': ('in_progress',),
+        'in_progress': ('completed',),
+    }
+    # Statuses from which a driver can be (re)assigned
+    ASSIGNABLE_STATUSES = ('pending', 'assigned')
     
     SERVICE_TYPE_CHOICES = [
         ("shirt_ironing", "Shirt Ironing"),
@@ -50,6 +98,13 @@ class LaundryRequest(models.Model):
     customer_name = models.CharField(max_length=150)
     phone = models.CharField(max_length=30, blank=True)
     address = models.TextField()
+    # Optional pickup coordinates; requests with a position can be auto-dispatched
+    pickup_latitude = models.DecimalField(
+        max_digits=9, decimal_places=6, null=True, blank=True
+    )
+    pickup_longitude = models.DecimalField(
+        max_digits=9, decimal_places=6, null=True, blank=True
+    )
     pickup_time = models.DateTimeField(null=True, blank=True)
     items_description = models.TextField(blank=True)
     service_type = models.CharField(max_length=30, choices=SERVICE_TYPE_CHOICES, default="full_home_service")
@@ -58,10 +113,129 @@ class LaundryRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = LaundryRequestQuerySet.as_manager()
+
+    class Meta:
+        # Support the (created_at, id) keyset pagination used by the list endpoints
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='requests_created_idx'),
+            models.Index(fields=['customer', 'created_at'], name='requests_customer_created_idx'),
+            models.Index(fields=['driver', 'created_at'], name='requests_driver_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='requests_status_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.customer_name} - {self.status}"
 
 
+class RequestStatusEvent(models.Model):
+    """Append-only log of a request's status and driver changes.
+
+    Written in the same transaction as the change by timeline.record_transitions(),
+    which also maintains the projections below.
+    """
+    request = models.ForeignKey(LaundryRequest, on_delete=models.CASCADE, related_name='status_events')
+    from_status = models.CharField(max_length=20, blank=True)
+    to_status = models.CharField(max_length=20)
+    driver = models.ForeignKey(Driver, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    source = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['request', 'created_at'], name='status_event_request_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.request_id}: {self.from_status or '-'} -> {self.to_status}"
+
+
+class RequestStatusCount(models.Model):
+    """Projection: number of requests currently in each status"""
+    status = models.CharField(max_length=20, unique=True)
+    count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.status}: {self.count}"
+
+
+class DriverLoad(models.Model):
+    """Projection: number of active (assigned/picked up/in progress) requests per driver"""
+    driver = models.OneToOneField(Driver, on_delete=models.CASCADE, related_name='load')
+    active = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.driver_id}: {self.active}"
+
+
+class StatusDurationBucket(models.Model):
+    """Projection: histogram of how long requests stayed in each status.
+
+    `upper_seconds` is the bucket's inclusive upper bound; 0 is the overflow bucket.
+    """
+    status = models.CharField(max_length=20)
+    upper_seconds = models.PositiveIntegerField()
+    count = models.BigIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['status', 'upper_seconds'], name='status_duration_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.status} <= {self.upper_seconds or 'inf'}s: {self.count}"
+
+
+class RequestRollup(models.Model):
+    """Pre-aggregated request metrics per hour or day.
+
+    Built incrementally from RequestStatusEvent by rollups.py. `created`
+    rows carry the request's service type with no driver; completion and
+    cancellation rows also carry the driver, so per-driver and
+    per-service-type totals are sums over a bucket range.
+    """
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    service_type = models.CharField(max_length=30, blank=True)
+    driver = models.ForeignKey(Driver, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    # Sum of pending -> completed durations of the completions in this bucket
+    lead_time_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        # One row per (period, bucket_start, service_type, driver); rollup runs
+        # are serialised on the watermark row, so no unique constraint is
+        # needed (and a nullable driver would defeat one on most backends)
+        indexes = [
+            models.Index(fields=['period', 'bucket_start'], name='request_rollup_range_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket_start:%Y-%m-%d %H:%M} {self.service_type or '-'}"
+
+
+class RollupWatermark(models.Model):
+    """Id of the last RequestStatusEvent folded into the rollups"""
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_event_id}"
+
+
 class PricingItem(models.Model):
     """Stores pricing for a single service type. The `slug` corresponds to client-side ids."""
     slug = models.CharField(max_length=100, unique=True)
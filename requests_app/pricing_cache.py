@@ -0,0 +1,71 @@
+"""Two-tier cache for the public pricing payload.
+
+The serialized price list is cached per process and in Django's cache
+framework (shared between workers when a shared backend is configured).
+Entries are keyed by a catalog version kept in the database
+(utils/cache_versions.py) and replaced in the transaction that changes
+pricing, so every worker stops serving the old payload as soon as an edit
+commits, whatever cache backend is configured. A read costs one indexed
+version lookup.
+"""
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from utils.cache_versions import bump_version, current_version, version_modified_at
+from utils.conf import Setting
+
+VERSION_NAME = 'pricing'
+PAYLOAD_KEY = 'pricing:payload:{}'
+# How long the shared tier keeps a payload; versions make expiry a safety net only
+CACHE_TIMEOUT = Setting('PRICING_CACHE_TIMEOUT', 24 * 60 * 60)
+
+# In-process tier: the last entry this process built or fetched
+_local_entry = None
+
+
+def _build_entry(version):
+    from .models import PricingItem
+    from .serializers import PricingItemSerializer
+
+    items = PricingItem.objects.all().order_by('ordering', 'slug')
+    payload = json.loads(json.dumps(PricingItemSerializer(items, many=True).data, cls=DjangoJSONEncoder))
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+    # Same Last-Modified from every process that builds this version
+    modified_at = version_modified_at(VERSION_NAME)
+    return {
+        'version': version,
+        'payload': payload,
+        'etag': f'"{digest[:32]}"',
+        'last_modified': int(modified_at.timestamp()) if modified_at else int(time.time()),
+    }
+
+
+def get_pricing():
+    """Return the cached pricing entry: payload, strong ETag and Last-Modified timestamp."""
+    version = current_version(VERSION_NAME)
+    global _local_entry
+    entry = _local_entry
+    if entry is not None and entry['version'] == version:
+        return entry
+
+    entry = cache.get(PAYLOAD_KEY.format(version))
+    if entry is None:
+        entry = _build_entry(version)
+        cache.set(PAYLOAD_KEY.format(version), entry, CACHE_TIMEOUT.value)
+    _local_entry = entry
+    return entry
+
+
+def invalidate_pricing():
+    """Bump the catalog version so every process rebuilds on its next read.
+
+    Call inside the transaction that changes pricing, so the new version
+    becomes visible together with the new rows.
+    """
+    global _local_entry
+    bump_version(VERSION_NAME)
+    _local_entry = None
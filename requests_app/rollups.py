@@ -0,0 +1,164 @@
+"""Hourly and daily request metrics rolled up from the status event log.
+
+`rollup_events()` reads RequestStatusEvent rows past a stored id watermark
+and adds them into RequestRollup buckets (requests created per service
+type, completions and cancellations per driver and service type, and
+pending -> completed lead time), so /api/stats/ only ever reads the small
+rollup table. Events younger than ROLLUP_SETTLE_SECONDS are left for the
+next run: ids are allocated before commit, so a slow transaction could
+otherwise commit an event below the watermark after it has moved on.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from utils.conf import Setting
+from .models import RequestRollup, RequestStatusEvent, RollupWatermark
+
+WATERMARK_NAME = 'request_rollups'
+SETTLE_SECONDS = Setting('ROLLUP_SETTLE_SECONDS', 60)
+PERIODS = ('hour', 'day')
+METRICS = ('created', 'completed', 'cancelled', 'lead_time_seconds')
+
+
+def bucket_start(moment, period):
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def apply_deltas(deltas):
+    """Add {(period, bucket_start, service_type, driver_id): metrics} into the rollup rows.
+
+    Reads the touched buckets once, bulk-creates the missing rows and adds
+    to the others with one parameterised UPDATE executed for the batch.
+    Checking for a row before creating it is safe because runs are
+    serialised on the watermark row.
+    """
+    existing = {}
+    for period in PERIODS:
+        starts = {start for row_period, start, _, _ in deltas if row_period == period}
+        if starts:
+            rows = RequestRollup.objects.filter(period=period, bucket_start__in=starts).values_list(
+                'id', 'bucket_start', 'service_type', 'driver_id',
+            )
+            for row_id, start, service_type, driver_id in rows:
+                existing[(period, start, service_type, driver_id)] = row_id
+    to_create, increments = [], []
+    for key, metrics in deltas.items():
+        row_id = existing.get(key)
+        if row_id is None:
+            period, start, service_type, driver_id = key
+            to_create.append(RequestRollup(
+                period=period, bucket_start=start, service_type=service_type, driver_id=driver_id, **metrics,
+            ))
+        else:
+            increments.append([metrics[metric] for metric in METRICS] + [row_id])
+    RequestRollup.objects.bulk_create(to_create, batch_size=1000)
+    if increments:
+        quote = connection.ops.quote_name
+        assignments = ', '.join(f'{quote(metric)} = {quote(metric)} + %s' for metric in METRICS)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {quote(RequestRollup._meta.db_table)} SET {assignments} WHERE id = %s', increments,
+            )
+
+
+def rollup_events(batch_size=5000, now=None):
+    """Fold the next batch of settled events into the rollups; returns the number processed"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+        # Serialise concurrent runs on the watermark row
+        watermark = RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+        events = list(
+            RequestStatusEvent.objects.filter(
+                id__gt=watermark.last_event_id,
+                created_at__lte=now - timedelta(seconds=SETTLE_SECONDS.value),
+            ).order_by('id').values_list(
+                'id', 'from_status', 'to_status', 'driver_id', 'created_at',
+                'request__service_type', 'request__created_at',
+            )[:batch_size]
+        )
+        if not events:
+            return 0
+
+        deltas = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+        for _, from_status, to_status, driver_id, created_at, service_type, request_created_at in events:
+            if from_status == to_status:
+                continue  # driver re-assignment; no metric changes
+            service_type = service_type or ''
+            for period in PERIODS:
+                start = bucket_start(created_at, period)
+                if not from_status:
+                    deltas[(period, start, service_type, None)]['created'] += 1
+                elif to_status == 'completed':
+                    row = deltas[(period, start, service_type, driver_id)]
+                    row['completed'] += 1
+                    if request_created_at is not None:
+                        row['lead_time_seconds'] += max(0, int((created_at - request_created_at).total_seconds()))
+                elif to_status == 'cancelled':
+                    deltas[(period, start, service_type, driver_id)]['cancelled'] += 1
+
+        apply_deltas(deltas)
+        watermark.last_event_id = events[-1][0]
+        watermark.save(update_fields=['last_event_id', 'updated_at'])
+    return len(events)
+
+
+def rollup_all(batch_size=5000):
+    """Process batches until the settled backlog is empty; returns the total processed"""
+    total = 0
+    while True:
+        processed = rollup_events(batch_size=batch_size)
+        total += processed
+        if processed < batch_size:
+            return total
+
+
+def reset_rollups():
+    """Drop all rollups and rewind the watermark so the next run rebuilds from the whole log"""
+    with transaction.atomic():
+        # Rewind first: the UPDATE waits for (then blocks) a run holding the watermark lock
+        RollupWatermark.objects.filter(name=WATERMARK_NAME).update(last_event_id=0)
+        RequestRollup.objects.all().delete()
+
+
+def stats(period='hour', since=None, until=None):
+    """Summarise rollups between `since` and `until` (reads only RequestRollup rows)"""
+    until = until or timezone.now()
+    since = since or until - (timedelta(days=1) if period == 'hour' else timedelta(days=30))
+    rows = RequestRollup.objects.filter(
+        period=period, bucket_start__gte=bucket_start(since, period), bucket_start__lte=until,
+    ).values_list('bucket_start', 'service_type', 'driver_id', *METRICS)
+
+    buckets = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    service_types = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    drivers = defaultdict(lambda: {'completed': 0, 'cancelled': 0})
+    totals = dict.fromkeys(METRICS, 0)
+    for start, service_type, driver_id, *values in rows:
+        metrics = dict(zip(METRICS, values))
+        for target in (buckets[start], service_types[service_type], totals):
+            for key, value in metrics.items():
+                target[key] += value
+        if driver_id is not None:
+            drivers[driver_id]['completed'] += metrics['completed']
+            drivers[driver_id]['cancelled'] += metrics['cancelled']
+
+    def with_average(metrics):
+        lead = metrics.pop('lead_time_seconds')
+        metrics['avg_lead_time_seconds'] = round(lead / metrics['completed']) if metrics['completed'] else None
+        return metrics
+
+    return {
+        'period': period,
+        'since': since,
+        'until': until,
+        'totals': with_average(dict(totals)),
+        'buckets': [{'start': start, **with_average(dict(m))} for start, m in sorted(buckets.items())],
+        'service_types': {name or 'unknown': with_average(dict(m)) for name, m in sorted(service_types.items())},
+        'drivers': [{'driver_id': driver_id, **m} for driver_id, m in sorted(drivers.items())],
+    }
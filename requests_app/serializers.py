@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import LaundryRequest, Driver
+from .models import LaundryRequest, Driver, RequestStatusEvent
 from .models import PricingItem
 from django.contrib.auth import get_user_model
 
@@ -30,11 +30,43 @@ class LaundryRequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = LaundryRequest
         fields = [
-            'id', 'customer_name', 'customer_email', 'phone', 'address', 'pickup_time', 
+            'id', 'customer_name', 'customer_email', 'phone', 'address',
+            'pickup_latitude', 'pickup_longitude', 'pickup_time', 
             'items_description', 'service_type', 'status', 'driver', 'driver_id', 'created_at', 'updated_at',
         ]
         read_only_fields = ['customer_email']
 
+    @staticmethod
+    def eager_load(queryset):
+        """Join everything the nested representation reads (customer, driver, driver.user)"""
+        return queryset.select_related('customer', 'driver__user')
+
+
+class LaundryRequestImportSerializer(LaundryRequestSerializer):
+    """Validates one line of a bulk import (see importer.py).
+
+    Same field rules as LaundryRequestSerializer, but the customer and
+    driver are plain ids (or a customer email) that the importer resolves
+    with one query per batch instead of a lookup per row. `created_at` may
+    be given to keep the timestamps of historical requests.
+    """
+    driver_id = serializers.IntegerField(required=False, allow_null=True)
+    customer_id = serializers.IntegerField(required=False, allow_null=True)
+    customer_email = serializers.EmailField(required=False, allow_blank=True)
+    created_at = serializers.DateTimeField(required=False, allow_null=True)
+
+    class Meta(LaundryRequestSerializer.Meta):
+        fields = [
+            'customer_id', 'customer_email', 'customer_name', 'phone', 'address',
+            'pickup_latitude', 'pickup_longitude', 'pickup_time',
+            'items_description', 'service_type', 'status', 'driver_id', 'created_at',
+        ]
+        read_only_fields = []
+
+    def validate(self, attrs):
+        if not attrs.get('customer_id') and not attrs.get('customer_email'):
+            raise serializers.ValidationError('customer_id or customer_email is required')
+        return attrs
 
 class PricingItemSerializer(serializers.ModelSerializer):
     id = serializers.CharField(source='slug')
@@ -43,3 +75,22 @@ class PricingItemSerializer(serializers.ModelSerializer):
         model = PricingItem
         # include both `id` (for client compatibility) and `slug`
         fields = ['id', 'slug', 'label', 'price', 'description', 'icon', 'ordering']
+
+
+class PricingItemPayloadSerializer(PricingItemSerializer):
+    """Validates one item of a PUT /pricing/ payload.
+
+    `slug` is left out so ModelSerializer doesn't attach a per-row uniqueness
+    query; the view checks for duplicates across the payload and upserts
+    existing slugs instead.
+    """
+    id = serializers.CharField(source='slug', max_length=100)
+
+    class Meta(PricingItemSerializer.Meta):
+        fields = ['id', 'label', 'price', 'description', 'icon', 'ordering']
+
+
+class RequestStatusEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RequestStatusEvent
+        fields = ['id', 'from_status', 'to_status', 'driver', 'actor', 'source', 'created_at']
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Driver, LaundryRequest, PricingItem
+from .pricing_cache import invalidate_pricing
+from .spatial import remove_driver, update_driver_position
+from .timeline import forget_durations, forget_request
+
+
+@receiver([post_save, post_delete], sender=PricingItem)
+def pricing_changed(sender, **kwargs):
+    # Admin edits save items one by one; the version commits with each change
+    invalidate_pricing()
+
+
+@receiver(post_save, sender=Driver)
+def driver_saved(sender, instance, **kwargs):
+    # Keep the nearest-driver index current (location pings, availability toggles, admin edits)
+    transaction.on_commit(lambda: update_driver_position(instance))
+
+
+@receiver(post_delete, sender=Driver)
+def driver_deleted(sender, instance, **kwargs):
+    driver_id = instance.pk
+    transaction.on_commit(lambda: remove_driver(driver_id))
+
+
+@receiver(post_delete, sender=LaundryRequest)
+def request_deleted(sender, instance, **kwargs):
+    # Fires for API/admin deletes, queryset deletes and cascades from the customer
+    forget_request(instance.status, instance.driver_id)
+
+
+@receiver(pre_delete, sender=LaundryRequest)
+def request_deleting(sender, instance, **kwargs):
+    # Its events go with it (cascade), so replay them while they still exist
+    forget_durations(instance.pk)
@@ -0,0 +1,273 @@
+"""In-memory spatial index of available drivers.
+
+Drivers are bucketed into lat/lng grids whose columns wrap at the
+antimeridian: one with DRIVER_INDEX_CELL_DEGREES cells and a few coarser
+ones. A k-nearest query scans rings of cells outward from the query point
+and stops as soon as no unscanned cell can hold anything closer than the
+current k-th result, so it only touches a handful of cells even with tens
+of thousands of drivers. Where drivers are too sparse for that, it moves
+to the next coarser grid after LEVEL_SCAN_CELLS cells, and on the coarsest
+one scans the remaining occupied cells directly once the rings would visit
+more cells than are occupied.
+
+The index is built lazily from the database, kept current by Driver
+saves (see signals.py) and rebuilt periodically to pick up writes made by
+other processes.
+"""
+import heapq
+import math
+import threading
+import time
+from decimal import Decimal
+
+from utils.conf import Setting
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+CELL_DEGREES = Setting('DRIVER_INDEX_CELL_DEGREES', 0.01)
+REBUILD_SECONDS = Setting('DRIVER_INDEX_REBUILD_SECONDS', 300)
+# Coarser grids are kept at this factor up to MAX_LEVEL_DEGREES; a query
+# moves to the next one after visiting LEVEL_SCAN_CELLS cells of a grid
+LEVEL_FACTOR = 8
+MAX_LEVEL_DEGREES = 30
+LEVEL_SCAN_CELLS = 128
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) enclosing a circle of `radius_km`"""
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 89.9)))
+    dlng = min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+class _Grid:
+    """One resolution of the index: a uniform grid whose columns wrap at the antimeridian"""
+
+    def __init__(self, cell_degrees):
+        self.cell = cell_degrees
+        # Columns split 360 degrees evenly so the grid wraps at +/-180
+        self.columns = max(1, round(360 / cell_degrees))
+        self.column_degrees = 360 / self.columns
+        self.cells = {}  # (row, col) -> {driver_id: (lat, lng)}
+
+    def key(self, lat, lng):
+        return math.floor(lat / self.cell), math.floor((lng + 180) / self.column_degrees) % self.columns
+
+    def add(self, key, driver_id, lat, lng):
+        self.cells.setdefault(key, {})[driver_id] = (lat, lng)
+
+    def discard(self, key, driver_id):
+        cell = self.cells.get(key)
+        if cell is not None:
+            cell.pop(driver_id, None)
+            if not cell:
+                del self.cells[key]
+
+    def scan(self, lat, lng, k, radius_km, total, max_cells=None):
+        """Max-heap of (-distance, driver_id) for the `k` closest drivers.
+
+        Returns None instead when more than `max_cells` cells would have to
+        be visited, so the caller can retry on a coarser grid.
+        """
+        best = []
+        seen = 0
+
+        def consider(cell):
+            nonlocal seen
+            for driver_id, (dlat, dlng) in cell.items():
+                seen += 1
+                dist = haversine_km(lat, lng, dlat, dlng)
+                if radius_km is not None and dist > radius_km:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-dist, driver_id))
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, (-dist, driver_id))
+
+        row, col = self.key(lat, lng)
+        cell_degrees = min(self.cell, self.column_degrees)
+        visited = 0
+        ring = 0
+        while True:
+            if visited > len(self.cells) or 2 * ring + 1 >= self.columns:
+                # Cheaper to finish with every occupied cell the rings haven't reached
+                for key, cell in self.cells.items():
+                    if self.ring_of(row, col, key) >= ring:
+                        consider(cell)
+                return best
+            if max_cells is not None and visited > max_cells:
+                return None
+            for key in self.ring_cells(row, col, ring):
+                visited += 1
+                cell = self.cells.get(key)
+                if cell:
+                    consider(cell)
+            if seen >= total:
+                return best
+            # Anything outside the scanned rings is at least this far away
+            cos_lat = math.cos(math.radians(min(abs(lat) + (ring + 1) * self.cell, 89.9)))
+            lower_bound = ring * cell_degrees * KM_PER_DEGREE * cos_lat
+            if radius_km is not None and lower_bound > radius_km:
+                return best
+            if len(best) == k and lower_bound >= -best[0][0]:
+                return best
+            ring += 1
+
+    def ring_of(self, row, col, key):
+        """Ring (Chebyshev distance in cells, wrapping columns) of `key` around (row, col)"""
+        dcol = abs(key[1] - col) % self.columns
+        return max(abs(key[0] - row), min(dcol, self.columns - dcol))
+
+    def ring_cells(self, row, col, ring):
+        if ring == 0:
+            yield row, col
+            return
+        columns = self.columns
+        for c in range(col - ring, col + ring + 1):
+            yield row - ring, c % columns
+            yield row + ring, c % columns
+        for r in range(row - ring + 1, row + ring):
+            yield r, (col - ring) % columns
+            yield r, (col + ring) % columns
+
+
+class DriverGridIndex:
+    """Grids of increasing cell size over (lat, lng) holding the positions of available drivers"""
+
+    def __init__(self, cell_degrees=None):
+        # None follows DRIVER_INDEX_CELL_DEGREES, re-read whenever build_driver_index() rebuilds it
+        self.cell_degrees = cell_degrees
+        self.cell = CELL_DEGREES.value if cell_degrees is None else cell_degrees
+        self._grids = [_Grid(self.cell)]
+        while self._grids[-1].cell * LEVEL_FACTOR <= MAX_LEVEL_DEGREES:
+            self._grids.append(_Grid(self._grids[-1].cell * LEVEL_FACTOR))
+        self._positions = {}  # driver_id -> (lat, lng, (key in each grid, ...))
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def clear(self):
+        with self._lock:
+            for grid in self._grids:
+                grid.cells.clear()
+            self._positions.clear()
+
+    def update(self, driver_id, lat, lng, available=True):
+        """Insert, move or (when unavailable/without coordinates) remove a driver"""
+        with self._lock:
+            self.remove(driver_id)
+            if not available or lat is None or lng is None:
+                return
+            lat, lng = float(lat), float(lng)
+            keys = tuple(grid.key(lat, lng) for grid in self._grids)
+            for grid, key in zip(self._grids, keys):
+                grid.add(key, driver_id, lat, lng)
+            self._positions[driver_id] = (lat, lng, keys)
+
+    def move(self, driver_id, lat, lng):
+        """Update the position of a driver that is already indexed (i.e. available)"""
+        with self._lock:
+            if driver_id in self._positions:
+                self.update(driver_id, lat, lng)
+
+    def remove(self, driver_id):
+        with self._lock:
+            entry = self._positions.pop(driver_id, None)
+            if entry is None:
+                return
+            for grid, key in zip(self._grids, entry[2]):
+                grid.discard(key, driver_id)
+
+    def nearest(self, lat, lng, k=5, radius_km=None):
+        """Return up to `k` (distance_km, driver_id) pairs, closest first"""
+        lat, lng = float(lat), float(lng)
+        with self._lock:
+            total = len(self._positions)
+            if not total or k <= 0:
+                return []
+            for grid in self._grids[:-1]:
+                best = grid.scan(lat, lng, k, radius_km, total, max_cells=LEVEL_SCAN_CELLS)
+                if best is not None:
+                    break
+            else:
+                best = self._grids[-1].scan(lat, lng, k, radius_km, total)
+            return sorted((-d, driver_id) for d, driver_id in best)
+
+
+_index = DriverGridIndex()
+_build_lock = threading.Lock()
+
+
+def build_driver_index(index=None):
+    """(Re)load every available driver with a known position from the database"""
+    from .models import Driver
+
+    index = index or _index
+    rows = Driver.objects.filter(
+        is_available=True, latitude__isnull=False, longitude__isnull=False,
+    ).values_list('id', 'latitude', 'longitude')
+    fresh = DriverGridIndex(index.cell_degrees)
+    for driver_id, lat, lng in rows.iterator(chunk_size=5000):
+        fresh.update(driver_id, lat, lng)
+    with index._lock:
+        index.cell, index._grids, index._positions = fresh.cell, fresh._grids, fresh._positions
+        index.built_at = time.monotonic()
+    return index
+
+
+def get_driver_index():
+    """The process-wide driver index, built on first use and refreshed periodically"""
+    if _index.built_at is None or time.monotonic() - _index.built_at > REBUILD_SECONDS.value:
+        with _build_lock:
+            if _index.built_at is None or time.monotonic() - _index.built_at > REBUILD_SECONDS.value:
+                build_driver_index(_index)
+    return _index
+
+
+def update_driver_position(driver):
+    """Reflect a saved Driver in the index (no-op until the index has been built)"""
+    if _index.built_at is None:
+        return
+    _index.update(driver.pk, driver.latitude, driver.longitude, driver.is_available)
+
+
+def move_driver(driver_id, lat, lng):
+    """Apply a location ping to the index without touching availability"""
+    if _index.built_at is None:
+        return
+    _index.move(driver_id, lat, lng)
+
+
+def remove_driver(driver_id):
+    _index.remove(driver_id)
+
+
+def nearest_drivers_from_db(lat, lng, k=5, radius_km=25):
+    """Fallback k-nearest query using an indexed bounding-box prefilter in the database"""
+    from .models import Driver
+
+    min_lat, max_lat, min_lng, max_lng = bounding_box(float(lat), float(lng), radius_km)
+    rows = Driver.objects.filter(
+        is_available=True,
+        latitude__range=(Decimal(str(round(min_lat, 6))), Decimal(str(round(max_lat, 6)))),
+        longitude__range=(Decimal(str(round(min_lng, 6))), Decimal(str(round(max_lng, 6)))),
+    ).values_list('id', 'latitude', 'longitude')
+    scored = []
+    for driver_id, dlat, dlng in rows:
+        dist = haversine_km(float(lat), float(lng), float(dlat), float(dlng))
+        if dist <= radius_km:
+            scored.append((dist, driver_id))
+    return heapq.nsmallest(k, scored)
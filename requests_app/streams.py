@@ -0,0 +1,147 @@
+"""Live driver position stream for customers tracking their request.
+
+GET /api/requests/<id>/track/ is a server-sent-events stream that follows
+the driver assigned to the request. Drivers may ping every second, but
+each subscriber receives at most one update per
+DRIVER_TRACKING_MIN_INTERVAL_SECONDS: pings arriving in between are
+coalesced (only the newest is kept), moves shorter than
+DRIVER_TRACKING_MIN_MOVE_METERS are skipped, and after the first full
+`position` frame only `position.delta` frames carrying the offset from the
+previously sent position in micro-degrees are emitted.
+
+Tracking is only offered while the request is assigned, picked up or in
+progress. The stream also follows the request's own topic and re-checks the
+request on every keep-alive, and ends with a `tracking.ended` frame as soon
+as the request leaves those statuses or gets another driver.
+"""
+import time
+
+from django.http import JsonResponse
+
+from users.streams import HEARTBEAT_SECONDS, authenticate_stream, format_sse, sse_response
+from utils.conf import Setting
+from utils.events import driver_topic, get_broker, request_topic
+from .models import LaundryRequest
+from .spatial import haversine_km
+from .timeline import ACTIVE_STATUSES
+
+MIN_INTERVAL_SECONDS = Setting('DRIVER_TRACKING_MIN_INTERVAL_SECONDS', 5)
+MIN_MOVE_METERS = Setting('DRIVER_TRACKING_MIN_MOVE_METERS', 10)
+MICRODEGREES = 1_000_000
+
+
+class PositionEncoder:
+    """Turns a subscriber's stream of positions into full and delta frames"""
+
+    def __init__(self, min_move_meters=None):
+        if min_move_meters is None:
+            min_move_meters = MIN_MOVE_METERS.value
+        self.min_move_km = min_move_meters / 1000
+        self.last = None  # (lat_micro, lng_micro) of the last frame sent
+        self.sequence = 0
+
+    def encode(self, position):
+        """SSE frame for `position`, or None if it is too close to the last one sent"""
+        lat = round(position['latitude'] * MICRODEGREES)
+        lng = round(position['longitude'] * MICRODEGREES)
+        if self.last is None:
+            event_type = 'position'
+            data = {
+                'driver_id': position['driver_id'],
+                'latitude': lat / MICRODEGREES,
+                'longitude': lng / MICRODEGREES,
+                'recorded_at': position['recorded_at'],
+            }
+        else:
+            moved_km = haversine_km(self.last[0] / MICRODEGREES, self.last[1] / MICRODEGREES,
+                                    lat / MICRODEGREES, lng / MICRODEGREES)
+            if moved_km < self.min_move_km:
+                return None
+            event_type = 'position.delta'
+            data = {'dlat': lat - self.last[0], 'dlng': lng - self.last[1], 'recorded_at': position['recorded_at']}
+        self.last = (lat, lng)
+        self.sequence += 1
+        return format_sse({'id': self.sequence, 'type': event_type, 'data': data})
+
+
+async def throttled_position_stream(subscription, initial=None, min_interval=None, is_active=None):
+    """Yield at most one coalesced, delta-encoded position frame per `min_interval` seconds.
+
+    `min_interval` defaults to DRIVER_TRACKING_MIN_INTERVAL_SECONDS. `is_active`
+    is an async callable checked on every non-position event and keep-alive;
+    once it returns False a `tracking.ended` frame closes the stream.
+    """
+    if min_interval is None:
+        min_interval = MIN_INTERVAL_SECONDS.value
+    encoder = PositionEncoder()
+    pending = None
+    last_sent = float('-inf')
+    try:
+        yield f'retry: {HEARTBEAT_SECONDS.value * 1000}\n\n'
+        if initial is not None:
+            frame = encoder.encode(initial)
+            if frame:
+                last_sent = time.monotonic()
+                yield frame
+        while True:
+            if pending is None:
+                timeout = HEARTBEAT_SECONDS.value
+            else:
+                timeout = max(0.0, last_sent + min_interval - time.monotonic())
+            event = await subscription.get(timeout=timeout)
+            idle = event is None and pending is None
+            if idle or (event is not None and event['type'] != 'driver.position'):
+                # An idle keep-alive or a change to the request itself: is it still trackable?
+                if is_active is not None and not await is_active():
+                    yield format_sse({'id': encoder.sequence + 1, 'type': 'tracking.ended', 'data': {}})
+                    return
+                if event is None:
+                    yield ': keep-alive\n\n'
+                continue
+            if event is not None:
+                pending = event['data']  # coalesce: only the newest ping matters
+            if pending is not None and time.monotonic() - last_sent >= min_interval:
+                frame = encoder.encode(pending)
+                pending = None
+                if frame:
+                    last_sent = time.monotonic()
+                    yield frame
+    finally:
+        # Runs when the ASGI server cancels the response on client disconnect
+        subscription.close()
+
+
+async def request_driver_stream(request, pk):
+    if request.method != 'GET':
+        return JsonResponse({'detail': 'Method not allowed'}, status=405)
+    user = await authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+    try:
+        laundry_request = await LaundryRequest.objects.select_related('driver').aget(pk=pk)
+    except LaundryRequest.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    if laundry_request.customer_id != user.pk and not user.is_staff:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    driver = laundry_request.driver
+    if driver is None:
+        return JsonResponse({'detail': 'No driver has been assigned to this request yet'}, status=409)
+    if laundry_request.status not in ACTIVE_STATUSES:
+        return JsonResponse({'detail': f'Tracking is not available for a request that is {laundry_request.status}'},
+                            status=409)
+
+    async def is_active():
+        return await LaundryRequest.objects.filter(
+            pk=pk, driver_id=driver.pk, status__in=ACTIVE_STATUSES,
+        ).aexists()
+
+    initial = None
+    if driver.latitude is not None and driver.longitude is not None:
+        initial = {
+            'driver_id': driver.pk,
+            'latitude': float(driver.latitude),
+            'longitude': float(driver.longitude),
+            'recorded_at': driver.last_location_update,
+        }
+    subscription = get_broker().subscribe(driver_topic(driver.pk), request_topic(pk))
+    return sse_response(throttled_position_stream(subscription, initial, is_active=is_active))
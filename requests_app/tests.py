@@ -0,0 +1,866 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from requests_app import importer, location_ingest, pricing_cache, rollups
+from requests_app.dispatch import _MinCostMatcher
+from requests_app.location_ingest import LocationBuffer
+from requests_app.models import (
+    Driver, DriverLoad, DriverLocation, LaundryRequest, PricingItem, RequestRollup, RequestStatusCount,
+    RequestStatusEvent, RollupWatermark, StatusDurationBucket,
+)
+from requests_app.spatial import DriverGridIndex, _Grid, haversine_km
+from requests_app.timeline import Transition, duration_bucket, rebuild_projections, record_transitions
+from users.authentication import cached_token, token_cache
+from users.directory import get_staff_directory
+from users.models import Notification, StreamEvent, StreamTopic, User
+from utils.cache_versions import current_version
+from utils.email_service import notify_new_request
+from utils.events import DatabaseBroker, driver_topic, get_broker, user_topic
+from utils.outbox import backoff_delay
+from utils.testing import query_budget
+
+
+class NewRequestFanOutTests(TestCase):
+    """A new request notifies every admin in a fixed number of queries"""
+
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', 'customer@example.com')
+
+    def add_admins(self, count):
+        start = User.objects.filter(is_staff=True).count()
+        for i in range(start, start + count):
+            User.objects.create_user(f'admin{i}', f'admin{i}@example.com', is_staff=True)
+
+    def notify(self):
+        laundry_request = LaundryRequest.objects.create(
+            customer=self.customer, customer_name='Customer', phone='1', address='1 Road',
+        )
+        get_staff_directory()  # measure the fan-out, not the directory reload
+        with CaptureQueriesContext(connection) as captured:
+            notify_new_request(laundry_request)
+        return laundry_request, len(captured.captured_queries)
+
+    def test_query_count_does_not_grow_with_staff(self):
+        self.add_admins(1)
+        _, one_admin = self.notify()
+        self.add_admins(29)
+        laundry_request, thirty_admins = self.notify()
+
+        self.assertEqual(one_admin, thirty_admins)
+        # the customer plus every admin gets an in-app notification
+        self.assertEqual(Notification.objects.filter(related_request=laundry_request).count(), 31)
+
+
+class ListQueryBudgetTests(TestCase):
+    """Request listings load customers and drivers without N+1 queries"""
+
+    # One SELECT for the page; authentication is forced, so no token lookup
+    LIST_QUERIES = 1
+
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', 'customer@example.com')
+        driver_user = User.objects.create_user('driver', 'driver@example.com', first_name='Dee')
+        self.driver = Driver.objects.create(user=driver_user, name='Dee')
+        self.client = APIClient()
+
+    def add_requests(self, count):
+        LaundryRequest.objects.bulk_create([
+            LaundryRequest(customer=self.customer, customer_name='Customer', phone='1',
+                           address='1 Road', status='assigned', driver=self.driver)
+            for _ in range(count)
+        ])
+
+    def assert_list_within_budget(self, url, extra_queries=0):
+        for count in (3, 30):
+            self.add_requests(count)
+            with query_budget(self.LIST_QUERIES + extra_queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(all(row['driver']['email'] == 'driver@example.com' for row in response.data['results']))
+
+    def test_staff_request_list(self):
+        self.client.force_authenticate(User.objects.create_user('admin', 'admin@example.com', is_staff=True))
+        self.assert_list_within_budget('/api/requests/')
+
+    def test_driver_my_requests(self):
+        self.client.force_authenticate(self.driver.user)
+        # plus the lookup of the caller's driver profile
+        self.assert_list_within_budget('/api/drivers/my_requests/', extra_queries=1)
+
+
+class ConcurrentTransitionTests(TransactionTestCase):
+    """Racing assign/update_status calls never persist an illegal transition"""
+
+    THREADS = 12
+    CALLS_PER_THREAD = 60
+    STATUSES = ('assigned', 'picked_up', 'in_progress', 'completed', 'cancelled')
+
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+        customer = User.objects.create_user('customer', 'customer@example.com')
+        self.drivers = [Driver.objects.create(name=f'Driver {i}') for i in range(3)]
+        self.request_ids = [
+            LaundryRequest.objects.create(customer=customer, customer_name='Customer', phone='1', address='1 Road').pk
+            for _ in range(20)
+        ]
+
+    def hammer(self, seed, statuses, errors):
+        rng = random.Random(seed)
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        try:
+            for _ in range(self.CALLS_PER_THREAD):
+                pk = rng.choice(self.request_ids)
+                if rng.random() < 0.3:
+                    response = client.post(f'/api/requests/{pk}/assign/',
+                                           {'driver_id': rng.choice(self.drivers).pk}, format='json')
+                else:
+                    response = client.post(f'/api/requests/{pk}/update_status/',
+                                           {'status': rng.choice(self.STATUSES)}, format='json')
+                statuses.append(response.status_code)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_no_illegal_transition_is_persisted(self):
+        statuses, errors = [], []
+        threads = [
+            threading.Thread(target=self.hammer, args=(seed, statuses, errors))
+            for seed in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(set(statuses) <= {200, 400, 409}, set(statuses))
+        self.assertIn(200, statuses)
+        for laundry_request in LaundryRequest.objects.filter(pk__in=self.request_ids):
+            current = 'pending'
+            events = RequestStatusEvent.objects.filter(request=laundry_request).exclude(from_status='').order_by('id')
+            for event in events:
+                self.assertEqual(event.from_status, current, f'#{laundry_request.pk}: {event} after {current}')
+                legal = LaundryRequest.STATUS_TRANSITIONS.get(current, ())
+                if event.to_status == 'assigned':
+                    self.assertIn(current, LaundryRequest.ASSIGNABLE_STATUSES, f'#{laundry_request.pk}: {event}')
+                else:
+                    self.assertIn(event.to_status, legal, f'#{laundry_request.pk}: {event}')
+                current = event.to_status
+            self.assertEqual(laundry_request.status, current)
+
+
+class LocationFlushQueryTests(TestCase):
+    """Flushing buffered pings costs the same queries however many drivers moved"""
+
+    def setUp(self):
+        get_broker()._active = (0.0, frozenset())  # forget leases cached by earlier tests
+
+    def flush_queries(self, count):
+        drivers = [Driver.objects.create(name=f'Driver {i}') for i in range(count)]
+        # Everyone is being tracked, so every position is published
+        expires_at = timezone.now() + timedelta(minutes=1)
+        StreamTopic.objects.bulk_create([StreamTopic(topic=driver_topic(d.pk), expires_at=expires_at) for d in drivers])
+        get_broker()._active = (0.0, frozenset())
+        buffer = LocationBuffer(keep_history=True)
+        now = timezone.now()
+        for driver in drivers:
+            buffer.add(driver.pk, [(6.5, 3.4, now - timedelta(seconds=1)), (6.6, 3.5, now)])
+        published = StreamEvent.objects.count()
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(buffer.flush(), (count, 2 * count))
+        self.assertEqual(StreamEvent.objects.count() - published, count)
+        return len(captured.captured_queries)
+
+    def test_constant_queries_per_flush(self):
+        self.assertEqual(self.flush_queries(3), self.flush_queries(30))
+
+
+class MinCostMatcherTests(SimpleTestCase):
+    """The dispatch matcher agrees with brute force on small random instances"""
+
+    TRIALS = 400
+
+    def brute_force(self, costs, free):
+        """{frozenset of served requests: cheapest total cost} over every feasible assignment"""
+        best = {}
+        requests = list(costs)
+        used = dict.fromkeys(free, 0)
+
+        def search(i, total, served):
+            if i == len(requests):
+                best[served] = min(total, best.get(served, float('inf')))
+                return
+            request_id = requests[i]
+            search(i + 1, total, served)
+            for driver_id, (cost, _) in costs[request_id].items():
+                if used[driver_id] < free[driver_id]:
+                    used[driver_id] += 1
+                    search(i + 1, total + cost, served | {request_id})
+                    used[driver_id] -= 1
+
+        search(0, 0.0, frozenset())
+        return best
+
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        for trial in range(self.TRIALS):
+            free = {driver_id: rng.randint(1, 2) for driver_id in range(rng.randint(1, 4))}
+            costs = {}
+            for request_id in range(rng.randint(1, 7)):
+                candidates = rng.sample(sorted(free), rng.randint(0, len(free)))
+                if candidates:
+                    costs[request_id] = {d: (round(rng.uniform(0, 10), 2), 0) for d in candidates}
+
+            matcher = _MinCostMatcher(costs, dict(free))
+            for request_id in costs:
+                matcher.augment(request_id)
+            best = self.brute_force(costs, free)
+            served = frozenset(matcher.match)
+            with self.subTest(trial=trial, costs=costs, free=free):
+                # Serves as many requests as possible, at the cheapest cost for that set
+                self.assertEqual(len(served), max(len(option) for option in best))
+                self.assertAlmostEqual(sum(costs[r][d][0] for r, d in matcher.match.items()), best[served])
+                self.assertTrue(all(list(matcher.match.values()).count(d) <= free[d] for d in free))
+
+
+class DriverGridIndexTests(SimpleTestCase):
+    """Grid k-nearest queries agree with a full scan, across the antimeridian and for sparse fleets"""
+
+    def full_scan(self, drivers, lat, lng, k, radius_km=None):
+        scored = sorted((haversine_km(lat, lng, dlat, dlng), driver_id) for driver_id, (dlat, dlng) in drivers.items())
+        return [(d, driver_id) for d, driver_id in scored if radius_km is None or d <= radius_km][:k]
+
+    def assert_same_distances(self, got, expected):
+        self.assertEqual([round(d, 6) for d, _ in got], [round(d, 6) for d, _ in expected])
+
+    def test_matches_full_scan(self):
+        rng = random.Random(3)
+        for trial in range(300):
+            index = DriverGridIndex(rng.choice([0.05, 0.5, 7]))
+            drivers = {}
+            for driver_id in range(rng.randint(1, 60)):
+                if rng.random() < 0.5:  # crowd the antimeridian
+                    lat, lng = rng.uniform(-60, 60), rng.choice([rng.uniform(178, 180), rng.uniform(-180, -178)])
+                else:
+                    lat, lng = rng.uniform(-89, 89), rng.uniform(-180, 180)
+                drivers[driver_id] = (lat, lng)
+                index.update(driver_id, lat, lng)
+            lat, lng = rng.uniform(-60, 60), rng.choice([179.99, -179.99, rng.uniform(-180, 180)])
+            k, radius_km = rng.randint(1, 6), rng.choice([None, 50, 500, 5000])
+            with self.subTest(trial=trial):
+                self.assert_same_distances(index.nearest(lat, lng, k=k, radius_km=radius_km),
+                                           self.full_scan(drivers, lat, lng, k, radius_km))
+
+    def test_neighbour_across_the_antimeridian(self):
+        index = DriverGridIndex(0.05)
+        index.update(1, 10, 179.99)
+        index.update(2, 10, 179.5)
+        (distance, driver_id), = index.nearest(10, -179.99, k=1, radius_km=5)
+        self.assertEqual(driver_id, 1)
+        self.assertAlmostEqual(distance, haversine_km(10, -179.99, 10, 179.99))
+
+    def test_sparse_far_away_drivers_scan_few_cells(self):
+        index = DriverGridIndex(0.05)
+        index.update(1, 6.5, 3.4)  # Lagos
+        index.update(2, -33.9, 151.2)  # Sydney
+        with mock.patch.object(_Grid, 'ring_cells', autospec=True, side_effect=_Grid.ring_cells) as ring_cells:
+            self.assertEqual([driver_id for _, driver_id in index.nearest(6.5, 3.4, k=2)], [1, 2])
+        # Falls back to the two occupied cells instead of ringing out thousands of cells
+        self.assertLessEqual(ring_cells.call_count, 3)
+
+    def test_sparse_global_fleet_matches_full_scan(self):
+        # More occupied cells than one grid level may visit, so queries move to coarser grids
+        rng = random.Random(4)
+        drivers = {driver_id: (rng.uniform(-60, 60), rng.uniform(-180, 180)) for driver_id in range(2000)}
+        index = DriverGridIndex(0.05)
+        for driver_id, (lat, lng) in drivers.items():
+            index.update(driver_id, lat, lng)
+        for _ in range(50):
+            lat, lng = rng.uniform(-60, 60), rng.uniform(-180, 180)
+            radius_km = rng.choice([None, 300])
+            self.assert_same_distances(index.nearest(lat, lng, k=5, radius_km=radius_km),
+                                       self.full_scan(drivers, lat, lng, 5, radius_km))
+
+
+class LocationBufferTests(TestCase):
+    """Pings coalesce per driver and survive a failed flush"""
+
+    def setUp(self):
+        self.drivers = [Driver.objects.create(name=f'Driver {i}') for i in range(2)]
+        self.buffer = LocationBuffer(flush_seconds=3600)
+        self.now = timezone.now()
+
+    def tearDown(self):
+        self.buffer._stopped.set()
+
+    def ping(self, driver, seconds_ago, lat=6.5, lng=3.4):
+        self.buffer.add(driver.pk, [(lat, lng, self.now - timedelta(seconds=seconds_ago))])
+
+    def failing_flush(self, during=None):
+        def fail(*args, **kwargs):
+            if during:
+                during()
+            raise OperationalError('database is locked')
+
+        with mock.patch.object(Driver.objects, 'bulk_update', side_effect=fail), \
+                self.assertLogs('requests_app.location_ingest', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), (0, 0))
+
+    def test_latest_ping_wins_regardless_of_arrival_order(self):
+        first, second = self.drivers
+        self.ping(first, 5, lat=1)
+        self.ping(first, 10, lat=2)  # late, older ping
+        self.ping(second, 3, lat=3)
+        self.assertEqual(self.buffer.pending(), (2, 3))
+
+        self.assertEqual(self.buffer.flush(), (2, 3))
+        first.refresh_from_db()
+        self.assertEqual(first.latitude, 1)
+        self.assertEqual(first.last_location_update, self.now - timedelta(seconds=5))
+        self.assertEqual(DriverLocation.objects.count(), 3)
+        self.assertEqual(self.buffer.pending(), (0, 0))
+
+    def test_failed_flush_is_requeued_behind_newer_pings(self):
+        first, second = self.drivers
+        self.ping(first, 10, lat=1)
+        self.ping(second, 10, lat=2)
+        # A newer ping for `first` arrives while the flush is failing
+        self.failing_flush(during=lambda: self.ping(first, 1, lat=9))
+        self.assertEqual(self.buffer.pending(), (2, 3))
+
+        self.assertEqual(self.buffer.flush(), (2, 3))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.latitude, second.latitude), (9, 2))
+        self.assertEqual(DriverLocation.objects.count(), 3)
+
+    def test_requeue_keeps_only_the_newest_history(self):
+        driver = self.drivers[0]
+        for seconds_ago in range(8, 0, -1):
+            self.ping(driver, seconds_ago)
+        with mock.patch.object(location_ingest, 'MAX_RETRY_HISTORY', 5):
+            self.failing_flush()
+        # The three oldest pings are dropped silently; the position is kept
+        self.assertEqual(self.buffer.pending(), (1, 5))
+
+        self.buffer.flush()
+        kept = sorted(DriverLocation.objects.values_list('recorded_at', flat=True))
+        self.assertEqual(kept, [self.now - timedelta(seconds=s) for s in range(5, 0, -1)])
+
+    def test_pings_for_deleted_drivers_are_dropped(self):
+        first, second = self.drivers
+        self.ping(first, 1)
+        self.ping(second, 1)
+        second.delete()
+        with self.assertLogs('requests_app.location_ingest', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), (1, 1))
+        self.assertEqual(self.buffer.pending(), (0, 0))
+
+
+class NotificationInboxTests(TestCase):
+    """Email-addressed notifications land in the account's inbox"""
+
+    def titles(self, user):
+        return sorted(Notification.objects.for_user(user).values_list('title', flat=True))
+
+    def test_linked_on_write_signup_and_email_change(self):
+        user = User.objects.create_user('carol', 'Carol@Example.com')
+        Notification.objects.create(email=' carol@example.COM', title='written')
+        Notification.objects.create(email='later@example.com', title='signup')
+        Notification.objects.create(email='moved@example.com', title='moved')
+
+        later = User.objects.create_user('later', 'later@example.com')
+        user.email = 'moved@example.com'
+        user.save()
+
+        self.assertEqual(self.titles(user), ['moved', 'written'])
+        self.assertEqual(self.titles(later), ['signup'])
+
+    def test_inbox_is_one_index_range_scan(self):
+        user = User.objects.create_user('carol', 'carol@example.com')
+        sql, params = Notification.objects.for_user(user).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('users_notif_user_created_idx', plan)
+        self.assertNotIn('SCAN', plan)
+
+
+class TokenCacheInvalidationTests(TestCase):
+    """Cached token lookups are dropped on logout, password change and deactivation"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user('dana', 'dana@example.com', password='old-password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def me(self):
+        return self.client.get('/api/users/me/')
+
+    def warm(self):
+        self.assertEqual(self.me().status_code, 200)
+        self.assertIsNotNone(cached_token(self.token.key))
+
+    def test_warm_lookup_costs_no_token_query(self):
+        self.warm()
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.me().status_code, 200)
+        self.assertFalse(any('authtoken_token' in query['sql'] for query in captured.captured_queries))
+
+    def test_logout_revokes_the_cached_token(self):
+        self.warm()
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertIsNone(cached_token(self.token.key))
+        self.assertEqual(self.me().status_code, 401)
+
+    def test_password_change_drops_the_cached_user(self):
+        self.warm()
+        response = self.client.patch('/api/users/me/', {'password': 'new-password'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cached_token(self.token.key))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new-password'))
+
+    def test_deactivation_rejects_the_cached_token(self):
+        self.warm()
+        # Another instance, as when an admin deactivates the account
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        self.assertIsNone(cached_token(self.token.key))
+        self.assertEqual(self.me().status_code, 401)
+
+
+class PricingCacheTests(TestCase):
+    """GET /api/pricing/ revalidates with ETags and PUT publishes a new version"""
+
+    def setUp(self):
+        pricing_cache._local_entry = None
+        cache.clear()
+        PricingItem.objects.create(slug='shirt', label='Shirt', price='3.50')
+        self.client = APIClient()
+        self.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+
+    def put(self, price):
+        self.client.force_authenticate(self.admin)
+        response = self.client.put('/api/pricing/', [{'id': 'shirt', 'label': 'Shirt', 'price': price}], format='json')
+        self.client.force_authenticate(None)
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/pricing/')
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_NONE_MATCH': f'"other", {etag}'},
+                        {'HTTP_IF_NONE_MATCH': '*'}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            with self.subTest(headers=headers):
+                response = self.client.get('/api/pricing/', **headers)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+                self.assertEqual(response['ETag'], etag)
+        # If-None-Match wins over a matching If-Modified-Since
+        response = self.client.get('/api/pricing/', HTTP_IF_NONE_MATCH='"other"', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_warm_get_costs_one_version_lookup(self):
+        self.client.get('/api/pricing/')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/pricing/').status_code, 200)
+
+    def test_put_bumps_the_version_and_the_etag(self):
+        etag = self.client.get('/api/pricing/')['ETag']
+        version = current_version(pricing_cache.VERSION_NAME)
+
+        self.put('4.00')
+        self.assertNotEqual(current_version(pricing_cache.VERSION_NAME), version)
+        response = self.client.get('/api/pricing/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data[0]['price'], '4.00')
+
+        # The ETag follows the content, so an unchanged catalog still revalidates
+        etag = response['ETag']
+        self.put('4.00')
+        self.assertEqual(self.client.get('/api/pricing/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class DatabaseBrokerTests(TransactionTestCase):
+    """Events published in one transaction reach subscribers through the StreamEvent table"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('erin', 'erin@example.com')
+        self.token = Token.objects.create(user=self.user)
+
+    def publish_in_transaction(self, broker, count):
+        with transaction.atomic():
+            broker.publish_many([(user_topic(self.user.pk), 'test.event', {'n': n}) for n in range(count)])
+
+    def test_committed_events_reach_an_asgi_stream(self):
+        # Run the ASGI handler on a plain event loop as a server would (async
+        # tests run under async_to_sync, which hides per-request executors)
+        frames = asyncio.run(self.stream_then_publish(2))
+        self.assertIn(b'event: test.event', frames[0])
+        self.assertIn(b'"n": 1', frames[1])
+
+    async def stream_then_publish(self, count):
+        chunks = asyncio.Queue()
+        disconnect = asyncio.Event()
+        messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+
+        async def receive():
+            message = next(messages, None)
+            if message is None:
+                await disconnect.wait()
+                message = {'type': 'http.disconnect'}
+            return message
+
+        async def send(message):
+            await chunks.put(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': '/api/stream/', 'raw_path': b'/api/stream/', 'query_string': b'',
+            'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Token {self.token.key}'.encode())],
+        }
+        request = asyncio.create_task(ASGIHandler()(scope, receive, send))
+        try:
+            self.assertEqual((await asyncio.wait_for(chunks.get(), 5))['status'], 200)
+            self.assertTrue((await asyncio.wait_for(chunks.get(), 5))['body'].startswith(b'retry:'))
+            await sync_to_async(self.publish_in_transaction)(get_broker(), count)
+            return [(await asyncio.wait_for(chunks.get(), 5))['body'] for _ in range(count)]
+        finally:
+            disconnect.set()
+            await asyncio.wait_for(request, 5)
+            # Let the poller see there are no subscribers left, then close the
+            # worker thread's connection so the test database can be dropped
+            await asyncio.wait_for(get_broker()._pollers[asyncio.get_running_loop()], 5)
+            await sync_to_async(connections.close_all)()
+
+    async def test_subscriber_is_delivered_after_commit_only(self):
+        broker = DatabaseBroker()
+        subscription = broker.subscribe(user_topic(self.user.pk))
+        try:
+            await sync_to_async(self.publish_in_transaction)(broker, 3)
+            events = [await subscription.get(timeout=5) for _ in range(3)]
+        finally:
+            subscription.close()
+        self.assertEqual([event['data']['n'] for event in events], [0, 1, 2])
+        self.assertEqual(len({event['id'] for event in events}), 3)
+
+    def test_fetch_rechecks_ids_that_commit_late(self):
+        broker = DatabaseBroker()
+        topic = user_topic(self.user.pk)
+        for event_id in (1, 2, 4):
+            StreamEvent.objects.create(id=event_id, topic=topic, event_type='test.event', data={})
+        gaps = {}
+        rows, last_id = broker._fetch(0, gaps)
+        self.assertEqual(([row[0] for row in rows], last_id), ([1, 2, 4], 4))
+        self.assertEqual(list(gaps), [3])
+
+        # Id 3 was allocated first but its transaction commits after the poll
+        StreamEvent.objects.create(id=3, topic=topic, event_type='test.event', data={})
+        StreamEvent.objects.create(id=5, topic=topic, event_type='test.event', data={})
+        rows, last_id = broker._fetch(last_id, gaps)
+        self.assertEqual(([row[0] for row in rows], last_id, gaps), ([3, 5], 5, {}))
+
+    def test_gaps_are_given_up_after_the_wait(self):
+        broker = DatabaseBroker()
+        topic = user_topic(self.user.pk)
+        StreamEvent.objects.create(id=2, topic=topic, event_type='test.event', data={})
+        gaps = {}
+        _, last_id = broker._fetch(0, gaps)
+        self.assertEqual(list(gaps), [1])
+        with mock.patch('utils.events.time.monotonic', return_value=time.monotonic() + broker.GAP_WAIT_SECONDS + 1):
+            StreamEvent.objects.create(id=1, topic=topic, event_type='test.event', data={})
+            rows, _ = broker._fetch(last_id, gaps)
+        self.assertEqual((rows, gaps), ([], {}))
+
+
+class RequestRollupTests(TestCase):
+    """Rollups fold each settled event in once, into its hour and day buckets"""
+
+    START = timezone.make_aware(datetime(2026, 3, 4, 10, 20, 30))
+
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', 'customer@example.com')
+        self.driver = Driver.objects.create(name='Dee')
+
+    def add_request(self, created_at, service_type='wash_dry'):
+        laundry_request = LaundryRequest.objects.create(
+            customer=self.customer, customer_name='Customer', phone='1', address='1 Road', service_type=service_type,
+        )
+        LaundryRequest.objects.filter(pk=laundry_request.pk).update(created_at=created_at)
+        record_transitions([Transition(laundry_request.pk, '', 'pending', None, None, created_at)])
+        return laundry_request
+
+    def log(self, laundry_request, from_status, to_status, at, from_driver=None):
+        record_transitions([Transition(laundry_request.pk, from_status, to_status, from_driver, self.driver.pk, at)])
+
+    def roll_up(self, **kwargs):
+        return rollups.rollup_events(now=self.START + timedelta(days=30), **kwargs)
+
+    def test_bucket_start(self):
+        self.assertEqual(rollups.bucket_start(self.START, 'hour'), timezone.make_aware(datetime(2026, 3, 4, 10)))
+        self.assertEqual(rollups.bucket_start(self.START, 'day'), timezone.make_aware(datetime(2026, 3, 4)))
+
+    def test_events_land_in_their_hour_and_day(self):
+        first_hour = timezone.make_aware(datetime(2026, 3, 4, 10))
+        self.add_request(first_hour + timedelta(minutes=59, seconds=59))
+        self.add_request(first_hour + timedelta(hours=1), service_type='suits')
+        self.add_request(first_hour + timedelta(hours=14))  # midnight: the next day
+        self.assertEqual(self.roll_up(), 3)
+
+        until = first_hour + timedelta(days=2)
+        hourly = rollups.stats('hour', since=first_hour, until=until)
+        self.assertEqual([(b['start'], b['created']) for b in hourly['buckets']], [
+            (first_hour, 1), (first_hour + timedelta(hours=1), 1), (first_hour + timedelta(hours=14), 1),
+        ])
+        daily = rollups.stats('day', since=first_hour, until=until)
+        self.assertEqual([(b['start'], b['created']) for b in daily['buckets']], [
+            (timezone.make_aware(datetime(2026, 3, 4)), 2), (timezone.make_aware(datetime(2026, 3, 5)), 1),
+        ])
+        self.assertEqual({name: m['created'] for name, m in daily['service_types'].items()},
+                         {'wash_dry': 2, 'suits': 1})
+        # The range starts at the bucket holding `since`
+        self.assertEqual(rollups.stats('hour', since=first_hour + timedelta(minutes=30), until=until)['totals']['created'], 3)
+
+    def test_lead_time_runs_from_pending_to_completed(self):
+        slow, quick, dropped = (self.add_request(self.START) for _ in range(3))
+        self.log(slow, 'pending', 'assigned', self.START + timedelta(minutes=10))
+        self.log(slow, 'assigned', 'assigned', self.START + timedelta(minutes=20), from_driver=self.driver.pk)
+        self.log(slow, 'assigned', 'completed', self.START + timedelta(minutes=90), from_driver=self.driver.pk)
+        self.log(quick, 'pending', 'completed', self.START + timedelta(minutes=30))
+        self.log(dropped, 'pending', 'cancelled', self.START + timedelta(minutes=5))
+        self.assertEqual(self.roll_up(), 8)
+
+        summary = rollups.stats('day', since=self.START, until=self.START + timedelta(days=1))
+        self.assertEqual(summary['totals'], {'created': 3, 'completed': 2, 'cancelled': 1,
+                                             'avg_lead_time_seconds': (90 * 60 + 30 * 60) // 2})
+        self.assertEqual(summary['drivers'], [{'driver_id': self.driver.pk, 'completed': 2, 'cancelled': 1}])
+        # Each completion is counted in the hour it happened
+        hourly = rollups.stats('hour', since=self.START, until=self.START + timedelta(days=1))['buckets']
+        self.assertEqual([(b['start'].hour, b['completed'], b['avg_lead_time_seconds']) for b in hourly],
+                         [(10, 1, 30 * 60), (11, 1, 90 * 60)])
+
+    @override_settings(ROLLUP_SETTLE_SECONDS=120)
+    def test_watermark_waits_for_events_to_settle_and_counts_them_once(self):
+        self.add_request(self.START)
+        settled = self.START + timedelta(seconds=120)
+        self.assertEqual(rollups.rollup_events(now=settled - timedelta(seconds=1)), 0)
+        self.assertEqual(rollups.rollup_events(now=settled), 1)
+        self.assertEqual(rollups.rollup_events(now=settled), 0)
+
+        for minutes in (1, 2, 3):
+            self.add_request(self.START + timedelta(minutes=minutes))
+        self.assertEqual(self.roll_up(batch_size=2), 2)
+        self.assertEqual(self.roll_up(batch_size=2), 1)
+        self.assertEqual(self.roll_up(batch_size=2), 0)
+        self.assertEqual(RollupWatermark.objects.get(name=rollups.WATERMARK_NAME).last_event_id,
+                         RequestStatusEvent.objects.latest('id').id)
+
+        def totals():
+            return rollups.stats('day', since=self.START, until=self.START + timedelta(days=1))['totals']['created']
+
+        self.assertEqual(totals(), 4)
+        rollups.reset_rollups()
+        self.assertFalse(RequestRollup.objects.exists())
+        self.assertEqual(self.roll_up(), 4)
+        self.assertEqual(totals(), 4)
+
+
+class RequestImportTests(TestCase):
+    """The NDJSON importer keeps the good lines of a batch, backdates them and resumes where it stopped"""
+
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', 'Customer@Example.com')
+        self.driver = Driver.objects.create(name='Dee')
+
+    def row(self, **fields):
+        return json.dumps({'customer_email': 'customer@example.com', 'customer_name': 'Customer',
+                           'address': '1 Road', **fields}).encode()
+
+    def test_mixed_batch_keeps_the_valid_lines(self):
+        lines = list(enumerate([
+            self.row(),
+            b'{not json',
+            b'[1, 2]',
+            self.row(customer_email='', customer_id=self.customer.pk, status='assigned', driver_id=self.driver.pk),
+            self.row(customer_email='', customer_id=999999),
+            self.row(customer_email='nobody@example.com'),
+            self.row(driver_id=999999),
+            self.row(service_type='starching'),
+            self.row(customer_email=''),
+        ], start=1))
+        created, errors = importer.import_batch(lines)
+
+        self.assertEqual(created, 2)
+        self.assertEqual([line for line, _ in errors], [2, 3, 5, 6, 7, 8, 9])
+        self.assertIn('customer_id', dict(errors)[5])
+        self.assertIn('customer_email', dict(errors)[6])
+        self.assertIn('driver_id', dict(errors)[7])
+        self.assertIn('service_type', dict(errors)[8])
+        imported = LaundryRequest.objects.filter(customer=self.customer).order_by('id')
+        self.assertEqual([(r.status, r.driver_id) for r in imported], [('pending', None), ('assigned', self.driver.pk)])
+        self.assertEqual(RequestStatusEvent.objects.filter(request__in=imported, source='import').count(), 2)
+        self.assertEqual(dict(RequestStatusCount.objects.values_list('status', 'count')), {'pending': 1, 'assigned': 1})
+
+    def test_created_at_is_backdated(self):
+        stamp = timezone.now() - timedelta(days=400)
+        before = timezone.now()
+        created, errors = importer.import_batch([(1, self.row(created_at=stamp.isoformat())), (2, self.row())])
+        self.assertEqual((created, errors), (2, []))
+
+        old, new = LaundryRequest.objects.order_by('id')
+        self.assertEqual(old.created_at, stamp)
+        self.assertGreaterEqual(new.created_at, before)
+        events = dict(RequestStatusEvent.objects.values_list('request_id', 'created_at'))
+        self.assertEqual(events, {old.pk: stamp, new.pk: new.created_at})
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'requests.ndjson')
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            with open(path, 'wb') as fh:
+                fh.write(b'\n'.join([self.row(items_description=str(n)) if n != 3 else b'{bad' for n in range(1, 8)]))
+
+            real_import_batch = importer.import_batch
+            calls = []
+
+            def interrupted(*args, **kwargs):
+                calls.append(args)
+                if len(calls) == 3:
+                    raise KeyboardInterrupt
+                return real_import_batch(*args, **kwargs)
+
+            options = {'batch_size': 2, 'checkpoint': checkpoint, 'stdout': StringIO(), 'stderr': StringIO()}
+            with mock.patch('requests_app.importer.import_batch', side_effect=interrupted):
+                with self.assertRaises(CommandError):
+                    call_command('import_requests', path, **options)
+            with open(checkpoint) as fh:
+                self.assertEqual(json.load(fh)['line'], 4)
+            self.assertEqual(LaundryRequest.objects.count(), 3)
+
+            stdout = StringIO()
+            call_command('import_requests', path, **{**options, 'stdout': stdout})
+        self.assertIn('Resuming after line 4', stdout.getvalue())
+        self.assertIn('Created 3 request(s); rejected 0 line(s); read through line 7', stdout.getvalue())
+        self.assertEqual(sorted(LaundryRequest.objects.values_list('items_description', flat=True)),
+                         ['1', '2', '4', '5', '6', '7'])
+
+
+class ProjectionRebuildTests(TestCase):
+    """Rebuilding the projections from scratch gives the rows kept up incrementally"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+        self.customers = [User.objects.create_user(f'customer{i}', f'customer{i}@example.com') for i in range(2)]
+        self.drivers = [Driver.objects.create(name=f'Driver {i}') for i in range(2)]
+        self.client = APIClient()
+        # Every API call happens some minutes after the previous one
+        self.now = timezone.now()
+        self.rng = random.Random(22)
+
+    def tick(self):
+        self.now += timedelta(minutes=self.rng.randint(1, 90))
+        return self.now
+
+    def api(self, method, url, user=None, **data):
+        self.client.force_authenticate(user or self.admin)
+        with mock.patch('django.utils.timezone.now', side_effect=self.tick):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.data if hasattr(response, 'data') else response)
+        return response
+
+    def create(self, customer):
+        return self.api('post', '/api/requests/', customer, customer_name='Customer', address='1 Road').data['id']
+
+    def assign(self, pk, driver):
+        self.api('post', f'/api/requests/{pk}/assign/', driver_id=driver.pk)
+
+    def move(self, pk, *statuses):
+        for status in statuses:
+            self.api('post', f'/api/requests/{pk}/update_status/', status=status)
+
+    def projections(self):
+        return (
+            dict(RequestStatusCount.objects.exclude(count=0).values_list('status', 'count')),
+            dict(DriverLoad.objects.exclude(active=0).values_list('driver_id', 'active')),
+            {(row.status, row.upper_seconds): (row.count, row.total_seconds)
+             for row in StatusDurationBucket.objects.exclude(count=0)},
+        )
+
+    def assert_rebuild_matches(self):
+        incremental = self.projections()
+        rebuild_projections()
+        self.assertEqual(self.projections(), incremental)
+
+    def test_rebuild_matches_after_create_transition_and_delete(self):
+        first, second = self.drivers
+        requests = [self.create(self.customers[i % 2]) for i in range(8)]
+        self.assert_rebuild_matches()
+
+        self.assign(requests[0], first)
+        self.move(requests[0], 'picked_up', 'in_progress', 'completed')
+        self.assign(requests[1], first)
+        self.assign(requests[1], second)  # re-assignment moves the load
+        self.move(requests[1], 'picked_up')
+        self.assign(requests[2], second)
+        self.move(requests[2], 'cancelled')
+        self.assign(requests[3], first)
+        self.api('patch', f'/api/requests/{requests[4]}/', status='assigned', driver_id=second.pk)
+        self.assign(requests[5], second)
+        self.move(requests[5], 'picked_up', 'in_progress')
+        self.assert_rebuild_matches()
+
+        self.api('delete', f'/api/requests/{requests[3]}/')  # assigned
+        self.api('delete', f'/api/requests/{requests[6]}/')  # pending
+        self.customers[1].delete()  # cascades to requests 1, 5 and 7
+        self.assertEqual(LaundryRequest.objects.count(), 3)
+        self.assert_rebuild_matches()
+
+
+class SettingOverrideTests(SimpleTestCase):
+    """Tunables are read when used, so override_settings reaches them"""
+
+    def test_module_tunables_follow_overrides(self):
+        with override_settings(NOTIFICATION_OUTBOX_BACKOFF_SECONDS=1, NOTIFICATION_OUTBOX_MAX_BACKOFF_SECONDS=4):
+            self.assertEqual([backoff_delay(n).total_seconds() for n in (1, 2, 3, 4)], [1, 2, 4, 4])
+        with override_settings(STATUS_DURATION_BUCKETS=(10, 60)):
+            self.assertEqual([duration_bucket(s) for s in (5, 30, 61)], [10, 60, 0])
+        self.assertEqual(duration_bucket(30), 300)
+
+    def test_shared_instances_follow_overrides(self):
+        with override_settings(DRIVER_LOCATION_FLUSH_SECONDS=1, DRIVER_LOCATION_HISTORY=False):
+            self.assertEqual((location_ingest.buffer.flush_seconds, location_ingest.buffer.keep_history), (1, False))
+        with override_settings(AUTH_TOKEN_CACHE_SIZE=3, AUTH_TOKEN_CACHE_TTL=7):
+            self.assertEqual((token_cache.maxsize, token_cache.ttl), (3, 7))
+        with override_settings(DRIVER_INDEX_CELL_DEGREES=0.5):
+            self.assertEqual(DriverGridIndex().cell, 0.5)
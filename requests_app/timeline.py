@@ -0,0 +1,218 @@
+"""Request status event log and the projections maintained from it.
+
+Every status or driver change is appended to RequestStatusEvent by
+`record_transitions()`, inside the caller's transaction. The same call
+applies the change to three small projection tables with F() increments
+instead of recomputing them from LaundryRequest:
+
+- RequestStatusCount: requests currently in each status
+- DriverLoad: active requests per driver
+- StatusDurationBucket: histogram of time spent in each status
+
+so dashboards read a handful of summary rows whatever the table size.
+Deleting a request (API, admin, or a cascade from its customer) takes it
+back out of the counts via `forget_request()`, and its stays out of the
+histogram via `forget_durations()`; deletes are deliberately not logged as
+events, since a request's events are deleted along with it.
+`manage.py rebuild_status_projections` recomputes them from scratch if
+they ever drift (e.g. after raw SQL edits).
+"""
+from collections import Counter, namedtuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from utils.conf import Setting
+from .models import (
+    DriverLoad, LaundryRequest, RequestStatusCount, RequestStatusEvent, StatusDurationBucket,
+)
+
+ACTIVE_STATUSES = ('assigned', 'picked_up', 'in_progress')
+# Histogram bucket upper bounds in seconds (5m .. 1d); longer stays land in the overflow bucket 0
+DURATION_BUCKETS = Setting(
+    'STATUS_DURATION_BUCKETS', (300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 12 * 3600, 24 * 3600),
+)
+
+# `at` backdates the event (e.g. imported history); it defaults to record_transitions' `now`
+Transition = namedtuple(
+    'Transition', 'request_id from_status to_status from_driver_id to_driver_id at', defaults=(None,),
+)
+
+
+def duration_bucket(seconds):
+    for upper in DURATION_BUCKETS.value:
+        if seconds <= upper:
+            return upper
+    return 0
+
+
+def increment_row(model, lookup, **deltas):
+    """Add `deltas` to the row matching `lookup`, creating it on first use"""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Created concurrently; fall back to the increment
+        model.objects.filter(**lookup).update(**changes)
+
+
+def record_transitions(transitions, actor=None, source='', now=None):
+    """Append events for `transitions` and fold them into the projections.
+
+    `transitions` is an iterable of Transition; use from_status='' for a
+    newly created request. Must be called inside the transaction that
+    made the change so the log and projections commit (or roll back) with it.
+    """
+    transitions = list(transitions)
+    if not transitions:
+        return []
+    now = now or timezone.now()
+    actor_id = getattr(actor, 'pk', actor)
+
+    # When did each request first enter the status it is leaving? One query for the batch.
+    # Statuses only move forward, so the earliest such event is the entry time
+    # (re-assigning a driver doesn't restart the clock).
+    leaving = {t.request_id: t.from_status for t in transitions if t.from_status and t.from_status != t.to_status}
+    entered = {}
+    if leaving:
+        rows = (
+            RequestStatusEvent.objects.filter(request_id__in=leaving, to_status__in=set(leaving.values()))
+            .values('request_id', 'to_status').annotate(at=Min('created_at'))
+            .values_list('request_id', 'to_status', 'at')
+        )
+        entered = {request_id: at for request_id, status, at in rows if leaving[request_id] == status}
+
+    events = RequestStatusEvent.objects.bulk_create([
+        RequestStatusEvent(
+            request_id=t.request_id, from_status=t.from_status, to_status=t.to_status,
+            driver_id=t.to_driver_id, actor_id=actor_id, source=source, created_at=t.at or now,
+        )
+        for t in transitions
+    ])
+
+    status_deltas = Counter()
+    load_deltas = Counter()
+    durations = Counter()
+    duration_totals = Counter()
+    for t in transitions:
+        if t.from_status != t.to_status:
+            if t.from_status:
+                status_deltas[t.from_status] -= 1
+            status_deltas[t.to_status] += 1
+        was_active = t.from_status in ACTIVE_STATUSES and t.from_driver_id
+        is_active = t.to_status in ACTIVE_STATUSES and t.to_driver_id
+        if was_active:
+            load_deltas[t.from_driver_id] -= 1
+        if is_active:
+            load_deltas[t.to_driver_id] += 1
+        if t.request_id in entered and t.from_status != t.to_status:
+            seconds = max(0, int((now - entered[t.request_id]).total_seconds()))
+            key = (t.from_status, duration_bucket(seconds))
+            durations[key] += 1
+            duration_totals[key] += seconds
+
+    for status, delta in status_deltas.items():
+        increment_row(RequestStatusCount, {'status': status}, count=delta)
+    for driver_id, delta in load_deltas.items():
+        increment_row(DriverLoad, {'driver_id': driver_id}, active=delta)
+    for (status, upper), count in durations.items():
+        increment_row(StatusDurationBucket, {'status': status, 'upper_seconds': upper},
+                   count=count, total_seconds=duration_totals[(status, upper)])
+    return events
+
+
+def record_transition(request_id, from_status, to_status, from_driver_id=None, to_driver_id=None, **kwargs):
+    return record_transitions(
+        [Transition(request_id, from_status, to_status, from_driver_id, to_driver_id)], **kwargs,
+    )
+
+
+def forget_request(status, driver_id=None):
+    """Take a deleted request out of the status count and driver load projections.
+
+    Plain decrements without increment_row's create fallback: during a
+    cascade the driver (and its DriverLoad row) may be going away too.
+    """
+    RequestStatusCount.objects.filter(status=status).update(count=F('count') - 1)
+    if driver_id and status in ACTIVE_STATUSES:
+        DriverLoad.objects.filter(driver_id=driver_id).update(active=F('active') - 1)
+
+
+def forget_durations(request_id):
+    """Take a request's stays out of the time-in-state histogram.
+
+    Called before the delete, while its events still exist to replay.
+    """
+    rows = RequestStatusEvent.objects.filter(request_id=request_id).order_by('created_at', 'id').values_list(
+        'request_id', 'from_status', 'to_status', 'created_at',
+    )
+    counts, totals = replay_durations(rows)
+    for (status, upper), n in counts.items():
+        StatusDurationBucket.objects.filter(status=status, upper_seconds=upper).update(
+            count=F('count') - n, total_seconds=F('total_seconds') - totals[(status, upper)],
+        )
+
+
+def replay_durations(rows):
+    """Histogram (counts, total seconds) per (status, bucket) from event rows.
+
+    `rows` are (request_id, from_status, to_status, created_at), ordered by
+    request and then time.
+    """
+    counts = Counter()
+    totals = Counter()
+    current_request = None
+    entered = {}
+    for request_id, from_status, to_status, created_at in rows:
+        if request_id != current_request:
+            current_request, entered = request_id, {}
+        if from_status != to_status and from_status in entered:
+            seconds = max(0, int((created_at - entered[from_status]).total_seconds()))
+            key = (from_status, duration_bucket(seconds))
+            counts[key] += 1
+            totals[key] += seconds
+        entered.setdefault(to_status, created_at)
+    return counts, totals
+
+
+def rebuild_projections():
+    """Recompute every projection from LaundryRequest and the event log.
+
+    Returns (statuses, drivers, histogram_buckets) row counts.
+    """
+    with transaction.atomic():
+        RequestStatusCount.objects.all().delete()
+        RequestStatusCount.objects.bulk_create([
+            RequestStatusCount(status=row['status'], count=row['n'])
+            for row in LaundryRequest.objects.order_by().values('status').annotate(n=Count('id'))
+        ])
+
+        DriverLoad.objects.all().delete()
+        DriverLoad.objects.bulk_create([
+            DriverLoad(driver_id=row['driver'], active=row['n'])
+            for row in LaundryRequest.objects.filter(status__in=ACTIVE_STATUSES, driver__isnull=False)
+            .order_by().values('driver').annotate(n=Count('id'))
+        ])
+
+        # Replay each request's events to rebuild the time-in-state histogram
+        rows = RequestStatusEvent.objects.order_by('request_id', 'created_at', 'id').values_list(
+            'request_id', 'from_status', 'to_status', 'created_at',
+        )
+        counts, totals = replay_durations(rows.iterator(chunk_size=5000))
+        StatusDurationBucket.objects.all().delete()
+        StatusDurationBucket.objects.bulk_create([
+            StatusDurationBucket(status=status, upper_seconds=upper, count=n, total_seconds=totals[(status, upper)])
+            for (status, upper), n in counts.items()
+        ])
+    return (
+        RequestStatusCount.objects.count(),
+        DriverLoad.objects.count(),
+        StatusDurationBucket.objects.count(),
+    )
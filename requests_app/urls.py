@@ -5,9 +5,12 @@ from .views import LaundryRequestViewSet, DriverViewSet
 router = routers.DefaultRouter()
 router.register(r'requests', LaundryRequestViewSet, basename='laundryrequest')
 router.register(r'drivers', DriverViewSet, basename='driver')
-from .views import PricingAPIView
+from .views import PricingAPIView, StatsAPIView
+from .streams import request_driver_stream
 
 urlpatterns = [
+    path('requests/<int:pk>/track/', request_driver_stream, name='laundryrequest-track'),
     path('', include(router.urls)),
     path('pricing/', PricingAPIView.as_view(), name='pricing'),
+    path('stats/', StatsAPIView.as_view(), name='stats'),
 ]
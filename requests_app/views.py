@@ -1,39 +1,64 @@
 from rest_framework import viewsets, permissions
-from rest_framework.authentication import TokenAuthentication
+from users.authentication import CachingTokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.utils import timezone
 from .models import LaundryRequest, Driver
-from .serializers import LaundryRequestSerializer, DriverSerializer
+from .serializers import LaundryRequestSerializer, DriverSerializer, RequestStatusEventSerializer
 from .models import PricingItem
-from .serializers import PricingItemSerializer
-from utils.email_service import (
-    notify_new_request,
-    notify_request_status_update,
-    notify_driver_assignment,
-)
+from .serializers import PricingItemSerializer, PricingItemPayloadSerializer
+from utils.outbox import enqueue_notification
+from utils.events import publish_driver_position, publish_request_event
+from utils.pagination import CreatedAtCursorPagination
+from django.conf import settings
+from .spatial import get_driver_index, nearest_drivers_from_db
+from . import location_ingest
+from .timeline import record_transition
+from utils.export import REQUEST_COLUMNS, export_response, filter_requests
+from .importer import import_lines, read_lines
 
 
 class LaundryRequestViewSet(viewsets.ModelViewSet):
     # Use token authentication for request creation/updating so CSRF is not enforced
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachingTokenAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = LaundryRequestSerializer
+    pagination_class = CreatedAtCursorPagination
+    # Rejected lines listed in a bulk-import response (the count covers all of them)
+    BULK_IMPORT_MAX_ERRORS = 1000
 
     def get_queryset(self):
         user = self.request.user
         # Staff can see all requests, regular users only see their own
         if user.is_staff:
-            return LaundryRequest.objects.all().order_by('-created_at')
-        return LaundryRequest.objects.filter(customer=user).order_by('-created_at')
+            qs = LaundryRequest.objects.all()
+        else:
+            qs = LaundryRequest.objects.filter(customer=user)
+        return LaundryRequestSerializer.eager_load(qs).order_by('-created_at')
     
     def perform_create(self, serializer):
         # Automatically set the customer to the current user
-        request = serializer.save(customer=self.request.user)
-        # Send email notifications and persist in-app notifications
-        notify_new_request(request)
+        with transaction.atomic():
+            request = serializer.save(customer=self.request.user)
+            record_transition(request.id, '', request.status, to_driver_id=request.driver_id,
+                              actor=self.request.user, source='create')
+            # Queue email and in-app notifications for the background worker
+            enqueue_notification('new_request', request_id=request.id)
+            publish_request_event(request, 'request.created')
+
+    def perform_update(self, serializer):
+        old_status, old_driver_id = serializer.instance.status, serializer.instance.driver_id
+        with transaction.atomic():
+            laundry_request = serializer.save()
+            if (laundry_request.status, laundry_request.driver_id) != (old_status, old_driver_id):
+                record_transition(laundry_request.pk, old_status, laundry_request.status,
+                                  old_driver_id, laundry_request.driver_id,
+                                  actor=self.request.user, source='update')
+                publish_request_event(laundry_request, 'request.status', old_status=old_status)
 
     @action(detail=True, methods=['post'])
     def assign(self, request, pk=None):
@@ -45,11 +70,31 @@ class LaundryRequestViewSet(viewsets.ModelViewSet):
             driver = Driver.objects.get(pk=driver_id)
         except Driver.DoesNotExist:
             return Response({'detail': 'Driver not found'}, status=404)
-        request_obj.driver = driver
-        request_obj.status = 'assigned'
-        request_obj.save()
-        # Send email notifications and persist in-app notifications
-        notify_driver_assignment(request_obj)
+        if request_obj.status not in LaundryRequest.ASSIGNABLE_STATUSES:
+            return Response(
+                {'detail': f'Cannot assign a driver to a request that is {request_obj.status}'},
+                status=400
+            )
+        now = timezone.now()
+        with transaction.atomic():
+            # Only succeeds if nobody changed the status or driver since we read them
+            assigned = LaundryRequest.objects.compare_and_set(
+                request_obj.pk,
+                {'status': request_obj.status, 'driver_id': request_obj.driver_id},
+                status='assigned',
+                driver=driver,
+                updated_at=now,
+            )
+            if not assigned:
+                return self._conflict(request_obj)
+            record_transition(request_obj.pk, request_obj.status, 'assigned', request_obj.driver_id, driver.pk,
+                              actor=request.user, source='assign', now=now)
+            request_obj.driver = driver
+            request_obj.status = 'assigned'
+            request_obj.updated_at = now
+            # Queue email and in-app notifications for the background worker
+            enqueue_notification('driver_assignment', request_id=request_obj.id)
+            publish_request_event(request_obj, 'request.assigned', driver_user_id=driver.user_id)
         return Response(self.get_serializer(request_obj).data)
         
     @action(detail=True, methods=['post'])
@@ -67,29 +112,112 @@ class LaundryRequestViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'status is required'}, status=400)
             
         # Validate status transition
-        valid_transitions = {
-            'assigned': ['picked_up', 'cancelled'],
-            'picked_up': ['in_progress'],
-            'in_progress': ['completed'],
-        }
-        
-        if new_status not in valid_transitions.get(laundry_request.status, []):
+        if new_status not in LaundryRequest.STATUS_TRANSITIONS.get(old_status, ()):
             return Response(
-                {'detail': f'Cannot transition from {laundry_request.status} to {new_status}'},
+                {'detail': f'Cannot transition from {old_status} to {new_status}'},
                 status=400
             )
             
-        laundry_request.status = new_status
-        laundry_request.save()
-        
-        # Send email notifications and persist in-app notifications
-        notify_request_status_update(laundry_request, old_status)
+        now = timezone.now()
+        with transaction.atomic():
+            # Compare-and-swap on the status (and driver) we validated against
+            updated = LaundryRequest.objects.compare_and_set(
+                laundry_request.pk,
+                {'status': old_status, 'driver_id': laundry_request.driver_id},
+                status=new_status,
+                updated_at=now,
+            )
+            if not updated:
+                return self._conflict(laundry_request)
+            record_transition(laundry_request.pk, old_status, new_status,
+                              laundry_request.driver_id, laundry_request.driver_id,
+                              actor=request.user, source='status', now=now)
+            laundry_request.status = new_status
+            laundry_request.updated_at = now
+            # Queue email and in-app notifications for the background worker
+            enqueue_notification(
+                'request_status_update',
+                request_id=laundry_request.id,
+                old_status=old_status,
+                new_status=new_status,
+            )
+            publish_request_event(laundry_request, 'request.status', old_status=old_status)
         
         return Response(self.get_serializer(laundry_request).data)
 
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """Staff-only streaming export of all requests.
+
+        ?output=csv|ndjson (`format` is taken by DRF), ?compress=gzip, and
+        filters since/until (ISO date or datetime), status (comma-separated)
+        and driver (id or "none").
+        """
+        params = request.query_params
+        try:
+            queryset = filter_requests(
+                LaundryRequest.objects.all(),
+                since=params.get('since'), until=params.get('until'),
+                status=params.get('status'), driver=params.get('driver'),
+            )
+            return export_response(
+                queryset, REQUEST_COLUMNS, 'laundry-requests',
+                output=params.get('output', 'csv'), compress=params.get('compress') == 'gzip',
+                request=request,
+            )
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=400)
+
+    @action(detail=False, methods=['post'], url_path='bulk-import', permission_classes=[permissions.IsAdminUser])
+    def bulk_import(self, request):
+        """Staff-only bulk create from an NDJSON body, one request per line.
+
+        Accepts the `export?output=ndjson` format. Lines are imported in
+        batches that commit independently; invalid lines are skipped and
+        listed in `errors`. After an interrupted upload, resend the file
+        with ?start_line=<last_line> to skip what was already imported.
+        """
+        try:
+            start_line = int(request.query_params.get('start_line', 0))
+        except ValueError:
+            return Response({'detail': 'start_line must be an integer'}, status=400)
+        if request.stream is None:
+            return Response({'detail': 'Request body is empty'}, status=400)
+
+        errors = []
+
+        def on_batch(result):
+            room = self.BULK_IMPORT_MAX_ERRORS - len(errors)
+            errors.extend({'line': line, 'errors': detail} for line, detail in result.errors[:max(room, 0)])
+
+        lines = (item for item in read_lines(request.stream) if item[0] > start_line)
+        created, failed, last_line = import_lines(lines, actor=request.user, on_batch=on_batch)
+        return Response({
+            'created': created,
+            'failed': failed,
+            'last_line': max(last_line, start_line),
+            'errors': errors,
+        })
+
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """Status and driver changes of a request, oldest first"""
+        laundry_request = self.get_object()
+        events = laundry_request.status_events.order_by('created_at', 'id')
+        return Response(RequestStatusEventSerializer(events, many=True).data)
+
+    def _conflict(self, laundry_request):
+        """409 for a transition that lost a race; includes the current state"""
+        current = LaundryRequest.objects.filter(pk=laundry_request.pk).values('status', 'driver_id').first() or {}
+        return Response({
+            'detail': 'This request was changed by someone else; reload it and try again.',
+            'status': current.get('status'),
+            'driver_id': current.get('driver_id'),
+        }, status=409)
+
 
 class DriverViewSet(viewsets.ModelViewSet):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachingTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = DriverSerializer
     
@@ -97,8 +225,8 @@ class DriverViewSet(viewsets.ModelViewSet):
         # Admin sees all, drivers see only themselves
         user = self.request.user
         if user.is_staff:
-            return Driver.objects.all()
-        return Driver.objects.filter(user=user)
+            return Driver.objects.select_related('user')
+        return Driver.objects.filter(user=user).select_related('user')
     
     @action(detail=False, methods=['get'])
     def me(self, request):
@@ -111,19 +239,83 @@ class DriverViewSet(viewsets.ModelViewSet):
     def my_requests(self, request):
         """Get requests assigned to the authenticated driver"""
         driver = get_object_or_404(Driver, user=request.user)
-        requests = LaundryRequest.objects.filter(driver=driver).order_by('-created_at')
-        serializer = LaundryRequestSerializer(requests, many=True)
-        return Response(serializer.data)
+        requests = LaundryRequestSerializer.eager_load(
+            LaundryRequest.objects.filter(driver=driver)
+        ).order_by('-created_at')
+        # Driver listings have no created_at, so paginate this action on its own
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(requests, request, view=self)
+        serializer = LaundryRequestSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
         
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def nearest(self, request):
+        """Find the k nearest available drivers to ?lat=&lng= (staff only).
+
+        Optional: k (default 5, max 50), radius_km to cap the search, and
+        source=db to bypass the in-memory index and use the database
+        bounding-box query instead.
+        """
+        try:
+            lat = float(request.query_params['lat'])
+            lng = float(request.query_params['lng'])
+            k = min(max(int(request.query_params.get('k', 5)), 1), 50)
+            radius = request.query_params.get('radius_km')
+            radius_km = float(radius) if radius not in (None, '') else None
+        except (KeyError, ValueError):
+            return Response({'detail': 'lat and lng are required numbers; k must be an integer'}, status=400)
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return Response({'detail': 'lat/lng out of range'}, status=400)
+
+        use_db = (request.query_params.get('source') == 'db'
+                  or not getattr(settings, 'DRIVER_SPATIAL_INDEX_ENABLED', True))
+        if use_db:
+            matches = nearest_drivers_from_db(lat, lng, k=k, radius_km=radius_km or 25)
+        else:
+            matches = get_driver_index().nearest(lat, lng, k=k, radius_km=radius_km)
+
+        drivers = Driver.objects.select_related('user').in_bulk([driver_id for _, driver_id in matches])
+        results = []
+        for distance, driver_id in matches:
+            driver = drivers.get(driver_id)
+            # The index can briefly lag behind deletions and availability changes
+            if driver is None or not driver.is_available:
+                continue
+            data = DriverSerializer(driver).data
+            data['distance_km'] = round(distance, 3)
+            results.append(data)
+        return Response(results)
+
     @action(detail=False, methods=['post'])
     def update_location(self, request):
         """Update driver's current location and availability"""
         driver = get_object_or_404(Driver, user=request.user)
         serializer = DriverSerializer(driver, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        driver = serializer.save()
+        if 'latitude' in serializer.validated_data or 'longitude' in serializer.validated_data:
+            publish_driver_position(driver.pk, driver.latitude, driver.longitude, driver.last_location_update)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def locations(self, request):
+        """Lightweight, batched location ingestion for the authenticated driver.
+
+        Accepts {"points": [{"latitude", "longitude", "recorded_at"?}, ...]}
+        (or a single point object). Points are buffered in memory and flushed
+        in bulk every few seconds, so this returns 202 without writing to
+        the database. Use update_location to change availability.
+        """
+        driver_id = location_ingest.driver_id_for_user(request.user)
+        if driver_id is None:
+            return Response({'detail': 'No driver profile for this user.'}, status=404)
+        try:
+            points = location_ingest.parse_points(request.data)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=400)
+        location_ingest.buffer.add(driver_id, points)
+        return Response({'accepted': len(points)}, status=202)
+
     def perform_create(self, serializer):
         # When creating a driver, link to current user for non-staff users.
         # Admins can create driver records without linking to themselves.
@@ -141,15 +333,22 @@ class DriverViewSet(viewsets.ModelViewSet):
 
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAdminUser, AllowAny
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.utils.dateparse import parse_datetime
+from .pricing_cache import get_pricing, invalidate_pricing
+from .models import RequestStatusCount
+from .rollups import stats as rollup_stats
 
 
 class PricingAPIView(APIView):
     """Simple endpoint to GET pricing (public) and PUT pricing (admin only).
 
-    GET returns an array of pricing items.
+    GET returns an array of pricing items. The payload is served from a
+    versioned cache with a strong ETag and Last-Modified, so clients that
+    revalidate get an empty 304 when nothing changed.
     PUT expects an array of items and replaces/updates the server-side pricing.
     """
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachingTokenAuthentication]
 
     def get_permissions(self):
         if self.request.method == 'GET':
@@ -157,30 +356,119 @@ class PricingAPIView(APIView):
         return [IsAdminUser()]
 
     def get(self, request):
-        items = PricingItem.objects.all().order_by('ordering', 'slug')
-        serializer = PricingItemSerializer(items, many=True)
-        return Response(serializer.data)
+        entry = get_pricing()
+        headers = {
+            'ETag': entry['etag'],
+            'Last-Modified': http_date(entry['last_modified']),
+            'Cache-Control': f"public, max-age={getattr(settings, 'PRICING_CACHE_MAX_AGE', 60)}",
+        }
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+            etags = parse_etags(if_none_match)
+            if '*' in etags or entry['etag'] in etags:
+                return Response(status=304, headers=headers)
+        else:
+            since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+            if since is not None and entry['last_modified'] <= since:
+                return Response(status=304, headers=headers)
+        return Response(entry['payload'], headers=headers)
 
     def put(self, request):
-        # Admin-only: replace pricing items with provided list
+        """Admin-only: make the catalog match the provided list.
+
+        The whole payload is validated before anything is written, then the
+        difference against the current rows is applied in one transaction
+        (bulk delete, bulk update, bulk insert), so readers see either the
+        old catalog or the new one, never a partial list. Pass
+        `?report=diff` to get the applied diff alongside the items.
+        """
         data = request.data
         if not isinstance(data, list):
             return Response({'detail': 'Expected a JSON array'}, status=400)
+        if not all(isinstance(item, dict) for item in data):
+            return Response({'detail': 'Each pricing item must be a JSON object'}, status=400)
+
+        rows = [{
+            'id': item.get('id') or item.get('slug'),
+            'label': item.get('label') or item.get('name') or '',
+            'price': item.get('price'),
+            'description': item.get('description') or '',
+            'icon': item.get('icon') or '',
+            'ordering': item.get('ordering', idx),
+        } for idx, item in enumerate(data)]
+        serializer = PricingItemPayloadSerializer(data=rows, many=True)
+        serializer.is_valid(raise_exception=True)
+        wanted = {}
+        for item in serializer.validated_data:
+            if item['slug'] in wanted:
+                return Response({'detail': f"Duplicate pricing id '{item['slug']}'"}, status=400)
+            wanted[item['slug']] = item
+
+        diff_fields = ['label', 'price', 'description', 'icon', 'ordering']
+        with transaction.atomic():
+            existing = {obj.slug: obj for obj in PricingItem.objects.select_for_update()}
+            to_create, to_update = [], []
+            for slug, item in wanted.items():
+                obj = existing.get(slug)
+                if obj is None:
+                    to_create.append(PricingItem(**item))
+                    continue
+                if any(getattr(obj, field) != item[field] for field in diff_fields):
+                    for field in diff_fields:
+                        setattr(obj, field, item[field])
+                    to_update.append(obj)
+            to_delete = [slug for slug in existing if slug not in wanted]
 
-        # For simplicity, remove existing items and recreate from payload
-        PricingItem.objects.all().delete()
-        created = []
-        for idx, item in enumerate(data):
-            serializer = PricingItemSerializer(data={
-                'slug': item.get('id') or item.get('slug') or item.get('slug'),
-                'label': item.get('label') or item.get('name') or '',
-                'price': item.get('price'),
-                'description': item.get('description') or '',
-                'icon': item.get('icon') or '',
-                'ordering': item.get('ordering', idx),
+            if to_delete:
+                PricingItem.objects.filter(slug__in=to_delete).delete()
+            if to_update:
+                PricingItem.objects.bulk_update(to_update, diff_fields)
+            if to_create:
+                PricingItem.objects.bulk_create(to_create)
+            # Bulk writes skip save() signals, so bump the version explicitly
+            invalidate_pricing()
+
+        items = PricingItemSerializer(PricingItem.objects.order_by('ordering', 'slug'), many=True).data
+        if request.query_params.get('report') == 'diff':
+            return Response({
+                'items': items,
+                'diff': {
+                    'created': [obj.slug for obj in to_create],
+                    'updated': [obj.slug for obj in to_update],
+                    'deleted': to_delete,
+                    'unchanged': len(wanted) - len(to_create) - len(to_update),
+                },
             })
-            serializer.is_valid(raise_exception=True)
-            created.append(serializer.save())
+        return Response(items)
+
+
+class StatsAPIView(APIView):
+    """Staff-only operations metrics.
 
-        out = PricingItemSerializer(created, many=True)
-        return Response(out.data)
+    GET /api/stats/?period=hour|day&since=<ISO>&until=<ISO> summarises the
+    pre-aggregated rollups (see rollups.py) and the current status counts,
+    so its cost depends on the time range, not on the number of requests.
+    Rollups are refreshed by `manage.py rollup_request_stats`.
+    """
+    authentication_classes = [CachingTokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        period = request.query_params.get('period', 'hour')
+        if period not in ('hour', 'day'):
+            return Response({'detail': 'period must be "hour" or "day"'}, status=400)
+        bounds = {}
+        for name in ('since', 'until'):
+            raw = request.query_params.get(name)
+            if raw:
+                try:
+                    value = parse_datetime(raw)
+                except ValueError:  # well formed but impossible, e.g. 2024-02-30
+                    value = None
+                if value is None:
+                    return Response({'detail': f'{name} must be an ISO-8601 datetime'}, status=400)
+                bounds[name] = value if timezone.is_aware(value) else timezone.make_aware(value)
+        data = rollup_stats(period=period, **bounds)
+        data['status_counts'] = dict(RequestStatusCount.objects.filter(count__gt=0).values_list('status', 'count'))
+        return Response(data)
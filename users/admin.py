@@ -3,10 +3,19 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 from django.utils.html import format_html
 from django.conf import settings
+from django.utils import timezone
+from .models import NotificationOutbox, NotificationPreference
 
 User = get_user_model()
 
 
+class NotificationPreferenceInline(admin.StackedInline):
+    model = NotificationPreference
+    can_delete = True
+    extra = 0
+    verbose_name_plural = 'Notification preferences'
+
+
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
     list_display = ('profile_image_tag', 'email', 'first_name', 'mobile_number', 'is_staff', 'is_active', 'date_joined')
@@ -43,4 +52,21 @@ class CustomUserAdmin(UserAdmin):
         }),
     )
 
-    readonly_fields = ('profile_image_tag',)
\ No newline at end of file
+    readonly_fields = ('profile_image_tag',)
+    inlines = [NotificationPreferenceInline]
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event', 'status', 'attempts', 'available_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'event')
+    readonly_fields = ('created_at', 'sent_at', 'locked_at', 'last_error')
+    ordering = ('-id',)
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected messages')
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(
+            status='pending', attempts=0, available_at=timezone.now(), locked_at=None,
+        )
+        self.message_user(request, f'{updated} message(s) requeued.')
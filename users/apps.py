@@ -9,3 +9,8 @@ class UsersConfig(AppConfig):
     # the module is found in multiple locations (PythonAnywhere/WSGI setups
     # sometimes add duplicate entries like './users' and '/home/.../users').
     path = str(Path(__file__).resolve().parent)
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from utils.email_templates import warm_email_templates
+        warm_email_templates()
@@ -0,0 +1,168 @@
+"""Token authentication with a token -> user cache.
+
+DRF's TokenAuthentication looks the token and its user up on every request.
+CachingTokenAuthentication caches recent lookups so most authenticated
+requests cost no query. When AUTH_TOKEN_SHARED_CACHE names a Django cache
+alias, lookups are cached there only; otherwise they go to a per-process
+LRU with a TTL.
+
+Entries are dropped when a token is deleted or rotated (including on
+logout) and whenever the user is saved or deleted, which covers password
+changes and deactivation from the API or the admin.
+
+Revocation window: with a shared cache, invalidation is seen by every
+process on its next request. Without one, only the process that made the
+change drops its entry; other processes keep accepting the old token or
+user state for up to AUTH_TOKEN_CACHE_TTL seconds, so deployments with
+several workers that need immediate revocation should configure a shared
+cache (or a short TTL). Changes written with QuerySet.update() fire no
+signals and are picked up within AUTH_TOKEN_CACHE_TTL in either mode.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from utils.conf import Setting
+
+CACHE_SIZE = Setting('AUTH_TOKEN_CACHE_SIZE', 10000)
+CACHE_TTL = Setting('AUTH_TOKEN_CACHE_TTL', 60)
+SHARED_CACHE = Setting('AUTH_TOKEN_SHARED_CACHE', None)
+
+
+class TokenCache:
+    """Bounded LRU of token key -> (user, token) with a per-entry TTL"""
+
+    def __init__(self, maxsize=None, ttl=None):
+        # None follows AUTH_TOKEN_CACHE_SIZE / AUTH_TOKEN_CACHE_TTL as they are when used
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, user, token)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        return CACHE_SIZE.value if self._maxsize is None else self._maxsize
+
+    @property
+    def ttl(self):
+        return CACHE_TTL.value if self._ttl is None else self._ttl
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, key, user, token):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, user, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_user(self, user_id):
+        """Drop every entry belonging to `user_id`; returns their token keys"""
+        with self._lock:
+            keys = [key for key, (_, user, _) in self._entries.items() if user.pk == user_id]
+            for key in keys:
+                del self._entries[key]
+        return keys
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def _shared_cache():
+    alias = SHARED_CACHE.value
+    return caches[alias] if alias else None
+
+
+def _shared_key(key):
+    # Never store raw tokens as cache keys
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def cache_token(key, user, token):
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set(_shared_key(key), (user, token), CACHE_TTL.value)
+    else:
+        token_cache.set(key, user, token)
+
+
+def cached_token(key):
+    """(user, token) for `key`, or None.
+
+    With a shared cache configured it is the only tier consulted: a local
+    copy couldn't be invalidated from the process that revokes the token.
+    """
+    shared = _shared_cache()
+    if shared is not None:
+        return shared.get(_shared_key(key))
+    return token_cache.get(key)
+
+
+def invalidate_token(key):
+    token_cache.discard(key)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(_shared_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    """Forget cached lookups for all of a user's tokens"""
+    keys = set(token_cache.discard_user(user_id))
+    shared = _shared_cache()
+    if shared is not None:
+        from rest_framework.authtoken.models import Token
+
+        keys.update(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+        shared.delete_many([_shared_key(key) for key in keys])
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """Drop-in TokenAuthentication that serves repeat lookups from the token cache"""
+
+    def authenticate_credentials(self, key):
+        entry = cached_token(key)
+        if entry is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            cache_token(key, token.user, token)
+            entry = (token.user, token)
+        user, token = entry
+        # Hand each request its own copy so in-place edits can't leak between requests
+        return copy.copy(user), token
@@ -0,0 +1,78 @@
+"""Cached directory of staff notification recipients.
+
+Every admin-facing notification needs the list of active staff, their
+addresses and delivery preferences. The list is cached per process and
+in Django's cache framework, keyed by a version stored in the database
+(utils/cache_versions.py) that signals replace whenever a user's
+is_staff/is_active/email or a NotificationPreference changes (see
+users/signals.py). Each read costs one indexed version lookup, and the
+web, outbox worker and digest processes all see a change once it commits.
+"""
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from utils.cache_versions import bump_version, current_version
+from utils.conf import Setting
+
+VERSION_NAME = 'staff_directory'
+ENTRIES_KEY = 'staff_directory:entries:{}'
+# The version makes expiry a safety net only
+CACHE_TIMEOUT = Setting('STAFF_DIRECTORY_CACHE_TIMEOUT', 60 * 60)
+
+StaffRecipient = namedtuple('StaffRecipient', 'user_id email delivery muted_events')
+
+# In-process tier: (version, recipients) last built or fetched by this process
+_local_entry = None
+
+
+def _build_directory():
+    from .models import NotificationPreference, User
+
+    rows = (
+        User.objects.filter(is_staff=True, is_active=True).exclude(email='')
+        .order_by('id')
+        .values_list('id', 'email', 'notification_preference__delivery', 'notification_preference__muted_events')
+    )
+    return tuple(
+        StaffRecipient(user_id, email, delivery or NotificationPreference.DELIVERY_IMMEDIATE,
+                       frozenset(muted or ()))
+        for user_id, email, delivery, muted in rows
+    )
+
+
+def get_staff_directory():
+    """All active staff with an email address, as StaffRecipient tuples"""
+    global _local_entry
+    version = current_version(VERSION_NAME)
+    entry = _local_entry
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    recipients = cache.get(ENTRIES_KEY.format(version))
+    if recipients is None:
+        recipients = _build_directory()
+        cache.set(ENTRIES_KEY.format(version), recipients, CACHE_TIMEOUT.value)
+    _local_entry = (version, recipients)
+    return recipients
+
+
+def invalidate_staff_directory():
+    """Bump the directory version so every process reloads on its next read.
+
+    Call inside the transaction that changes staff or preferences: other
+    processes see the new version exactly when the change commits.
+    """
+    global _local_entry
+    bump_version(VERSION_NAME)
+    _local_entry = None
+
+
+def staff_recipients(event=None, delivery=None):
+    """(email, user_id) pairs for staff who want `event`, optionally limited to one delivery mode"""
+    return [
+        (recipient.email, recipient.user_id)
+        for recipient in get_staff_directory()
+        if (event is None or event not in recipient.muted_events)
+        and (delivery is None or recipient.delivery == delivery)
+    ]
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Value
+from django.db.models.functions import Coalesce, Lower, Trim
+from users.models import Notification
+
+
+class Command(BaseCommand):
+    help = ('Backfill denormalized Notification columns (email_normalized, body_text, summary) '
+            'in primary-key chunks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of notifications handled per chunk')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_id = Notification.objects.aggregate(m=Max('id'))['m'] or 0
+        self.stdout.write(f'Backfilling notifications up to id {max_id}')
+
+        updated = 0
+        start = 0
+        while start < max_id:
+            end = start + batch_size
+            # Each chunk is a single short UPDATE so writers are never blocked for long
+            updated += Notification.objects.filter(id__gt=start, id__lte=end).update(
+                email_normalized=Lower(Trim(Coalesce('email', Value(''))))
+            )
+            start = end
+        self.stdout.write(f'Normalized emails on {updated} notifications')
+
+        # Inboxes list by user only, so email-only rows need their account id
+        linked = 0
+        for start in range(0, max_id, batch_size):
+            orphans = list(
+                Notification.objects.filter(id__gt=start, id__lte=start + batch_size, user__isnull=True)
+                .exclude(email_normalized='').only('id', 'email_normalized')
+            )
+            accounts = Notification.account_ids(n.email_normalized for n in orphans)
+            by_user = {}
+            for notification in orphans:
+                if notification.email_normalized in accounts:
+                    by_user.setdefault(accounts[notification.email_normalized], []).append(notification.id)
+            for user_id, ids in by_user.items():
+                linked += Notification.objects.filter(id__in=ids).update(user_id=user_id)
+        self.stdout.write(f'Linked {linked} notifications to accounts')
+
+        # Summaries need Python (HTML stripping), so walk the table by keyset
+        # and write each chunk back with one bulk UPDATE
+        summarized = 0
+        last_id = 0
+        while True:
+            chunk = list(
+                Notification.objects.filter(id__gt=last_id)
+                .select_related('related_request')
+                .order_by('id')[:batch_size]
+            )
+            if not chunk:
+                break
+            for notification in chunk:
+                notification.fill_derived_fields(related_request=notification.related_request)
+            with transaction.atomic():
+                Notification.objects.bulk_update(chunk, ['body_text', 'summary'])
+            summarized += len(chunk)
+            last_id = chunk[-1].id
+        self.stdout.write(self.style.SUCCESS(f'Backfilled summaries on {summarized} notifications'))
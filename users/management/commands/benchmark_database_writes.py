@@ -0,0 +1,98 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from users.models import Notification
+
+TITLE = 'database write benchmark'
+
+# Django's stock SQLite connection: rollback journal, deferred transactions, 5s busy timeout
+UNTUNED_SQLITE_OPTIONS = {'init_command': 'PRAGMA journal_mode=DELETE;'}
+
+
+class Command(BaseCommand):
+    help = ('Measure write throughput of the configured database (see DATABASE_PROFILE) under concurrency: '
+            'each thread runs transactions that read the latest notification, then insert one. '
+            'The inserted rows are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent writers')
+        parser.add_argument('--transactions', type=int, default=200, help='Transactions per thread')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to write to')
+        parser.add_argument('--untuned', action='store_true',
+                            help='SQLite only: connect without the DATABASE_PROFILE pragmas, as a baseline')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        settings_dict = connections.settings[alias]
+        if not options['untuned']:
+            return self.run(alias, settings_dict, options)
+        if connections[alias].vendor != 'sqlite':
+            raise CommandError('--untuned only applies to SQLite')
+        tuned = settings_dict['OPTIONS']
+        connections[alias].close()
+        settings_dict['OPTIONS'] = UNTUNED_SQLITE_OPTIONS
+        try:
+            self.run(alias, settings_dict, options)
+        finally:
+            connections[alias].close()
+            settings_dict['OPTIONS'] = tuned
+            # Switch the file back to the configured journal mode
+            connections[alias].ensure_connection()
+
+    def run(self, alias, settings_dict, options):
+        threads, per_thread = options['threads'], options['transactions']
+        self.stdout.write(f"{connections[alias].vendor} ({settings_dict['NAME']}"
+                          f"{', untuned' if options['untuned'] else ''}), {threads} threads x {per_thread} transactions")
+
+        latencies, failures = [], []
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+
+        def writer(number):
+            timings, errors = [], []
+            start.wait()
+            try:
+                for i in range(per_thread):
+                    began = time.perf_counter()
+                    try:
+                        with transaction.atomic(using=alias):
+                            Notification.objects.using(alias).order_by('-id').values_list('id', flat=True).first()
+                            Notification.objects.using(alias).create(
+                                email=f'writer{number}@example.com', title=TITLE, body=str(i))
+                    except OperationalError as exc:
+                        errors.append(str(exc))
+                    else:
+                        timings.append(time.perf_counter() - began)
+            finally:
+                connections[alias].close()
+                with lock:
+                    latencies.extend(timings)
+                    failures.extend(errors)
+
+        workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        began = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - began
+
+        try:
+            total = threads * per_thread
+            self.stdout.write(f'{len(latencies)}/{total} transactions committed in {elapsed:.2f}s '
+                              f'({len(latencies) / elapsed:.0f} writes/s), {len(failures)} failed')
+            if failures:
+                self.stdout.write(f'  first failure: {failures[0]}')
+            if latencies:
+                latencies.sort()
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                self.stdout.write(f'Transaction latency median {statistics.median(latencies) * 1000:.1f} ms, '
+                                  f'p99 {p99 * 1000:.1f} ms')
+        finally:
+            deleted, _ = Notification.objects.using(alias).filter(title=TITLE).delete()
+            self.stdout.write(f'Deleted {deleted} benchmark rows')
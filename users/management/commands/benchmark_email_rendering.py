@@ -0,0 +1,38 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+
+from utils.email_templates import EMAIL_TEMPLATES, render_email, warm_email_templates
+
+SAMPLE_CONTEXT = {
+    'name': 'Ada Obi',
+    'customer_name': 'Ada Obi',
+    'email': 'ada@example.com',
+    'items': '3 shirts, 2 trousers',
+    'address': '12 Marina Road, Lagos',
+    'old_status': 'assigned',
+    'new_status': 'picked_up',
+}
+
+
+class Command(BaseCommand):
+    help = 'Time rendering each email template via render_to_string and via the cached email engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help='Renders timed per template and path')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        warm_email_templates()
+        self.stdout.write(f'{"template":<45} {"render_to_string":>18} {"render_email":>14}')
+        totals = [0.0, 0.0]
+        for name in EMAIL_TEMPLATES:
+            timings = [
+                timeit.timeit(lambda: render(name, SAMPLE_CONTEXT), number=number) / number * 1e6
+                for render in (render_to_string, render_email)
+            ]
+            totals = [total + timing for total, timing in zip(totals, timings)]
+            self.stdout.write(f'{name:<45} {timings[0]:>15.1f} us {timings[1]:>11.1f} us')
+        count = len(EMAIL_TEMPLATES)
+        self.stdout.write(f'{"mean per notification":<45} {totals[0] / count:>15.1f} us {totals[1] / count:>11.1f} us')
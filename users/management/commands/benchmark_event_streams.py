@@ -0,0 +1,136 @@
+import asyncio
+import json
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from users.models import StreamEvent, StreamTopic, User
+from utils.events import get_broker, user_topic
+
+
+class _Stream:
+    """One SSE client of GET /api/stream/, driven straight through the ASGI application"""
+
+    def __init__(self, app, key):
+        self.app = app
+        self.key = key
+        self.status = None
+        self.opened = asyncio.Event()
+        self.closing = asyncio.Event()
+        self.latencies = []
+        self.received = asyncio.Condition()
+        self._buffer = ''
+        self._requested = False
+
+    async def run(self):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': '/api/stream/', 'raw_path': b'/api/stream/', 'query_string': b'',
+            'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Token {self.key}'.encode())],
+        }
+        await self.app(scope, self.receive, self.send)
+
+    async def receive(self):
+        if not self._requested:
+            self._requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closing.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            if self.status != 200:
+                self.opened.set()
+            return
+        self._buffer += message.get('body', b'').decode()
+        while '\n\n' in self._buffer:
+            frame, self._buffer = self._buffer.split('\n\n', 1)
+            if frame.startswith('retry:'):
+                self.opened.set()
+            for line in frame.splitlines():
+                if line.startswith('data: '):
+                    sent_at = json.loads(line[len('data: '):]).get('sent_at')
+                    if sent_at is not None:
+                        async with self.received:
+                            self.latencies.append(time.time() - sent_at)
+                            self.received.notify_all()
+
+
+class Command(BaseCommand):
+    help = ('Open N server-sent-event streams (GET /api/stream/) against the ASGI application in this '
+            'process, publish rounds of events to every stream through the configured broker and report '
+            'connect time and delivery latency. Creates throwaway users and deletes them afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--streams', type=int, default=200, help='Concurrent SSE connections')
+        parser.add_argument('--rounds', type=int, default=10, help='Events published to every stream')
+        parser.add_argument('--interval', type=float, default=0.2, help='Seconds between rounds')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for delivery')
+
+    def handle(self, *args, **options):
+        users = User.objects.bulk_create([
+            User(username=f'sse-load-{i}', email=f'sse-load-{i}@example.com') for i in range(options['streams'])
+        ])
+        tokens = Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+        try:
+            asyncio.run(self.run(users, [token.key for token in tokens], options))
+        finally:
+            topics = [user_topic(user.pk) for user in users]
+            StreamEvent.objects.filter(topic__in=topics).delete()
+            StreamTopic.objects.filter(topic__in=topics).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            self.stdout.write('Deleted the load-test users')
+
+    async def run(self, users, keys, options):
+        app = ASGIHandler()
+        broker = get_broker()
+        streams = [_Stream(app, key) for key in keys]
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(stream.run()) for stream in streams]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(stream.opened.wait() for stream in streams)), options['timeout'])
+            connect = time.perf_counter() - started
+            failed = [stream.status for stream in streams if stream.status != 200]
+            if failed:
+                raise CommandError(f'{len(failed)} streams were refused (status {failed[0]})')
+            self.stdout.write(f'Opened {len(streams)} streams in {connect:.2f}s '
+                              f'({broker.__class__.__name__}, {broker.subscriber_count()} subscriptions)')
+            # Let the poller lease the new topics before publishing
+            await asyncio.sleep(1.5)
+
+            rounds = options['rounds']
+            publish = sync_to_async(broker.publish_many)
+            started = time.perf_counter()
+            for number in range(rounds):
+                await publish([(user_topic(user.pk), 'load.test', {'round': number, 'sent_at': time.time()})
+                               for user in users])
+                await asyncio.sleep(options['interval'])
+
+            async def delivered(stream):
+                async with stream.received:
+                    await stream.received.wait_for(lambda: len(stream.latencies) >= rounds)
+
+            try:
+                await asyncio.wait_for(asyncio.gather(*(delivered(stream) for stream in streams)), options['timeout'])
+            except asyncio.TimeoutError:
+                pass
+            elapsed = time.perf_counter() - started
+        finally:
+            for stream in streams:
+                stream.closing.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        latencies = sorted(latency * 1000 for stream in streams for latency in stream.latencies)
+        expected = rounds * len(streams)
+        self.stdout.write(f'Delivered {len(latencies)}/{expected} events in {elapsed:.2f}s '
+                          f'({len(latencies) / elapsed:.0f} events/s)')
+        if latencies:
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(f'Latency median {statistics.median(latencies):.1f} ms, '
+                              f'p99 {p99:.1f} ms, max {latencies[-1]:.1f} ms')
@@ -0,0 +1,64 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from users.models import Notification, User
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Time the first inbox page with N notifications in the table, against the old '
+            'user-or-iexact-email query. Runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Notifications to insert')
+        parser.add_argument('--users', type=int, default=1000, help='Accounts the rows are spread over')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs per query')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['users'], options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write('Rolled back the benchmark rows')
+
+    def run(self, rows, user_count, repeat):
+        users = User.objects.bulk_create([
+            User(username=f'inbox-bench-{i}', email=f'Inbox-Bench-{i}@example.com') for i in range(user_count)
+        ])
+        started = time.perf_counter()
+        for offset in range(0, rows, 10000):
+            batch = []
+            for i in range(offset, min(offset + 10000, rows)):
+                user = users[i % user_count]
+                batch.append(Notification(
+                    user=user, email=user.email, email_normalized=user.email.lower(),
+                    title='Benchmark', body_text='Benchmark', summary='Benchmark', read=bool(i % 3),
+                ))
+            Notification.objects.bulk_create(batch)
+        self.stdout.write(f'Inserted {rows} notifications in {time.perf_counter() - started:.1f}s')
+
+        user = users[len(users) // 2]
+        queries = {
+            'for_user': Notification.objects.for_user(user),
+            'user OR email iexact (old)': Notification.objects.filter(Q(user=user) | Q(email__iexact=user.email)),
+        }
+        for label, queryset in queries.items():
+            page = queryset.order_by('-created_at', '-id')[:50]
+            sql, params = page.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN ' + ('QUERY PLAN ' if connection.vendor == 'sqlite' else '') + sql, params)
+                plan = '; '.join(str(row[-1]) for row in cursor.fetchall())
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(page.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f'{label:<28} median {statistics.median(timings):8.2f} ms   plan: {plan}')
@@ -0,0 +1,75 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from users.authentication import CachingTokenAuthentication, token_cache
+from users.models import User
+from users.views import UserViewSet
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare queries and latency per authenticated request (GET /api/users/me/) with DRF '
+            'TokenAuthentication and with CachingTokenAuthentication, cold and warm. Uses the '
+            'per-process cache and runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Accounts with a token')
+        parser.add_argument('--requests', type=int, default=2000, help='Timed requests per mode')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['users'], options['requests'])
+                raise _Rollback
+        except _Rollback:
+            token_cache.clear()
+            self.stdout.write('Rolled back the benchmark rows')
+
+    def run(self, user_count, count):
+        users = User.objects.bulk_create([
+            User(username=f'auth-bench-{i}', email=f'auth-bench-{i}@example.com') for i in range(user_count)
+        ])
+        keys = [token.key for token in Token.objects.bulk_create([Token(user=user, key=Token.generate_key())
+                                                                   for user in users])]
+        factory = APIRequestFactory()
+        modes = [
+            ('TokenAuthentication', TokenAuthentication, False),
+            ('cached, cold', CachingTokenAuthentication, True),
+            ('cached, warm', CachingTokenAuthentication, False),
+        ]
+        self.stdout.write(f'{"mode":<22} {"queries/request":>16} {"median":>10} {"mean":>10}')
+        results = {}
+        token_cache.clear()
+        for label, authentication, cold in modes:
+            view = UserViewSet.as_view({'get': 'me'}, authentication_classes=[authentication])
+            if authentication is CachingTokenAuthentication and not cold:
+                for key in keys:
+                    authentication().authenticate_credentials(key)
+            timings = []
+            reset_queries()  # the query log is capped, so keep it short
+            with CaptureQueriesContext(connection) as captured:
+                for i in range(count):
+                    if cold:
+                        token_cache.clear()
+                    request = factory.get('/api/users/me/', HTTP_AUTHORIZATION=f'Token {keys[i % len(keys)]}')
+                    started = time.perf_counter()
+                    response = view(request)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise CommandError(f'{label}: GET /api/users/me/ returned {response.status_code}')
+            results[label] = (len(captured.captured_queries) / count, statistics.median(timings))
+            self.stdout.write(f'{label:<22} {results[label][0]:>16.2f} {results[label][1]:>7.3f} ms '
+                              f'{statistics.mean(timings):>7.3f} ms')
+        base, warm = results['TokenAuthentication'], results['cached, warm']
+        self.stdout.write(f'Saved per warm request: {base[0] - warm[0]:.2f} queries, '
+                          f'{base[1] - warm[1]:.3f} ms median')
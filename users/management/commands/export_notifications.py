@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import Notification
+from utils.export import NOTIFICATION_COLUMNS, OUTPUTS, export_stream, filter_notifications, write_export
+
+
+class Command(BaseCommand):
+    help = 'Stream notifications as CSV or NDJSON to a file or stdout, in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=OUTPUTS, default='csv', help='Export format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the export with gzip')
+        parser.add_argument('--file', default='-', help='Destination path ("-" for stdout)')
+        parser.add_argument('--since', help='Only notifications created at or after this ISO date/datetime')
+        parser.add_argument('--until', help='Only notifications created at or before this ISO date/datetime')
+        parser.add_argument('--user', help='Only notifications linked to this user id')
+        parser.add_argument('--read', choices=('true', 'false'), help='Filter on the read flag')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per query')
+
+    def handle(self, *args, **options):
+        try:
+            queryset = filter_notifications(
+                Notification.objects.all(), since=options['since'], until=options['until'],
+                user=options['user'], read=options['read'],
+            )
+            stream = export_stream(queryset, NOTIFICATION_COLUMNS, output=options['output'],
+                                   compress=options['gzip'], chunk_size=options['chunk_size'])
+            write_export(stream, options['file'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
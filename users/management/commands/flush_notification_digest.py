@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from utils.digest import flush_digests
+
+
+class Command(BaseCommand):
+    help = 'Send digest emails to admins who chose digest delivery and whose window has elapsed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Flush every digest admin now, ignoring the digest interval')
+        parser.add_argument('--loop', type=float, default=None, metavar='SECONDS',
+                            help='Keep running, checking for due digests every SECONDS')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    sent, included = flush_digests(force=options['force'])
+                except Exception as exc:
+                    if options['loop'] is None:
+                        raise CommandError(f'Digest flush failed: {exc}')
+                    self.stderr.write(f'Digest flush failed: {exc}')
+                else:
+                    if sent or options['loop'] is None:
+                        self.stdout.write(f'Sent {sent} digest(s) covering {included} event(s)')
+                if options['loop'] is None:
+                    break
+                time.sleep(options['loop'])
+        except KeyboardInterrupt:
+            self.stdout.write('Digest loop stopped')
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from utils.events import get_broker
+from utils.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = 'Drain the notification outbox: send queued emails and in-app notifications with retries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Maximum number of outbox rows to process per cycle')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait between cycles when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Process a single cycle and exit (useful for cron)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Notification worker started')
+        if not get_broker().cross_process:
+            self.stderr.write(self.style.WARNING(
+                f'EVENT_BROKER {settings.EVENT_BROKER} only delivers within this process; '
+                'events published here will not reach stream clients'
+            ))
+        try:
+            while True:
+                close_old_connections()
+                sent, failed = process_outbox(batch_size=batch_size)
+                if sent or failed:
+                    self.stdout.write(f'Processed outbox batch: {sent} sent, {failed} failed')
+                if options['once']:
+                    break
+                if sent + failed < batch_size:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Notification worker stopped')
+            return
+        self.stdout.write(self.style.SUCCESS('Notification worker finished'))
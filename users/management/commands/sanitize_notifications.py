@@ -1,45 +1,161 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management.base import BaseCommand
-from users.models import Notification
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from users.models import Notification, HTML_TAG_RE
 from requests_app.models import LaundryRequest
-import re
-from django.db import transaction
+
+REQUEST_REF_RE = re.compile(r'Request\s*#(\d+)')
+
 
 class Command(BaseCommand):
     help = 'Sanitize Notification bodies: strip HTML and attach related_request when Request #id is found.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of notifications read and written per chunk')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Split the id space into this many ranges and process them in parallel')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would change without writing anything')
+        parser.add_argument('--checkpoint', default='sanitize_notifications.checkpoint.json',
+                            help='File recording progress so an interrupted run can resume')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any existing checkpoint and start from the beginning')
+
     def handle(self, *args, **options):
-        qs = Notification.objects.all()
-        total = qs.count()
-        self.stdout.write(f'Found {total} notifications to sanitize')
-        updated = 0
-        for n in qs:
-            changed = False
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.checkpoint_path = None if self.dry_run else options['checkpoint']
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+        ranges = None if options['restart'] else self._load_checkpoint()
+        if ranges:
+            self.stdout.write(f'Resuming from checkpoint {self.checkpoint_path}')
+        else:
+            ranges = self._plan_ranges(max(options['workers'], 1))
+        self.ranges = ranges
+        remaining = sum(1 for r in ranges if r['last'] < r['hi'])
+        self.stdout.write(f'Sanitizing notifications in {remaining} id range(s)')
+
+        if len(ranges) == 1:
+            self._process_range(0)
+        else:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                # list() re-raises the first worker exception, if any
+                list(pool.map(self._process_range, range(len(ranges))))
+
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        summary = (f"scanned={self.stats['scanned']} html_stripped={self.stats['html_stripped']} "
+                   f"linked={self.stats['linked']} missing_request={self.stats['missing_request']}")
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS(f"Dry run: would sanitize {self.stats['updated']} notifications ({summary})"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Sanitized {self.stats['updated']} notifications ({summary})"))
+
+    def _plan_ranges(self, workers):
+        bounds = Notification.objects.aggregate(lo=Min('id'), hi=Max('id'))
+        if bounds['lo'] is None:
+            return [{'lo': 0, 'hi': 0, 'last': 0}]
+        lo, hi = bounds['lo'] - 1, bounds['hi']
+        step = max((hi - lo + workers - 1) // workers, 1)
+        ranges = []
+        start = lo
+        while start < hi:
+            end = min(start + step, hi)
+            # `last` is the highest id already processed in (lo, hi]
+            ranges.append({'lo': start, 'hi': end, 'last': start})
+            start = end
+        return ranges
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as fh:
+            return json.load(fh)['ranges']
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump({'ranges': self.ranges}, fh)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _process_range(self, index):
+        current = self.ranges[index]
+        try:
+            while current['last'] < current['hi']:
+                chunk = list(
+                    Notification.objects.filter(id__gt=current['last'], id__lte=current['hi'])
+                    .select_related('related_request')
+                    .order_by('id')[:self.batch_size]
+                )
+                if not chunk:
+                    break
+                stats = self._sanitize_chunk(chunk)
+                with self.lock:
+                    self.stats.update(stats)
+                    current['last'] = chunk[-1].id
+                    self._save_checkpoint()
+        finally:
+            # Worker threads each get their own connection; don't leak it
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+
+    def _sanitize_chunk(self, chunk):
+        stats = Counter(scanned=len(chunk))
+        changed = {}
+        wanted = {}
+        for n in chunk:
             body = n.body or ''
             # Strip HTML tags
             if '<' in body and '>' in body:
-                plain = re.sub('<[^<]+?>', '', body)
-                plain = plain.strip()
+                plain = HTML_TAG_RE.sub('', body).strip()
                 if plain != body:
                     n.body = plain
-                    changed = True
+                    changed[n.id] = n
+                    stats['html_stripped'] += 1
             else:
                 plain = body
             # Try to find "Request #123" patterns
-            m = re.search(r'Request\s*#(\d+)', plain)
-            if m and not n.related_request_id:
-                rq_id = int(m.group(1))
-                try:
-                    rq = LaundryRequest.objects.filter(id=rq_id).first()
-                    if rq:
-                        n.related_request = rq
-                        changed = True
-                except Exception:
-                    pass
-            if changed:
-                try:
-                    with transaction.atomic():
-                        n.save()
-                        updated += 1
-                except Exception as e:
-                    self.stderr.write(f'Failed to save notification {n.id}: {e}')
-        self.stdout.write(self.style.SUCCESS(f'Sanitized {updated} notifications'))
+            if not n.related_request_id:
+                m = REQUEST_REF_RE.search(plain)
+                if m:
+                    wanted[n.id] = int(m.group(1))
+
+        # One lookup for every request referenced in this chunk
+        requests = LaundryRequest.objects.only('id', 'customer_name', 'status').in_bulk(set(wanted.values()))
+        for n in chunk:
+            rq_id = wanted.get(n.id)
+            if rq_id is None:
+                continue
+            rq = requests.get(rq_id)
+            if rq is None:
+                stats['missing_request'] += 1
+                continue
+            n.related_request = rq
+            changed[n.id] = n
+            stats['linked'] += 1
+
+        stats['updated'] = len(changed)
+        if changed and not self.dry_run:
+            rows = list(changed.values())
+            for n in rows:
+                n.fill_derived_fields(related_request=n.related_request)
+            try:
+                with transaction.atomic():
+                    Notification.objects.bulk_update(rows, ['body', 'related_request', 'body_text', 'summary'])
+            except Exception as e:
+                self.stderr.write(f'Failed to save notifications {rows[0].id}..{rows[-1].id}: {e}')
+                raise
+        return stats
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0004_pricingitem'),
+        ('users', '0007_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='email_normalized',
+            field=models.CharField(blank=True, default='', max_length=254),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'read', 'created_at'], name='users_notif_user_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['email_normalized', 'created_at'], name='users_notif_email_inbox_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_notification_email_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='body_text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='summary',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
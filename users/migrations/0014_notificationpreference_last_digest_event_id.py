@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:35
+
+from django.db import migrations, models
+
+
+def seed_event_watermarks(apps, schema_editor):
+    """Start each digest admin after the events their last digest already covered"""
+    NotificationPreference = apps.get_model('users', 'NotificationPreference')
+    DigestEvent = apps.get_model('users', 'DigestEvent')
+    for preference in NotificationPreference.objects.filter(last_digest_at__isnull=False):
+        covered = (
+            DigestEvent.objects.filter(created_at__lte=preference.last_digest_at)
+            .order_by('-id').values_list('id', flat=True).first()
+        )
+        if covered:
+            preference.last_digest_event_id = covered
+            preference.save(update_fields=['last_digest_event_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_streamevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationpreference',
+            name='last_digest_event_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(seed_event_watermarks, migrations.RunPython.noop),
+    ]
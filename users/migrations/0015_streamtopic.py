@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_notificationpreference_last_digest_event_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamTopic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=100, unique=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
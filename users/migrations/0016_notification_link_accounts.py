@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:05
+
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Lower, Trim
+
+BATCH_SIZE = 5000
+
+
+def backfill_inbox_columns(apps, schema_editor):
+    """Fill email_normalized on rows written before 0008, then link email-only rows to their accounts.
+
+    Walks the table in primary-key chunks so each UPDATE stays short.
+    """
+    Notification = apps.get_model('users', 'Notification')
+    User = apps.get_model('users', 'User')
+    max_id = Notification.objects.aggregate(m=models.Max('id'))['m'] or 0
+    for start in range(0, max_id, BATCH_SIZE):
+        Notification.objects.filter(id__gt=start, id__lte=start + BATCH_SIZE, email_normalized='').update(
+            email_normalized=Lower(Trim(Coalesce('email', Value(''))))
+        )
+
+    accounts = {}
+    for user_id, email in User.objects.order_by('id').values_list('id', 'email'):
+        email = (email or '').strip().lower()
+        if email:
+            accounts.setdefault(email, user_id)  # the oldest account wins a shared address
+    for start in range(0, max_id, BATCH_SIZE):
+        by_user = {}
+        orphans = Notification.objects.filter(
+            id__gt=start, id__lte=start + BATCH_SIZE, user__isnull=True,
+        ).exclude(email_normalized='').values_list('id', 'email_normalized')
+        for notification_id, email in orphans:
+            if email in accounts:
+                by_user.setdefault(accounts[email], []).append(notification_id)
+        for user_id, ids in by_user.items():
+            Notification.objects.filter(id__in=ids).update(user_id=user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_streamtopic'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at'], name='users_notif_user_created_idx'),
+        ),
+        migrations.RunPython(backfill_inbox_columns, migrations.RunPython.noop),
+    ]
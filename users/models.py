@@ -1,7 +1,13 @@
+import re
+
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 
+HTML_TAG_RE = re.compile('<[^<]+?>')
+SUMMARY_LENGTH = 180
+
 
 def profile_picture_upload_to(instance, filename):
     # store uploads under MEDIA_ROOT/profile_pics/<user_id>/<filename>
@@ -20,6 +26,42 @@ class User(AbstractUser):
         default='profile_pics/default.png'
     )
 
+    # Fields the cached staff directory (users/directory.py) depends on
+    DIRECTORY_FIELDS = ('is_staff', 'is_active', 'email')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded values so signals can tell whether a save
+        # changed anything the staff directory caches
+        instance._directory_state = instance.directory_state()
+        return instance
+
+    def directory_state(self):
+        return tuple(self.__dict__.get(field) for field in self.DIRECTORY_FIELDS)
+
+
+class NotificationQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Notifications for `user`'s inbox.
+
+        Notifications addressed only by email are linked to the account with
+        that address when written, when the account is created or changes
+        its email (users/signals.py), and by migration 0016 for older rows,
+        so this is a single range scan of the (user, created_at) index.
+        """
+        return self.filter(user=user)
+
+    def link_to_accounts(self, email):
+        """Attach unlinked notifications addressed to `email` to the account using it"""
+        email = Notification.normalize_email(email)
+        if not email:
+            return 0
+        user_id = Notification.account_ids([email]).get(email)
+        if user_id is None:
+            return 0
+        return self.filter(user__isnull=True, email_normalized=email).update(user_id=user_id)
+
 
 class Notification(models.Model):
     """Simple notification record created when the system sends emails.
@@ -31,16 +73,252 @@ class Notification(models.Model):
         'users.User', on_delete=models.CASCADE, null=True, blank=True, related_name='notifications'
     )
     email = models.CharField(max_length=254, blank=True, null=True)
+    # Lowercased copy of `email` so inbox lookups can use a plain index
+    # instead of a case-insensitive scan. Kept in sync by save() and by
+    # bulk writers via normalize_email().
+    email_normalized = models.CharField(max_length=254, blank=True, default='')
     title = models.CharField(max_length=255)
     body = models.TextField(blank=True, null=True)
+    # Precomputed at write time by fill_derived_fields() so listing the inbox
+    # needs no per-row HTML stripping or related_request lookups
+    body_text = models.TextField(blank=True, default='')
+    summary = models.CharField(max_length=255, blank=True, default='')
     created_at = models.DateTimeField(default=timezone.now)
     read = models.BooleanField(default=False)
     related_request = models.ForeignKey(
         'requests_app.LaundryRequest', null=True, blank=True, on_delete=models.SET_NULL, related_name='notifications'
     )
 
+    objects = NotificationQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='users_notif_user_created_idx'),
+            models.Index(fields=['user', 'read', 'created_at'], name='users_notif_user_inbox_idx'),
+            models.Index(fields=['email_normalized', 'created_at'], name='users_notif_email_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notification({self.title}) to {self.email or (self.user and self.user.email)}"
+
+    # Fields fill_derived_fields() reads
+    SOURCE_FIELDS = ('email', 'body', 'title', 'related_request')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._source_state = instance.source_state()
+        return instance
+
+    def source_state(self):
+        return (self.__dict__.get('email'), self.__dict__.get('body'), self.__dict__.get('title'),
+                self.__dict__.get('related_request_id'))
+
+    @staticmethod
+    def normalize_email(email):
+        return (email or '').strip().lower()
+
+    @staticmethod
+    def account_ids(emails):
+        """{normalized email: user id} for accounts using `emails`; the oldest account wins a shared address"""
+        from django.db.models.functions import Lower, Trim
+
+        accounts = {}
+        rows = (
+            User.objects.annotate(email_normalized=Lower(Trim('email')))
+            .filter(email_normalized__in=set(emails)).order_by('id').values_list('email_normalized', 'id')
+        )
+        for email, user_id in rows:
+            accounts.setdefault(email, user_id)
+        return accounts
+
+    @classmethod
+    def link_accounts(cls, notifications):
+        """Set `user` on unsaved notifications addressed to an existing account (one query)"""
+        orphans = [n for n in notifications if n.user_id is None and n.email_normalized]
+        if orphans:
+            accounts = cls.account_ids(n.email_normalized for n in orphans)
+            for notification in orphans:
+                notification.user_id = accounts.get(notification.email_normalized)
+
+    def fill_derived_fields(self, related_request=None):
+        """Populate email_normalized, body_text and summary from the source fields.
+
+        Bulk writers (which bypass save()) must call this themselves. Pass the
+        already-loaded `related_request` to avoid fetching it again.
+        """
+        self.email_normalized = self.normalize_email(self.email)
+        self.body_text = HTML_TAG_RE.sub('', self.body or '').strip()
+        rq = related_request
+        if rq is None and self.related_request_id:
+            rq = self.related_request
+        if rq is not None:
+            # Prefer a concise summary derived from the related request
+            summary = f"Request #{rq.id} — {rq.customer_name} — {rq.status}"
+        elif self.body_text:
+            # Fallback: a short plain-text excerpt of the body
+            text = self.body_text
+            summary = (text[:SUMMARY_LENGTH] + '...') if len(text) > SUMMARY_LENGTH else text
+        else:
+            summary = self.title or ''
+        self.summary = summary[:255]
+
+    def save(self, *args, **kwargs):
+        # Derived fields are a snapshot taken when the notification is written
+        # (the summary keeps the request status it was sent for); only
+        # recompute them on create or when a source field actually changes.
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            refresh = bool(set(self.SOURCE_FIELDS) & set(update_fields))
+        else:
+            refresh = self._state.adding or self.source_state() != getattr(self, '_source_state', None)
+        if refresh:
+            self.fill_derived_fields()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'email_normalized', 'body_text', 'summary'}
+        if self._state.adding:
+            self.link_accounts([self])
+        super().save(*args, **kwargs)
+        self._source_state = self.source_state()
+
+
+class NotificationPreference(models.Model):
+    """Per-user delivery preferences for staff-facing notifications.
+
+    Staff without a row get every event immediately. `muted_events` holds
+    outbox event names (e.g. "new_request") the user has opted out of, for
+    both email and in-app notifications.
+    """
+    DELIVERY_IMMEDIATE = 'immediate'
+    DELIVERY_DIGEST = 'digest'
+    DELIVERY_CHOICES = [
+        (DELIVERY_IMMEDIATE, 'Immediate'),
+        (DELIVERY_DIGEST, 'Digest'),
+    ]
+    # Outbox events that notify staff
+    STAFF_EVENTS = ('new_request', 'new_user_registration')
+
+    user = models.OneToOneField('users.User', on_delete=models.CASCADE, related_name='notification_preference')
+    delivery = models.CharField(max_length=20, choices=DELIVERY_CHOICES, default=DELIVERY_IMMEDIATE)
+    muted_events = models.JSONField(default=list, blank=True)
+    # When this user's last digest went out (drives the digest interval)
+    last_digest_at = models.DateTimeField(null=True, blank=True)
+    # DigestEvents up to this id have been included in a digest for this user
+    last_digest_event_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"NotificationPreference({self.user_id}) {self.delivery}"
+
+    def save(self, *args, **kwargs):
+        if self.delivery == self.DELIVERY_DIGEST and self.last_digest_at is None:
+            # Start the first digest from now so it doesn't repeat events
+            # this admin was already emailed about immediately
+            self.last_digest_at = timezone.now()
+            latest = DigestEvent.objects.order_by('-id').values_list('id', flat=True).first()
+            self.last_digest_event_id = max(self.last_digest_event_id, latest or 0)
+        super().save(*args, **kwargs)
+
+
+class DigestEvent(models.Model):
+    """A staff-facing event waiting to be summarised in digest emails.
+
+    Written once per event (not per admin) while any admin uses digest
+    delivery; `manage.py flush_notification_digest` sends each digest admin
+    the events past their last_digest_event_id. `key` makes recording
+    idempotent when the outbox retries a delivery.
+    """
+    key = models.CharField(max_length=100, unique=True)
+    event = models.CharField(max_length=50)
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True, default='')
+    related_request = models.ForeignKey(
+        'requests_app.LaundryRequest', null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+
+    def __str__(self):
+        return f"DigestEvent({self.key})"
+
+
+class NotificationOutbox(models.Model):
+    """Durable queue of notification events waiting to be delivered.
+
+    Rows are written in the same transaction as the change that triggers
+    them and drained by `manage.py run_notification_worker`, so API calls
+    never wait on the email provider. Failed deliveries are retried with
+    exponential backoff and parked as `dead` after too many attempts.
+    """
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("sent", "Sent"),
+        ("dead", "Dead"),
+    ]
+
+    event = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='users_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"NotificationOutbox({self.event}) {self.status}"
+
+
+class CacheVersion(models.Model):
+    """Shared version stamp of a cached dataset (see utils/cache_versions.py).
+
+    Processes compare their cached copy against this row on every read, so a
+    change made in one process is seen by all others as soon as it commits,
+    whatever cache backend is configured.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    token = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.token}"
+
+
+class StreamEvent(models.Model):
+    """Real-time event written by utils.events.DatabaseBroker.
+
+    Any process (web, outbox worker, dispatcher) can publish; every ASGI
+    process with open streams polls new rows and fans them out to its own
+    subscribers. Rows are short-lived and pruned by those pollers.
+    """
+    topic = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=50)
+    data = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_type} -> {self.topic}"
+
+
+class StreamTopic(models.Model):
+    """A topic some ASGI process currently has stream subscribers for.
+
+    Pollers renew the lease while their subscribers stay connected;
+    DatabaseBroker only writes StreamEvent rows for topics with a live lease.
+    """
+    topic = models.CharField(max_length=100, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
 
     def __str__(self):
-        return f"Notification({self.title}) to {self.email or (self.user and self.user.email)}"
\ No newline at end of file
+        return f"{self.topic} until {self.expires_at}"
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from .models import Notification
+from .models import Notification, NotificationPreference
 
 User = get_user_model()
 
@@ -108,21 +108,23 @@ class NotificationSerializer(serializers.ModelSerializer):
     summary = serializers.SerializerMethodField()
     class Meta:
         model = Notification
-        fields = ('id', 'title', 'body', 'read', 'created_at', 'email', 'related_request', 'summary')
-        read_only_fields = ('id', 'created_at')
+        fields = ('id', 'title', 'body', 'body_text', 'read', 'created_at', 'email', 'related_request', 'summary')
+        read_only_fields = ('id', 'created_at', 'body_text')
 
     def get_summary(self, obj):
-        # Prefer a concise summary derived from a related request when present
-        try:
-            if obj.related_request:
-                rq = obj.related_request
-                return f"Request #{rq.id} — {rq.customer_name} — {rq.status}"
-        except Exception:
-            pass
-        # Fallback: return a short plain-text excerpt of the body
-        if obj.body:
-            import re
-            # strip HTML tags if present
-            text = re.sub('<[^<]+?>', '', obj.body)
-            return (text.strip()[:180] + '...') if len(text.strip()) > 180 else text.strip()
-        return obj.title or ''
\ No newline at end of file
+        # Precomputed when the notification was written (see Notification.fill_derived_fields)
+        return obj.summary or obj.title or ''
+
+
+class NotificationPreferenceSerializer(serializers.ModelSerializer):
+    muted_events = serializers.ListField(
+        child=serializers.ChoiceField(choices=NotificationPreference.STAFF_EVENTS), required=False,
+    )
+
+    class Meta:
+        model = NotificationPreference
+        fields = ('delivery', 'muted_events', 'updated_at')
+        read_only_fields = ('updated_at',)
+
+    def validate_muted_events(self, value):
+        return sorted(set(value))
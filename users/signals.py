@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .directory import invalidate_staff_directory
+from .models import Notification, NotificationPreference
+
+
+@receiver([post_save, post_delete], sender=Token)
+def token_changed(sender, instance, **kwargs):
+    # Covers logout (token deleted) and token rotation
+    invalidate_token(instance.key)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    # Password changes, deactivation and profile edits all go through save();
+    # dropping the cached user also keeps request.user from going stale
+    invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved_link_notifications(sender, instance, created, **kwargs):
+    # Registered before user_saved_directory, which replaces _directory_state
+    previous = dict(zip(instance.DIRECTORY_FIELDS, getattr(instance, '_directory_state', None) or ()))
+    if created or Notification.normalize_email(previous.get('email')) != Notification.normalize_email(instance.email):
+        Notification.objects.link_to_accounts(instance.email)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved_directory(sender, instance, created, **kwargs):
+    state = instance.directory_state()
+    previous = getattr(instance, '_directory_state', None)
+    if (created and instance.is_staff) or (not created and state != previous):
+        # In the same transaction, so the new version and the rows commit together
+        invalidate_staff_directory()
+    instance._directory_state = state
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted_directory(sender, instance, **kwargs):
+    if instance.is_staff:
+        invalidate_staff_directory()
+
+
+@receiver([post_save, post_delete], sender=NotificationPreference)
+def preference_changed(sender, instance, **kwargs):
+    invalidate_staff_directory()
@@ -0,0 +1,79 @@
+"""Server-sent-events stream of a user's request and notification updates.
+
+GET /api/stream/ keeps the connection open and pushes an event whenever one
+of the user's requests changes status, a driver is assigned, or a new
+in-app notification is written, so mobile clients no longer need to poll
+the list endpoints. Serve the project with an ASGI server (see
+laundry_backend/asgi.py) so idle streams don't each hold a worker thread.
+
+EventSource cannot set headers, so the token may be passed as ?token=
+as well as in the usual `Authorization: Token <key>` header.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+
+from utils.conf import Setting
+from utils.events import get_broker, user_topic
+from .authentication import CachingTokenAuthentication
+
+HEARTBEAT_SECONDS = Setting('EVENT_STREAM_HEARTBEAT_SECONDS', 15)
+
+
+def format_sse(event):
+    payload = json.dumps(event['data'], cls=DjangoJSONEncoder)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+async def authenticate_stream(request):
+    """Resolve the token from the Authorization header or ?token=; returns a User or None"""
+    key = request.GET.get('token')
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Token '):
+        key = header[len('Token '):].strip()
+    if not key:
+        return None
+    try:
+        user, _ = await sync_to_async(CachingTokenAuthentication().authenticate_credentials)(key)
+    except AuthenticationFailed:
+        return None
+    return user
+
+
+async def subscription_stream(subscription, first=None):
+    """Yield SSE frames from a subscription, with heartbeats, until the client goes away"""
+    try:
+        # Tell the client how long to wait before reconnecting
+        yield f'retry: {HEARTBEAT_SECONDS.value * 1000}\n\n'
+        if first is not None:
+            yield first
+        while True:
+            event = await subscription.get(timeout=HEARTBEAT_SECONDS.value)
+            if event is None:
+                # Comment line keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            yield format_sse(event)
+    finally:
+        # Runs when the ASGI server cancels the response on client disconnect
+        subscription.close()
+
+
+def sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # disable proxy buffering (nginx)
+    return response
+
+
+async def user_event_stream(request):
+    if request.method != 'GET':
+        return JsonResponse({'detail': 'Method not allowed'}, status=405)
+    user = await authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+    subscription = get_broker().subscribe(user_topic(user.pk))
+    return sse_response(subscription_stream(subscription))
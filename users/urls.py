@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import UserViewSet, AuthViewSet, NotificationViewSet
+from .streams import user_event_stream
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -8,5 +9,6 @@ router.register(r'auth', AuthViewSet, basename='auth')
 router.register(r'notifications', NotificationViewSet, basename='notification')
 
 urlpatterns = [
+    path('stream/', user_event_stream, name='user-event-stream'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,22 +1,24 @@
 from rest_framework import viewsets, permissions, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.contrib.auth import authenticate, login, logout, get_user_model
-from .serializers import UserSerializer
+from .authentication import CachingTokenAuthentication
+from .serializers import UserSerializer, NotificationPreferenceSerializer
 from rest_framework.authtoken.models import Token
-from utils.email_service import notify_new_user_registration, notify_user_signup_confirmation
+from utils.outbox import enqueue_notification
+from utils.pagination import CreatedAtCursorPagination
+from utils.export import NOTIFICATION_COLUMNS, export_response, filter_notifications
 from rest_framework import mixins
 from .serializers import NotificationSerializer
-from django.shortcuts import get_object_or_404
-from .models import Notification
-from django.db import models
+from django.http import Http404
+from .models import Notification, NotificationPreference
+from django.db import transaction
 
 User = get_user_model()
 
 class UserViewSet(viewsets.ModelViewSet):
     # Use token authentication for user endpoints to avoid CSRF issues
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachingTokenAuthentication]
     serializer_class = UserSerializer
 
     def get_permissions(self):
@@ -47,12 +49,26 @@ class UserViewSet(viewsets.ModelViewSet):
             serializer.save()
             return Response(serializer.data)
 
+    @action(detail=False, methods=['get', 'patch'], url_path='me/notification-preferences')
+    def notification_preferences(self, request):
+        """Staff-only: choose immediate or digest delivery and mute event types"""
+        if not request.user.is_staff:
+            return Response({'detail': 'Only staff have notification preferences'}, status=status.HTTP_403_FORBIDDEN)
+        preference = (NotificationPreference.objects.filter(user_id=request.user.pk).first()
+                      or NotificationPreference(user_id=request.user.pk))
+        if request.method == 'GET':
+            return Response(NotificationPreferenceSerializer(preference).data)
+        serializer = NotificationPreferenceSerializer(preference, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
 class AuthViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
     # Avoid SessionAuthentication for these endpoints so CSRF is not enforced
-    # TokenAuthentication does not require CSRF for unsafe methods and
+    # Token authentication does not require CSRF for unsafe methods and
     # allows unauthenticated requests to the login/signup actions.
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachingTokenAuthentication]
     
     @action(detail=False, methods=['post'])
     def login(self, request):
@@ -101,27 +117,28 @@ class AuthViewSet(viewsets.ViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
             
-        user = User.objects.create_user(
-            username=email,
-            email=email,
-            password=password,
-            first_name=name,
-            mobile_number=mobile_number or None,
-            address=address or None,
-        )
-        # attach profile picture if uploaded
-        if profile_picture:
-            user.profile_picture = profile_picture
-            user.save()
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=email,
+                email=email,
+                password=password,
+                first_name=name,
+                mobile_number=mobile_number or None,
+                address=address or None,
+            )
+            # attach profile picture if uploaded
+            if profile_picture:
+                user.profile_picture = profile_picture
+                user.save()
+
+            # Queue email notifications for the background worker
+            enqueue_notification('new_user_registration', user_id=user.id)  # Notify admins
+            enqueue_notification('user_signup_confirmation', user_id=user.id)  # Notify the new user
         
         # create token and login
         token, _ = Token.objects.get_or_create(user=user)
         login(request, user)
         
-        # Send email notifications
-        notify_new_user_registration(user)  # Notify admins
-        notify_user_signup_confirmation(user)  # Notify the new user
-        
         return Response({
             'user': UserSerializer(user).data,
             'token': token.key,
@@ -131,6 +148,9 @@ class AuthViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['post'])
     def logout(self, request):
         logout(request)
+        # Revoke the API token too; its cached lookup is dropped by users.signals
+        if isinstance(request.auth, Token):
+            request.auth.delete()
         return Response({'detail': 'Successfully logged out'})
 
 
@@ -143,26 +163,43 @@ class NotificationViewSet(mixins.ListModelMixin,
     - POST /notifications/{id}/mark_read/ : mark a notification as read
     - DELETE /notifications/{id}/ : delete a notification
     - POST /notifications/clear_all/ : clear (delete) all notifications for user
+    - GET /notifications/export/ : staff-only streaming export of all notifications
     """
     serializer_class = NotificationSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachingTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
-        user = self.request.user
-        # Notifications linked to the user OR matching the user's email
-        qs = Notification.objects.filter(models.Q(user=user) | models.Q(email__iexact=user.email))
-        return qs
+        # Email-addressed notifications are linked to the account when written
+        return Notification.objects.for_user(self.request.user)
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
-        obj = get_object_or_404(self.get_queryset(), pk=pk)
-        obj.read = True
-        obj.save()
+        # A single UPDATE; the stored summary stays as it was written
+        if not self.get_queryset().filter(pk=pk).update(read=True):
+            raise Http404
         return Response({'detail': 'marked read'})
 
     @action(detail=False, methods=['post'])
     def clear_all(self, request):
-        user = request.user
-        Notification.objects.filter(models.Q(user=user) | models.Q(email__iexact=user.email)).delete()
-        return Response({'detail': 'cleared'})
\ No newline at end of file
+        Notification.objects.for_user(request.user).delete()
+        return Response({'detail': 'cleared'})
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """?output=csv|ndjson, ?compress=gzip; filters since/until, user (id) and read"""
+        params = request.query_params
+        try:
+            queryset = filter_notifications(
+                Notification.objects.all(),
+                since=params.get('since'), until=params.get('until'),
+                user=params.get('user'), read=params.get('read'),
+            )
+            return export_response(
+                queryset, NOTIFICATION_COLUMNS, 'notifications',
+                output=params.get('output', 'csv'), compress=params.get('compress') == 'gzip',
+                request=request,
+            )
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=400)
@@ -0,0 +1,40 @@
+"""Database-backed version stamps for in-process caches.
+
+A process-local cache can only be invalidated by the process that makes the
+change, and Django's default LocMem cache isn't shared between workers
+either. Cached datasets (staff directory, pricing) are therefore keyed by a
+token stored in a users.CacheVersion row: readers fetch the token with one
+indexed query and reuse their cached copy while it matches, writers replace
+it in the same transaction as the change they make.
+"""
+import uuid
+
+INITIAL_TOKEN = '0'
+
+
+def current_version(name):
+    """The committed token for `name` ("0" until it is first bumped)"""
+    from users.models import CacheVersion
+
+    token = CacheVersion.objects.filter(name=name).values_list('token', flat=True).first()
+    return token or INITIAL_TOKEN
+
+
+def version_modified_at(name):
+    """When `name` was last bumped, or None if it never was"""
+    from users.models import CacheVersion
+
+    return CacheVersion.objects.filter(name=name).values_list('updated_at', flat=True).first()
+
+
+def bump_version(name):
+    """Replace the token for `name`; call inside the transaction making the change"""
+    from users.models import CacheVersion
+
+    token = uuid.uuid4().hex
+    if not CacheVersion.objects.filter(name=name).update(token=token):
+        _, created = CacheVersion.objects.get_or_create(name=name, defaults={'token': token})
+        if not created:
+            # Created concurrently; still replace it so it postdates our change
+            CacheVersion.objects.filter(name=name).update(token=token)
+    return token
@@ -0,0 +1,27 @@
+"""Tunables read from Django settings when they are used.
+
+A module-level `getattr(settings, ...)` is evaluated once at import, so
+`override_settings` in tests (or settings configured after the module was
+imported) would never reach it. Modules declare each tunable once with its
+default instead:
+
+    FLUSH_SECONDS = Setting('DRIVER_LOCATION_FLUSH_SECONDS', 5)
+
+and read `FLUSH_SECONDS.value` where it is needed.
+"""
+from django.conf import settings
+
+
+class Setting:
+    """A named setting with a default, looked up on every access"""
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    @property
+    def value(self):
+        return getattr(settings, self.name, self.default)
+
+    def __repr__(self):
+        return f'Setting({self.name!r}, {self.default!r})'
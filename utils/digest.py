@@ -0,0 +1,131 @@
+"""Digest delivery of staff-facing notifications.
+
+Admins whose NotificationPreference.delivery is "digest" are left out of
+the immediate new-request and new-registration emails. Each such event is
+recorded once as a DigestEvent instead, and `flush_digests()` (run by
+`manage.py flush_notification_digest`) sends every due digest admin a
+single email and in-app notification summarising the events since their
+last digest. Email volume per window is O(admins) instead of
+O(events x admins).
+
+Each admin's position is an id watermark (last_digest_event_id), and events
+younger than NOTIFICATION_DIGEST_SETTLE_SECONDS are left for the next run:
+ids are allocated before commit, so an event recorded in a slow transaction
+could otherwise commit below the watermark after a flush has moved past it.
+"""
+import logging
+from datetime import timedelta
+
+from django.utils import timezone
+
+from users.directory import get_staff_directory, staff_recipients
+from utils.conf import Setting
+
+logger = logging.getLogger(__name__)
+
+DIGEST = 'digest'
+INTERVAL_MINUTES = Setting('NOTIFICATION_DIGEST_INTERVAL_MINUTES', 60)
+RETENTION_DAYS = Setting('NOTIFICATION_DIGEST_RETENTION_DAYS', 7)
+SETTLE_SECONDS = Setting('NOTIFICATION_DIGEST_SETTLE_SECONDS', 60)
+
+EVENT_LABELS = {
+    'new_request': 'New laundry requests',
+    'new_user_registration': 'New user registrations',
+}
+
+
+def record_digest_event(event, key, title, body='', related_request=None):
+    """Queue an event for digest admins; a no-op while nobody uses digest delivery"""
+    from users.models import DigestEvent
+
+    if not staff_recipients(event, delivery=DIGEST):
+        return False
+    # ignore_conflicts: an outbox retry must not list the same event twice
+    DigestEvent.objects.bulk_create(
+        [DigestEvent(key=key, event=event, title=title, body=body, related_request=related_request)],
+        ignore_conflicts=True,
+    )
+    return True
+
+
+def display_name(user):
+    return user.get_full_name() or user.first_name or user.email
+
+
+def flush_digests(now=None, force=False, connection=None):
+    """Send each due digest admin one email covering their pending events.
+
+    An admin is due once NOTIFICATION_DIGEST_INTERVAL_MINUTES have passed
+    since their last digest (or always with `force`). Watermarks only move
+    after the emails were handed to the backend, so a failed send is
+    retried on the next run. Returns (digests_sent, events_included).
+    """
+    from users.models import DigestEvent, NotificationPreference
+    from utils.email_service import EmailBatch, save_notifications
+
+    now = now or timezone.now()
+    recipients = {r.user_id: r for r in get_staff_directory() if r.delivery == DIGEST}
+    preferences = list(NotificationPreference.objects.filter(user_id__in=recipients).select_related('user'))
+    interval = timedelta(minutes=INTERVAL_MINUTES.value)
+    due = [
+        p for p in preferences
+        if force or p.last_digest_at is None or now - p.last_digest_at >= interval
+    ]
+    sent = included = 0
+    if due:
+        events = list(
+            DigestEvent.objects.filter(
+                id__gt=min(p.last_digest_event_id for p in due),
+                created_at__lte=now - timedelta(seconds=SETTLE_SECONDS.value),
+            ).order_by('id')
+        )
+        latest = events[-1].id if events else 0
+
+        batch = EmailBatch(connection=connection)
+        notifications = []
+        for preference in due:
+            recipient = recipients[preference.user_id]
+            since = preference.last_digest_at
+            mine = [
+                e for e in events
+                if e.id > preference.last_digest_event_id and e.event not in recipient.muted_events
+            ]
+            preference.last_digest_at = now
+            preference.last_digest_event_id = max(preference.last_digest_event_id, latest)
+            if not mine:
+                continue
+            groups = []
+            for event, label in EVENT_LABELS.items():
+                grouped = [e for e in mine if e.event == event]
+                if grouped:
+                    groups.append({'label': label, 'events': grouped})
+            subject = f'Activity digest: {len(mine)} update(s)'
+            batch.add(
+                subject=subject,
+                template_name='emails/admin_digest.html',
+                context={'groups': groups, 'since': since, 'name': display_name(preference.user)},
+                recipient_list=[recipient.email],
+            )
+            notifications.append({
+                'user_id': recipient.user_id,
+                'email': recipient.email,
+                'title': subject,
+                'body': '; '.join(f"{g['label']}: {len(g['events'])}" for g in groups),
+            })
+            sent += 1
+            included += len(mine)
+
+        try:
+            batch.send()
+        except Exception:
+            logger.exception('Failed sending %s digest email(s)', sent)
+            raise
+        NotificationPreference.objects.bulk_update(due, ['last_digest_at', 'last_digest_event_id'])
+        save_notifications(notifications)
+
+    # Events every digest admin has already seen (or that outlived retention) can go
+    stale = DigestEvent.objects.filter(created_at__lte=now - timedelta(days=RETENTION_DAYS.value))
+    if preferences:
+        stale = stale | DigestEvent.objects.filter(id__lte=min(p.last_digest_event_id for p in preferences))
+    stale.delete()
+    return sent, included
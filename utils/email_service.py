@@ -1,8 +1,13 @@
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.conf import settings
-from django.template.loader import render_to_string
+from utils.email_templates import render_email
+from utils.events import publish_to_users
+from users.directory import staff_recipients
+from utils.digest import record_digest_event
 from django.contrib.auth import get_user_model
 import logging
+import threading
+from contextlib import contextmanager
 from django.utils import timezone
 
 # Import Notification model lazily to avoid circular imports at module import time
@@ -15,28 +20,139 @@ logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
-def get_admin_emails():
+def get_admin_emails(event=None):
     """Get list of admin email addresses"""
-    return list(User.objects.filter(is_staff=True).values_list('email', flat=True))
+    return [email for email, _ in get_admin_recipients(event)]
 
-def send_notification(subject, template_name, context, recipient_list):
+def get_admin_recipients(event=None):
+    """Get (email, user_id) pairs for staff who get `event` immediately.
+
+    Admins who opted out of `event` or receive digests (see utils/digest.py)
+    are left out.
+    Served from the cached staff directory, so this normally costs no query.
+    Carrying the user id along with the address lets callers link in-app
+    notifications to the admin without resolving each email back to a User.
+    """
+    return staff_recipients(event, delivery='immediate')
+
+_deferred = threading.local()
+
+
+@contextmanager
+def defer_notifications():
+    """Collect save_notifications() calls made inside the block instead of writing them.
+
+    Yields a list of (specs, related_request) pairs; pass it to
+    write_deferred_notifications() once the emails have gone out. The
+    outbox worker uses this to keep the email round trip outside any
+    database transaction.
+    """
+    previous = getattr(_deferred, 'pending', None)
+    _deferred.pending = pending = []
+    try:
+        yield pending
+    finally:
+        _deferred.pending = previous
+
+
+def write_deferred_notifications(pending):
+    return [n for specs, related_request in pending for n in save_notifications(specs, related_request)]
+
+
+def save_notifications(specs, related_request=None):
+    """Persist in-app notifications for one event with a single INSERT.
+
+    `specs` is a list of dicts with `user`/`user_id`, `email`, `title` and
+    `body` keys; one Notification row is written per spec. Inside
+    defer_notifications() the call is only recorded.
+    """
+    if Notification is None or not specs:
+        return []
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending.append((specs, related_request))
+        return []
+    notifications = []
+    for spec in specs:
+        notification = Notification(related_request=related_request, read=False, **spec)
+        # bulk_create skips save(), so precompute the derived columns here
+        notification.fill_derived_fields(related_request=related_request)
+        notifications.append(notification)
+    try:
+        Notification.link_accounts(notifications)
+        created = Notification.objects.bulk_create(notifications)
+    except Exception:
+        logger.exception('Failed to create %s Notification(s) for request %s',
+                         len(specs), getattr(related_request, 'id', None))
+        return []
+    for notification in created:
+        if notification.user_id:
+            publish_to_users([notification.user_id], 'notification.created', {
+                'id': notification.pk,
+                'title': notification.title,
+                'summary': notification.summary,
+                'related_request': notification.related_request_id,
+                'created_at': notification.created_at,
+            })
+    return created
+
+class EmailBatch:
+    """Collects the templated emails produced by one event and sends them together.
+
+    Each add() renders its template once, however many recipients share the
+    message. All queued messages go out through a single backend connection.
+    Pass an already-open `connection` to share it across several batches (the
+    notification worker does this for a whole drain cycle); otherwise one is
+    opened for the send and closed afterwards.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection
+        self.messages = []
+
+    def add(self, subject, template_name, context, recipient_list):
+        """Render `template_name` and queue it for `recipient_list`"""
+        html_message = render_email(template_name, context)
+        message = EmailMultiAlternatives(
+            subject=subject,
+            body='',  # Empty plain text message
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=recipient_list,
+        )
+        message.attach_alternative(html_message, 'text/html')
+        self.messages.append(message)
+        return message
+
+    def send(self):
+        """Send every queued message over one connection; returns the number sent"""
+        if not self.messages:
+            return 0
+        connection = self.connection or get_connection(fail_silently=False)
+        sent = connection.send_messages(self.messages) or 0
+        self.messages = []
+        return sent
+
+
+def send_notification(subject, template_name, context, recipient_list, connection=None):
     """Send email notification using a template"""
-    html_message = render_to_string(template_name, context)
-    
-    # Send the email using Django's send_mail
-    result = send_mail(
+    batch = EmailBatch(connection=connection)
+    batch.add(
         subject=subject,
-        message='', # Empty plain text message
-        from_email=settings.DEFAULT_FROM_EMAIL,
+        template_name=template_name,
+        context=context,
         recipient_list=recipient_list,
-        html_message=html_message,
-        fail_silently=False
     )
-    return result
+    return batch.send()
 
-def notify_new_user_registration(user):
+def notify_new_user_registration(user, connection=None):
     """Notify admins about new user registration"""
-    admin_emails = get_admin_emails()
+    record_digest_event(
+        'new_user_registration',
+        key=f'new_user_registration:{user.pk}',
+        title=f'New user: {user.email or user.username}',
+        body=f'{user.get_full_name() or user.username} signed up',
+    )
+    admin_emails = get_admin_emails('new_user_registration')
     if not admin_emails:
         return
     # Derive a friendly name from the user object in a safe way
@@ -58,12 +174,16 @@ def notify_new_user_registration(user):
         subject='New User Registration',
         template_name='emails/admin_new_user_notification.html',
         context=context,
-        recipient_list=admin_emails
+        recipient_list=admin_emails,
+        connection=connection,
     )
 
-def notify_new_request(request_obj):
+def notify_new_request(request_obj, connection=None):
     """Notify about new laundry request"""
-    admin_emails = get_admin_emails()
+    admins = get_admin_recipients('new_request')
+    admin_emails = [email for email, _ in admins]
+    notifications = []
+    batch = EmailBatch(connection=connection)
     
     context = {
         'request': request_obj,
@@ -87,61 +207,51 @@ def notify_new_request(request_obj):
         except Exception:
             logger.info(f"notify_new_request: sending customer email '{customer_email}'")
         subject = 'Your Laundry Request Has Been Received'
-        try:
-            send_notification(
-                subject=subject,
-                template_name='emails/customer_new_request.html',
-                context=context,
-                recipient_list=[customer_email]
-            )
-        except Exception:
-            logger.exception('Failed sending customer new request email for %s', customer_email)
+        batch.add(
+            subject=subject,
+            template_name='emails/customer_new_request.html',
+            context=context,
+            recipient_list=[customer_email]
+        )
         # Persist plain-text notification for mobile
-        if Notification is not None:
-            try:
-                Notification.objects.create(
-                    user=request_obj.customer,
-                    email=customer_email,
-                    title=subject,
-                    body=f"Request #{request_obj.id} received. {request_obj.items_description or ''} Pickup address: {request_obj.address}",
-                    related_request=request_obj,
-                    read=False,
-                )
-            except Exception:
-                logger.exception('Failed to create customer Notification for request %s', request_obj.id)
+        notifications.append({
+            'user': request_obj.customer,
+            'email': customer_email,
+            'title': subject,
+            'body': f"Request #{request_obj.id} received. {request_obj.items_description or ''} Pickup address: {request_obj.address}",
+        })
     
-    # Notify admins
+    # Notify admins; digest-mode admins get it in their next digest instead
+    record_digest_event(
+        'new_request',
+        key=f'new_request:{request_obj.id}',
+        title=f'Request #{request_obj.id} by {request_obj.customer_name}',
+        body=f"{request_obj.items_description or ''} Pickup address: {request_obj.address}".strip(),
+        related_request=request_obj,
+    )
     if admin_emails:
         subject_admin = 'New Laundry Request Received'
-        try:
-            send_notification(
-                subject=subject_admin,
-                template_name='emails/admin_new_request.html',
-                context=context,
-                recipient_list=admin_emails
-            )
-        except Exception:
-            logger.exception('Failed sending admin new request emails')
-        if Notification is not None:
-            User = get_user_model()
-            for recipient in admin_emails:
-                try:
-                    user_obj = User.objects.filter(email__iexact=recipient).first()
-                except Exception:
-                    user_obj = None
-                try:
-                    Notification.objects.create(
-                        user=user_obj,
-                        email=recipient,
-                        title=subject_admin,
-                        body=f"New request #{request_obj.id} by {request_obj.customer_name}: {request_obj.items_description or ''}",
-                        related_request=request_obj,
-                        read=False,
-                    )
-                except Exception:
-                    logger.exception('Failed to create admin Notification for request %s', request_obj.id)
-
-def notify_request_status_update(request_obj, old_status=None):
+        batch.add(
+            subject=subject_admin,
+            template_name='emails/admin_new_request.html',
+            context=context,
+            recipient_list=admin_emails
+        )
+        body_admin = f"New request #{request_obj.id} by {request_obj.customer_name}: {request_obj.items_description or ''}"
+        notifications.extend(
+            {'user_id': user_id, 'email': recipient, 'title': subject_admin, 'body': body_admin}
+            for recipient, user_id in admins
+        )
+
+    try:
+        batch.send()
+    except Exception:
+        logger.exception('Failed sending new request emails for request %s', request_obj.id)
+        # Let the outbox worker retry the event
+        raise
+    save_notifications(notifications, related_request=request_obj)
+
+def notify_request_status_update(request_obj, old_status=None, connection=None):
     """Notify about request status changes"""
     context = {
         'request': request_obj,
@@ -152,6 +262,7 @@ def notify_request_status_update(request_obj, old_status=None):
     }
     
     recipients = []
+    recipient_users = []
     # Customer email
     try:
         cust_email = getattr(request_obj.customer, 'email', None)
@@ -163,9 +274,11 @@ def notify_request_status_update(request_obj, old_status=None):
         except Exception:
             logger.info(f"notify_request_status_update: will notify customer '{cust_email}'")
         recipients.append(cust_email)
+        recipient_users.append(request_obj.customer)
 
     # Driver email (driver model links to a user)
     driver_email = None
+    driver_user = None
     if request_obj.driver:
         try:
             driver_user = getattr(request_obj.driver, 'user', None)
@@ -178,39 +291,31 @@ def notify_request_status_update(request_obj, old_status=None):
         except Exception:
             logger.info(f"notify_request_status_update: will notify driver '{driver_email}'")
         recipients.append(driver_email)
+        recipient_users.append(driver_user)
     
     if recipients:
         subject = f'Laundry Request Status Updated: {request_obj.status}'
+        batch = EmailBatch(connection=connection)
+        batch.add(
+            subject=subject,
+            template_name='emails/request_status_update.html',
+            context=context,
+            recipient_list=recipients
+        )
         try:
-            send_notification(
-                subject=subject,
-                template_name='emails/request_status_update.html',
-                context=context,
-                recipient_list=recipients
-            )
+            batch.send()
         except Exception:
             logger.exception('Failed to send status update emails for request %s', request_obj.id)
+            raise
         # Persist notifications for recipients
-        if Notification is not None:
-            User = get_user_model()
-            for rcpt in recipients:
-                try:
-                    user_obj = User.objects.filter(email__iexact=rcpt).first()
-                except Exception:
-                    user_obj = None
-                try:
-                    Notification.objects.create(
-                        user=user_obj,
-                        email=rcpt,
-                        title=subject,
-                        body=f"Request #{request_obj.id} status changed from {old_status or 'unknown'} to {request_obj.status}.",
-                        related_request=request_obj,
-                        read=False,
-                    )
-                except Exception:
-                    logger.exception('Failed to create status Notification for request %s to %s', request_obj.id, rcpt)
-
-def notify_driver_assignment(request_obj):
+        body = f"Request #{request_obj.id} status changed from {old_status or 'unknown'} to {request_obj.status}."
+        save_notifications(
+            [{'user': user_obj, 'email': rcpt, 'title': subject, 'body': body}
+             for rcpt, user_obj in zip(recipients, recipient_users)],
+            related_request=request_obj,
+        )
+
+def notify_driver_assignment(request_obj, connection=None):
     """Notify when a driver is assigned to a request"""
     # Resolve driver and their email
     driver = getattr(request_obj, 'driver', None)
@@ -248,31 +353,19 @@ def notify_driver_assignment(request_obj):
     
     # Notify driver
     subject_driver = 'New Laundry Pickup Assignment'
-    try:
-        send_notification(
-            subject=subject_driver,
-            template_name='emails/driver_assignment.html',
-            context=context,
-            recipient_list=[driver_email]
-        )
-    except Exception:
-        logger.exception('Failed sending driver assignment email to %s', driver_email)
-    if Notification is not None:
-        try:
-            user_obj = getattr(request_obj.driver, 'user', None)
-        except Exception:
-            user_obj = None
-        try:
-            Notification.objects.create(
-                user=user_obj,
-                email=driver_email,
-                title=subject_driver,
-                body=f"You have been assigned to request #{request_obj.id} for {request_obj.customer_name} at {request_obj.address}.",
-                related_request=request_obj,
-                read=False,
-            )
-        except Exception:
-            logger.exception('Failed to create driver Notification for request %s', request_obj.id)
+    batch = EmailBatch(connection=connection)
+    batch.add(
+        subject=subject_driver,
+        template_name='emails/driver_assignment.html',
+        context=context,
+        recipient_list=[driver_email]
+    )
+    notifications = [{
+        'user': driver_user,
+        'email': driver_email,
+        'title': subject_driver,
+        'body': f"You have been assigned to request #{request_obj.id} for {request_obj.customer_name} at {request_obj.address}.",
+    }]
     
     # Notify customer if email available
     customer_email = None
@@ -282,30 +375,28 @@ def notify_driver_assignment(request_obj):
         customer_email = None
     if customer_email:
         subject_customer = 'Driver Assigned to Your Laundry Request'
-        try:
-            send_notification(
-                subject=subject_customer,
-                template_name='emails/customer_driver_assigned.html',
-                context=context,
-                recipient_list=[customer_email]
-            )
-        except Exception:
-            logger.exception('Failed sending customer driver assigned email to %s', customer_email)
-        if Notification is not None:
-            try:
-                Notification.objects.create(
-                    user=request_obj.customer,
-                    email=customer_email,
-                    title=subject_customer,
-                    body=f"A driver has been assigned to your request #{request_obj.id}. Driver: {driver_name}",
-                    related_request=request_obj,
-                    read=False,
-                )
-            except Exception:
-                logger.exception('Failed to create customer Notification for driver assignment request %s', request_obj.id)
+        batch.add(
+            subject=subject_customer,
+            template_name='emails/customer_driver_assigned.html',
+            context=context,
+            recipient_list=[customer_email]
+        )
+        notifications.append({
+            'user': request_obj.customer,
+            'email': customer_email,
+            'title': subject_customer,
+            'body': f"A driver has been assigned to your request #{request_obj.id}. Driver: {driver_name}",
+        })
+
+    try:
+        batch.send()
+    except Exception:
+        logger.exception('Failed sending driver assignment emails for request %s', request_obj.id)
+        raise
+    save_notifications(notifications, related_request=request_obj)
 
 
-def notify_user_signup_confirmation(user):
+def notify_user_signup_confirmation(user, connection=None):
     """Send a welcome email to the newly registered user confirming their signup"""
     if not user.email:
         logger.warning(f"notify_user_signup_confirmation: User {user.id} has no email address")
@@ -328,51 +419,33 @@ def notify_user_signup_confirmation(user):
             subject='Welcome to Sophistican Laundry Logistics!',
             template_name='emails/customer_signup_confirmation.html',
             context=context,
-            recipient_list=[user.email]
+            recipient_list=[user.email],
+            connection=connection,
         )
         logger.info(f"notify_user_signup_confirmation: Sent welcome email to {user.email}")
     except Exception as e:
         logger.error(f"notify_user_signup_confirmation: Failed to send email to {user.email}: {str(e)}")
+        raise
 
 
 def create_inapp_new_request_notifications(request_obj):
     """Create in-app notifications (no email) for a newly created request."""
     if Notification is None:
         return
-    subject_customer = 'Your Laundry Request Has Been Received'
-    try:
-        Notification.objects.create(
-            user=request_obj.customer,
-            email=getattr(request_obj.customer, 'email', None),
-            title=subject_customer,
-            body=f"Request #{request_obj.id} received. {request_obj.items_description or ''} Pickup address: {request_obj.address}",
-            related_request=request_obj,
-            read=False,
-        )
-    except Exception:
-        logger.exception('Failed to create in-app customer Notification for request %s', request_obj.id)
+    notifications = [{
+        'user': request_obj.customer,
+        'email': getattr(request_obj.customer, 'email', None),
+        'title': 'Your Laundry Request Has Been Received',
+        'body': f"Request #{request_obj.id} received. {request_obj.items_description or ''} Pickup address: {request_obj.address}",
+    }]
 
-    admin_emails = get_admin_emails()
-    if not admin_emails:
-        return
-    User = get_user_model()
     subject_admin = 'New Laundry Request Received'
-    for recipient in admin_emails:
-        try:
-            user_obj = User.objects.filter(email__iexact=recipient).first()
-        except Exception:
-            user_obj = None
-        try:
-            Notification.objects.create(
-                user=user_obj,
-                email=recipient,
-                title=subject_admin,
-                body=f"New request #{request_obj.id} by {request_obj.customer_name}: {request_obj.items_description or ''}",
-                related_request=request_obj,
-                read=False,
-            )
-        except Exception:
-            logger.exception('Failed to create in-app admin Notification for request %s', request_obj.id)
+    body_admin = f"New request #{request_obj.id} by {request_obj.customer_name}: {request_obj.items_description or ''}"
+    notifications.extend(
+        {'user_id': user_id, 'email': recipient, 'title': subject_admin, 'body': body_admin}
+        for recipient, user_id in get_admin_recipients('new_request')
+    )
+    save_notifications(notifications, related_request=request_obj)
 
 
 def create_inapp_status_notifications(request_obj, old_status=None):
@@ -385,7 +458,7 @@ def create_inapp_status_notifications(request_obj, old_status=None):
     except Exception:
         cust_email = None
     if cust_email:
-        recipients.append(cust_email)
+        recipients.append((cust_email, request_obj.customer))
 
     driver_email = None
     if request_obj.driver:
@@ -395,33 +468,20 @@ def create_inapp_status_notifications(request_obj, old_status=None):
         except Exception:
             driver_email = None
     if driver_email:
-        recipients.append(driver_email)
+        recipients.append((driver_email, driver_user))
 
     subject = f'Laundry Request Status Updated: {request_obj.status}'
-    User = get_user_model()
-    for rcpt in recipients:
-        try:
-            user_obj = User.objects.filter(email__iexact=rcpt).first()
-        except Exception:
-            user_obj = None
-        try:
-            Notification.objects.create(
-                user=user_obj,
-                email=rcpt,
-                title=subject,
-                body=f"Request #{request_obj.id} status changed from {old_status or 'unknown'} to {request_obj.status}.",
-                related_request=request_obj,
-                read=False,
-            )
-        except Exception:
-            logger.exception('Failed to create in-app status Notification for request %s to %s', request_obj.id, rcpt)
+    body = f"Request #{request_obj.id} status changed from {old_status or 'unknown'} to {request_obj.status}."
+    save_notifications(
+        [{'user': user_obj, 'email': rcpt, 'title': subject, 'body': body} for rcpt, user_obj in recipients],
+        related_request=request_obj,
+    )
 
 
 def create_inapp_driver_assignment_notifications(request_obj):
     """Create in-app notifications (no email) when a driver is assigned."""
     if Notification is None:
         return
-    subject_driver = 'New Laundry Pickup Assignment'
     try:
         user_obj = getattr(request_obj.driver, 'user', None)
     except Exception:
@@ -431,17 +491,12 @@ def create_inapp_driver_assignment_notifications(request_obj):
         driver_email = getattr(user_obj, 'email', None)
     except Exception:
         driver_email = None
-    try:
-        Notification.objects.create(
-            user=user_obj,
-            email=driver_email,
-            title=subject_driver,
-            body=f"You have been assigned to request #{request_obj.id} for {request_obj.customer_name} at {request_obj.address}.",
-            related_request=request_obj,
-            read=False,
-        )
-    except Exception:
-        logger.exception('Failed to create in-app driver Notification for request %s', request_obj.id)
+    notifications = [{
+        'user': user_obj,
+        'email': driver_email,
+        'title': 'New Laundry Pickup Assignment',
+        'body': f"You have been assigned to request #{request_obj.id} for {request_obj.customer_name} at {request_obj.address}.",
+    }]
 
     # Notify customer (in-app)
     customer_email = None
@@ -450,14 +505,10 @@ def create_inapp_driver_assignment_notifications(request_obj):
     except Exception:
         customer_email = None
     if customer_email:
-        try:
-            Notification.objects.create(
-                user=request_obj.customer,
-                email=customer_email,
-                title='Driver Assigned to Your Laundry Request',
-                body=f"A driver has been assigned to your request #{request_obj.id}.",
-                related_request=request_obj,
-                read=False,
-            )
-        except Exception:
-            logger.exception('Failed to create in-app customer Notification for driver assignment request %s', request_obj.id)
+        notifications.append({
+            'user': request_obj.customer,
+            'email': customer_email,
+            'title': 'Driver Assigned to Your Laundry Request',
+            'body': f"A driver has been assigned to your request #{request_obj.id}.",
+        })
+    save_notifications(notifications, related_request=request_obj)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.template import Context, Engine
+
+# Every template the notification pipeline renders; compiled once and kept in memory
+EMAIL_TEMPLATES = (
+    'emails/admin_digest.html',
+    'emails/admin_new_request.html',
+    'emails/admin_new_user_notification.html',
+    'emails/customer_driver_assigned.html',
+    'emails/customer_new_request.html',
+    'emails/customer_signup_confirmation.html',
+    'emails/driver_assignment.html',
+    'emails/request_status_update.html',
+)
+
+_engine = None
+
+
+def get_email_engine():
+    """Template engine dedicated to email rendering.
+
+    Unlike the project-wide engine it always wraps its loaders in the cached
+    loader, even when DEBUG is on, so each email template is read and compiled
+    once per process instead of on every send.
+    """
+    global _engine
+    if _engine is None:
+        dirs = []
+        for backend in settings.TEMPLATES:
+            dirs.extend(backend.get('DIRS', []))
+        _engine = Engine(
+            dirs=dirs,
+            loaders=[(
+                'django.template.loaders.cached.Loader',
+                [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ],
+            )],
+        )
+    return _engine
+
+
+def warm_email_templates():
+    """Compile every known email template so the first send doesn't pay for it."""
+    engine = get_email_engine()
+    for name in EMAIL_TEMPLATES:
+        engine.get_template(name)
+
+
+def render_email(template_name, context):
+    """Render an email template from the compiled cache"""
+    return get_email_engine().get_template(template_name).render(Context(context))
@@ -0,0 +1,368 @@
+"""Lightweight pub/sub used to push real-time events to streaming clients.
+
+Publishers call `publish_to_users()` (or `get_broker().publish()`) from
+ordinary synchronous code; subscribers are asyncio consumers such as the
+server-sent-events view in users/streams.py.
+
+The default DatabaseBroker carries events between processes through the
+users.StreamEvent table, so notifications written by the outbox worker and
+assignments made by run_dispatch reach clients connected to any ASGI
+worker. InProcessBroker only delivers within the publishing process and
+suits a single-process deployment (or tests). Point EVENT_BROKER at another
+class with the same `subscribe()`/`publish()` interface (for example one
+backed by Redis pub/sub) to swap the transport.
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from utils.conf import Setting
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = Setting('EVENT_SUBSCRIBER_QUEUE_SIZE', 100)
+POLL_INTERVAL_SECONDS = Setting('EVENT_POLL_INTERVAL_SECONDS', 0.5)
+RETENTION_SECONDS = Setting('EVENT_RETENTION_SECONDS', 300)
+
+
+def user_topic(user_id):
+    return f'user:{user_id}'
+
+
+def driver_topic(driver_id):
+    return f'driver:{driver_id}'
+
+
+def request_topic(request_id):
+    return f'request:{request_id}'
+
+
+class Subscription:
+    """A single consumer's queue for one or more topics, bound to the event loop it was created on"""
+
+    def __init__(self, broker, topics, maxsize=None):
+        self.broker = broker
+        self.topics = tuple(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE.value if maxsize is None else maxsize)
+        self.dropped = 0
+
+    def deliver(self, event):
+        """Thread-safe hand-off from any publisher thread to the subscriber's loop"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop has shut down; the subscriber is gone
+            self.close()
+
+    def _put(self, event):
+        if self.queue.full():
+            # Slow consumer: drop the oldest event rather than grow without bound
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Next event, or None if `timeout` seconds pass without one"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Topic-based fan-out to subscribers living in this process"""
+
+    # Whether events published in one process reach subscribers in another
+    cross_process = False
+
+    def __init__(self):
+        self._topics = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, *topics):
+        """Create a subscription to `topics`; must be called from a running event loop"""
+        subscription = Subscription(self, topics)
+        with self._lock:
+            for topic in subscription.topics:
+                self._topics[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._topics.get(topic, ()))
+            return sum(len(s) for s in self._topics.values())
+
+    def publish(self, topic, event_type, data):
+        """Deliver an event to every current subscriber of `topic`"""
+        return self.fan_out(topic, {'id': next(self._ids), 'type': event_type, 'data': data})
+
+    def publish_many(self, events):
+        """Publish several (topic, event_type, data) events"""
+        return sum(self.publish(topic, event_type, data) for topic, event_type, data in events)
+
+    def fan_out(self, topic, event):
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return len(subscribers)
+
+
+class DatabaseBroker(InProcessBroker):
+    """Cross-process broker backed by the users.StreamEvent table.
+
+    Each process with subscribers runs one poller task on its event loop.
+    It leases the topics its subscribers follow in users.StreamTopic, reads
+    rows past the last id it saw every EVENT_POLL_INTERVAL_SECONDS and fans
+    them out locally, and prunes old rows and expired leases now and then.
+    publish() inserts a row only for topics with a live lease (the lease
+    list is re-read at most once per ACTIVE_TOPICS_SECONDS), so publishing
+    to a topic nobody streams costs no write; a client that has just
+    connected may miss events from its first second or so. Ids are
+    allocated before commit, so ids skipped by a poll are re-checked for a
+    few seconds in case their transaction commits late.
+    """
+    cross_process = True
+    BATCH_SIZE = 1000
+    GAP_WAIT_SECONDS = 5
+    LEASE_SECONDS = 30
+    ACTIVE_TOPICS_SECONDS = 1.0
+    PRUNE_SECONDS = 60
+
+    def __init__(self):
+        super().__init__()
+        self._pollers = {}  # event loop -> poller task
+        self._active = (0.0, frozenset())  # (monotonic expiry, leased topics)
+
+    def subscribe(self, *topics):
+        subscription = super().subscribe(*topics)
+        loop = subscription.loop
+        with self._lock:
+            task = self._pollers.get(loop)
+            if task is None or task.done():
+                # Start from an empty context: the subscribing request's one may
+                # pin sync_to_async to a thread executor that shuts down when
+                # that request's view returns
+                self._pollers[loop] = contextvars.Context().run(loop.create_task, self._poll(timezone.now()))
+        return subscription
+
+    def publish(self, topic, event_type, data):
+        return self.publish_many([(topic, event_type, data)])
+
+    def publish_many(self, events):
+        """Insert (topic, event_type, data) events for leased topics in one query; returns the number written"""
+        from users.models import StreamEvent
+
+        events = list(events)
+        if not events:
+            return 0
+        active = self.active_topics()
+        rows = [
+            StreamEvent(topic=topic, event_type=event_type, data=data)
+            for topic, event_type, data in events if topic in active
+        ]
+        if rows:
+            StreamEvent.objects.bulk_create(rows)
+        return len(rows)
+
+    def active_topics(self):
+        """Topics any process streams: the leases (briefly cached) plus this process's own subscriptions"""
+        from users.models import StreamTopic
+
+        expiry, leased = self._active
+        now = time.monotonic()
+        if now >= expiry:
+            leased = frozenset(
+                StreamTopic.objects.filter(expires_at__gt=timezone.now()).values_list('topic', flat=True)
+            )
+            self._active = (now + self.ACTIVE_TOPICS_SECONDS, leased)
+        with self._lock:
+            local = set(self._topics)
+        return leased | local if local else leased
+
+    async def _poll(self, started):
+        from users.models import StreamEvent
+
+        # Start from what existed at subscribe time, not when this task first runs,
+        # so events published right after subscribing aren't skipped
+        last_id = await (
+            StreamEvent.objects.filter(created_at__lt=started).order_by('-id').values_list('id', flat=True).afirst()
+        ) or 0
+        gaps = {}  # skipped id -> monotonic deadline
+        leases = {}  # topic -> monotonic time the lease was last renewed
+        pruned_at = time.monotonic()
+        while self.subscriber_count():
+            try:
+                await sync_to_async(self._renew_leases)(leases)
+                rows, last_id = await sync_to_async(self._fetch)(last_id, gaps)
+                if time.monotonic() - pruned_at >= self.PRUNE_SECONDS:
+                    pruned_at = time.monotonic()
+                    await sync_to_async(self.prune)()
+            except Exception:
+                logger.exception('Polling stream events failed')
+                rows = []
+            for event_id, topic, event_type, data in rows:
+                self.fan_out(topic, {'id': event_id, 'type': event_type, 'data': data})
+            if len(rows) < self.BATCH_SIZE:
+                await asyncio.sleep(POLL_INTERVAL_SECONDS.value)
+
+    def _fetch(self, last_id, gaps):
+        from users.models import StreamEvent
+
+        now = time.monotonic()
+        for event_id in [i for i, deadline in gaps.items() if deadline < now]:
+            del gaps[event_id]
+        query = Q(id__gt=last_id)
+        if gaps:
+            query |= Q(id__in=list(gaps))
+        rows = list(
+            StreamEvent.objects.filter(query).order_by('id')
+            .values_list('id', 'topic', 'event_type', 'data')[:self.BATCH_SIZE]
+        )
+        expected = last_id + 1
+        for event_id, *_ in rows:
+            gaps.pop(event_id, None)
+            if event_id > last_id:
+                gaps.update(dict.fromkeys(range(expected, min(event_id, expected + self.BATCH_SIZE)),
+                                          now + self.GAP_WAIT_SECONDS))
+                expected = event_id + 1
+                last_id = event_id
+        return rows, last_id
+
+    def _renew_leases(self, leases):
+        """Lease newly subscribed topics, and renew the others a third of the way into their lease"""
+        from users.models import StreamTopic
+
+        with self._lock:
+            topics = set(self._topics)
+        for topic in set(leases) - topics:
+            del leases[topic]
+        now = time.monotonic()
+        due = [topic for topic in topics if now - leases.get(topic, float('-inf')) >= self.LEASE_SECONDS / 3]
+        if not due:
+            return
+        expires_at = timezone.now() + timedelta(seconds=self.LEASE_SECONDS)
+        StreamTopic.objects.bulk_create(
+            [StreamTopic(topic=topic, expires_at=expires_at) for topic in due],
+            update_conflicts=True, unique_fields=['topic'], update_fields=['expires_at'],
+        )
+        leases.update(dict.fromkeys(due, now))
+
+    def prune(self):
+        """Delete events older than EVENT_RETENTION_SECONDS and leases that have run out"""
+        from users.models import StreamEvent, StreamTopic
+
+        now = timezone.now()
+        StreamEvent.objects.filter(created_at__lt=now - timedelta(seconds=RETENTION_SECONDS.value)).delete()
+        StreamTopic.objects.filter(expires_at__lte=now).delete()
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(getattr(settings, 'EVENT_BROKER', 'utils.events.DatabaseBroker'))
+                _broker = broker_class()
+    return _broker
+
+
+def publish_on_commit(topics, event_type, data):
+    """Publish an event to each of `topics` once the current transaction commits"""
+    topics = list(dict.fromkeys(topics))
+    if not topics:
+        return
+
+    def _publish():
+        try:
+            get_broker().publish_many([(topic, event_type, data) for topic in topics])
+        except Exception:
+            logger.exception('Failed to publish %s event to %s', event_type, ', '.join(topics))
+
+    transaction.on_commit(_publish)
+
+
+def publish_to_users(user_ids, event_type, data):
+    """Publish an event to each user's stream once the current transaction commits"""
+    publish_on_commit([user_topic(user_id) for user_id in user_ids if user_id], event_type, data)
+
+
+def request_event_data(laundry_request, **extra):
+    data = {
+        'request_id': laundry_request.pk,
+        'status': laundry_request.status,
+        'driver_id': laundry_request.driver_id,
+        'updated_at': laundry_request.updated_at,
+    }
+    data.update(extra)
+    return data
+
+
+def publish_request_event(laundry_request, event_type, driver_user_id=None, **extra):
+    """Push a request change to its customer, its assigned driver and anyone tracking it"""
+    if driver_user_id is None and laundry_request.driver_id:
+        driver_user_id = laundry_request.driver.user_id
+    topics = [user_topic(user_id) for user_id in (laundry_request.customer_id, driver_user_id) if user_id]
+    topics.append(request_topic(laundry_request.pk))
+    publish_on_commit(topics, event_type, request_event_data(laundry_request, **extra))
+
+
+def publish_driver_position(driver_id, latitude, longitude, recorded_at):
+    """Fan a driver's latest position out to customers tracking them.
+
+    Publishes immediately; callers invoke this after the position is stored.
+    Throttling and delta encoding happen per subscriber in the tracking stream.
+    """
+    if latitude is None or longitude is None:
+        return
+    try:
+        publish_driver_positions([(driver_id, latitude, longitude, recorded_at)])
+    except Exception:
+        logger.exception('Failed to publish position of driver %s', driver_id)
+
+
+def publish_driver_positions(positions):
+    """Publish many (driver_id, latitude, longitude, recorded_at) positions with one broker call.
+
+    Only drivers somebody is tracking are written by DatabaseBroker. Errors
+    propagate, so a caller inside a transaction can roll back with it.
+    """
+    return get_broker().publish_many([
+        (driver_topic(driver_id), 'driver.position', {
+            'driver_id': driver_id,
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'recorded_at': recorded_at,
+        })
+        for driver_id, latitude, longitude, recorded_at in positions
+    ])
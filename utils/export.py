@@ -0,0 +1,223 @@
+"""Streaming CSV / NDJSON exports of laundry requests and notifications.
+
+Rows are read in keyset-paginated chunks (`WHERE id > last ORDER BY id
+LIMIT n`) and encoded line by line, optionally through an incremental gzip
+compressor, so memory stays flat however many rows an export has. Used by
+the staff export endpoints and the export_requests / export_notifications
+management commands.
+
+Under ASGI the response streams through `aiter_chunks()`, which pulls about
+GZIP_FLUSH_BYTES of output per hop to the sync thread; handing Django a
+plain generator there would make it buffer the whole export with
+sync_to_async(list) before sending a byte.
+"""
+import csv
+import datetime
+import json
+import sys
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+OUTPUTS = ('csv', 'ndjson')
+CHUNK_SIZE = 2000
+GZIP_FLUSH_BYTES = 64 * 1024
+
+# (column name, values_list lookup)
+REQUEST_COLUMNS = (
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+    ('status', 'status'),
+    ('service_type', 'service_type'),
+    ('customer_id', 'customer_id'),
+    ('customer_email', 'customer__email'),
+    ('customer_name', 'customer_name'),
+    ('phone', 'phone'),
+    ('address', 'address'),
+    ('pickup_time', 'pickup_time'),
+    ('pickup_latitude', 'pickup_latitude'),
+    ('pickup_longitude', 'pickup_longitude'),
+    ('items_description', 'items_description'),
+    ('driver_id', 'driver_id'),
+    ('driver_name', 'driver__name'),
+)
+
+NOTIFICATION_COLUMNS = (
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('user_id', 'user_id'),
+    ('email', 'email'),
+    ('title', 'title'),
+    ('summary', 'summary'),
+    ('body_text', 'body_text'),
+    ('read', 'read'),
+    ('related_request_id', 'related_request_id'),
+)
+
+
+def parse_bound(value, end=False):
+    """Parse an ISO date or datetime; a bare date as `end` means the end of that day"""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'{value!r} is not an ISO-8601 date or datetime')
+        moment = datetime.datetime.combine(day, datetime.time.max if end else datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_by_created(queryset, since=None, until=None):
+    since, until = parse_bound(since), parse_bound(until, end=True)
+    if since:
+        queryset = queryset.filter(created_at__gte=since)
+    if until:
+        queryset = queryset.filter(created_at__lte=until)
+    return queryset
+
+
+def filter_requests(queryset, since=None, until=None, status=None, driver=None):
+    """Apply the export filters; `status` may be comma-separated, `driver` an id or "none" """
+    queryset = filter_by_created(queryset, since, until)
+    if status:
+        queryset = queryset.filter(status__in=[s.strip() for s in status.split(',') if s.strip()])
+    if driver:
+        if str(driver).lower() == 'none':
+            queryset = queryset.filter(driver__isnull=True)
+        else:
+            try:
+                queryset = queryset.filter(driver_id=int(driver))
+            except ValueError:
+                raise ValueError('driver must be a driver id or "none"')
+    return queryset
+
+
+def filter_notifications(queryset, since=None, until=None, user=None, read=None):
+    queryset = filter_by_created(queryset, since, until)
+    if user:
+        try:
+            queryset = queryset.filter(user_id=int(user))
+        except ValueError:
+            raise ValueError('user must be a user id')
+    if read not in (None, ''):
+        queryset = queryset.filter(read=str(read).lower() in ('1', 'true', 'yes'))
+    return queryset
+
+
+def iter_rows(queryset, lookups, chunk_size=CHUNK_SIZE):
+    """Yield value tuples in id order, one keyset-paginated query per chunk"""
+    queryset = queryset.order_by('id').values_list(*lookups)
+    id_index = lookups.index('id')
+    last_id = None
+    while True:
+        page = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = list(page[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][id_index]
+
+
+class _LineBuffer:
+    """File-like sink that hands back whatever csv.writer just wrote"""
+
+    def write(self, value):
+        return value
+
+
+def encode_csv(columns, rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow([name for name, _ in columns]).encode('utf-8')
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row]).encode('utf-8')
+
+
+def encode_ndjson(columns, rows):
+    names = [name for name, _ in columns]
+    for row in rows:
+        yield (json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Compress a byte stream on the fly into a single gzip member"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    pending = []
+    size = 0
+    for chunk in chunks:
+        pending.append(compressor.compress(chunk))
+        size += len(pending[-1])
+        if size >= GZIP_FLUSH_BYTES:
+            yield b''.join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+def export_stream(queryset, columns, output='csv', compress=False, chunk_size=CHUNK_SIZE):
+    """Byte chunks of the encoded export"""
+    if output not in OUTPUTS:
+        raise ValueError(f'output must be one of: {", ".join(OUTPUTS)}')
+    rows = iter_rows(queryset, [lookup for _, lookup in columns], chunk_size=chunk_size)
+    encode = encode_csv if output == 'csv' else encode_ndjson
+    chunks = encode(columns, rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+async def aiter_chunks(stream, flush_bytes=GZIP_FLUSH_BYTES):
+    """Async iterator over a sync byte stream, reading it in the sync thread"""
+    stream = iter(stream)
+
+    def take():
+        pending, size = [], 0
+        for chunk in stream:
+            pending.append(chunk)
+            size += len(chunk)
+            if size >= flush_bytes:
+                break
+        return b''.join(pending)
+
+    while True:
+        data = await sync_to_async(take)()
+        if not data:
+            return
+        yield data
+
+
+def export_response(queryset, columns, basename, output='csv', compress=False, request=None):
+    """StreamingHttpResponse downloading the export; pass `request` so ASGI gets an async iterator"""
+    stream = export_stream(queryset, columns, output=output, compress=compress)
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        stream = aiter_chunks(stream)
+    filename = f'{basename}-{timezone.now():%Y%m%d-%H%M%S}.{output}'
+    if compress:
+        content_type = 'application/gzip'
+        filename += '.gz'
+    else:
+        content_type = 'text/csv; charset=utf-8' if output == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def write_export(stream, path):
+    """Write an export stream to `path`, or to stdout when path is "-" """
+    if path == '-':
+        out = sys.stdout.buffer
+        for chunk in stream:
+            out.write(chunk)
+        out.flush()
+        return
+    with open(path, 'wb') as out:
+        for chunk in stream:
+            out.write(chunk)
@@ -0,0 +1,42 @@
+from django.core.mail.backends import locmem
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    """Local stand-in for the SES backend that counts connections.
+
+    Messages are kept in `django.core.mail.outbox` like the locmem backend,
+    and every time a connection is opened `connections_opened` is bumped so
+    the effect of connection reuse can be measured without talking to AWS.
+    Use it with EMAIL_BACKEND = "utils.mail_backends.CountingEmailBackend".
+    """
+    connections_opened = 0
+    messages_sent = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_open = False
+
+    @classmethod
+    def reset_counters(cls):
+        cls.connections_opened = 0
+        cls.messages_sent = 0
+
+    def open(self):
+        if self.is_open:
+            return False
+        CountingEmailBackend.connections_opened += 1
+        self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        new_conn_created = self.open()
+        try:
+            sent = super().send_messages(messages)
+            CountingEmailBackend.messages_sent += sent
+            return sent
+        finally:
+            if new_conn_created:
+                self.close()
@@ -0,0 +1,197 @@
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from users.models import NotificationOutbox
+from utils.conf import Setting
+
+logger = logging.getLogger(__name__)
+
+# Tunables (override in settings.py)
+OUTBOX_MAX_ATTEMPTS = Setting('NOTIFICATION_OUTBOX_MAX_ATTEMPTS', 8)
+OUTBOX_BACKOFF_SECONDS = Setting('NOTIFICATION_OUTBOX_BACKOFF_SECONDS', 30)
+OUTBOX_MAX_BACKOFF_SECONDS = Setting('NOTIFICATION_OUTBOX_MAX_BACKOFF_SECONDS', 3600)
+# Rows stuck in `processing` longer than this are assumed orphaned by a crashed worker
+OUTBOX_LOCK_TIMEOUT_SECONDS = Setting('NOTIFICATION_OUTBOX_LOCK_TIMEOUT_SECONDS', 300)
+
+
+def _load_request(payload):
+    from requests_app.models import LaundryRequest
+    return LaundryRequest.objects.select_related('customer', 'driver__user').get(pk=payload['request_id'])
+
+
+def _load_user(payload):
+    from django.contrib.auth import get_user_model
+    return get_user_model().objects.get(pk=payload['user_id'])
+
+
+def _handle_new_request(payload, connection=None):
+    from utils.email_service import notify_new_request
+    notify_new_request(_load_request(payload), connection=connection)
+
+
+def _handle_request_status_update(payload, connection=None):
+    from utils.email_service import notify_request_status_update
+    request_obj = _load_request(payload)
+    # Report the status as it was when the event happened, not as it is now
+    request_obj.status = payload.get('new_status') or request_obj.status
+    notify_request_status_update(request_obj, payload.get('old_status'), connection=connection)
+
+
+def _handle_driver_assignment(payload, connection=None):
+    from utils.email_service import notify_driver_assignment
+    notify_driver_assignment(_load_request(payload), connection=connection)
+
+
+def _handle_new_user_registration(payload, connection=None):
+    from utils.email_service import notify_new_user_registration
+    notify_new_user_registration(_load_user(payload), connection=connection)
+
+
+def _handle_user_signup_confirmation(payload, connection=None):
+    from utils.email_service import notify_user_signup_confirmation
+    notify_user_signup_confirmation(_load_user(payload), connection=connection)
+
+
+EVENT_HANDLERS = {
+    'new_request': _handle_new_request,
+    'request_status_update': _handle_request_status_update,
+    'driver_assignment': _handle_driver_assignment,
+    'new_user_registration': _handle_new_user_registration,
+    'user_signup_confirmation': _handle_user_signup_confirmation,
+}
+
+
+def enqueue_notification(event, **payload):
+    """Record a notification event for background delivery.
+
+    Call this inside the same transaction as the change that triggers the
+    event so the outbox row commits (or rolls back) together with it. When
+    `NOTIFICATION_OUTBOX_ENABLED` is False the event is delivered inline once
+    the surrounding transaction commits, which is handy for local development
+    without a worker running.
+    """
+    if event not in EVENT_HANDLERS:
+        raise ValueError(f'Unknown notification event: {event}')
+    if not getattr(settings, 'NOTIFICATION_OUTBOX_ENABLED', True):
+        transaction.on_commit(lambda: _deliver_inline(event, payload))
+        return None
+    return NotificationOutbox.objects.create(event=event, payload=payload)
+
+
+def enqueue_notifications(event, payloads):
+    """Bulk variant of enqueue_notification: one INSERT for many events of the same kind"""
+    if event not in EVENT_HANDLERS:
+        raise ValueError(f'Unknown notification event: {event}')
+    if not getattr(settings, 'NOTIFICATION_OUTBOX_ENABLED', True):
+        for payload in payloads:
+            transaction.on_commit(lambda payload=payload: _deliver_inline(event, payload))
+        return []
+    return NotificationOutbox.objects.bulk_create(
+        [NotificationOutbox(event=event, payload=payload) for payload in payloads]
+    )
+
+
+def _deliver_inline(event, payload):
+    try:
+        EVENT_HANDLERS[event](payload)
+    except Exception:
+        logger.exception('Inline delivery of %s notification failed (payload=%s)', event, payload)
+
+
+def backoff_delay(attempts):
+    """Exponential backoff for the given attempt number (1-based), capped."""
+    delay = OUTBOX_BACKOFF_SECONDS.value * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, OUTBOX_MAX_BACKOFF_SECONDS.value))
+
+
+def _claim(message_id, now):
+    """Atomically move a due row to `processing`. Returns False if another worker won."""
+    stale = now - timedelta(seconds=OUTBOX_LOCK_TIMEOUT_SECONDS.value)
+    return NotificationOutbox.objects.filter(
+        Q(status='pending', available_at__lte=now) | Q(status='processing', locked_at__lt=stale),
+        pk=message_id,
+    ).update(status='processing', locked_at=now, attempts=F('attempts') + 1) == 1
+
+
+def process_message(message, connection=None):
+    """Deliver a single claimed outbox row and record the outcome.
+
+    The claim has already committed, and the handler renders and sends its
+    emails with no transaction open: on SQLite an open write transaction
+    would hold the database lock for the whole email round trip. The
+    in-app Notification rows the handler produces are collected meanwhile
+    and written together with the `sent` mark in one short transaction, so
+    a failed send leaves none behind for the retry to duplicate.
+
+    Delivery is at least once: if the worker dies between the send and
+    that final transaction, the row's lock goes stale and the event is sent
+    again.
+    """
+    from utils.email_service import defer_notifications, write_deferred_notifications
+
+    handler = EVENT_HANDLERS.get(message.event)
+    try:
+        if handler is None:
+            raise ValueError(f'No handler registered for event {message.event!r}')
+        with defer_notifications() as notifications:
+            handler(message.payload, connection=connection)
+        with transaction.atomic():
+            write_deferred_notifications(notifications)
+            NotificationOutbox.objects.filter(pk=message.pk).update(
+                status='sent', sent_at=timezone.now(), locked_at=None, last_error='',
+            )
+        return True
+    except Exception as exc:
+        if connection is not None:
+            # Drop a possibly broken connection; the next send reopens it
+            connection.close()
+        message.refresh_from_db(fields=['attempts'])
+        if handler is None or message.attempts >= OUTBOX_MAX_ATTEMPTS.value:
+            logger.exception('Notification outbox %s (%s) moved to dead letter', message.pk, message.event)
+            status, available_at = 'dead', timezone.now()
+        else:
+            logger.warning('Notification outbox %s (%s) failed, attempt %s: %s',
+                           message.pk, message.event, message.attempts, exc)
+            status, available_at = 'pending', timezone.now() + backoff_delay(message.attempts)
+        NotificationOutbox.objects.filter(pk=message.pk).update(
+            status=status, available_at=available_at, locked_at=None, last_error=repr(exc),
+        )
+        return False
+
+
+def process_outbox(batch_size=50):
+    """Drain up to `batch_size` due outbox rows. Returns (sent, failed).
+
+    Every email produced during the cycle is sent over one shared backend
+    connection instead of opening a new one per event.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=OUTBOX_LOCK_TIMEOUT_SECONDS.value)
+    due_ids = list(
+        NotificationOutbox.objects.filter(
+            Q(status='pending', available_at__lte=now) | Q(status='processing', locked_at__lt=stale)
+        ).order_by('id').values_list('id', flat=True)[:batch_size]
+    )
+    sent = failed = 0
+    if not due_ids:
+        return sent, failed
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    try:
+        for message_id in due_ids:
+            if not _claim(message_id, now):
+                continue
+            message = NotificationOutbox.objects.get(pk=message_id)
+            if process_message(message, connection=connection):
+                sent += 1
+            else:
+                failed += 1
+    finally:
+        connection.close()
+    return sent, failed
@@ -0,0 +1,45 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from utils.conf import Setting
+
+PAGE_SIZE = Setting('PAGINATION_PAGE_SIZE', 50)
+MAX_PAGE_SIZE = Setting('PAGINATION_MAX_PAGE_SIZE', 200)
+LEGACY_ARRAY = Setting('PAGINATION_LEGACY_ARRAY', False)
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """Keyset pagination over (created_at, id), newest first.
+
+    Cursors are opaque, stay stable while new rows are inserted, and each page
+    is a bounded index range scan no matter how long the history grows.
+
+    Clients that still expect a bare JSON array can pass `?legacy=1` (or the
+    project can set PAGINATION_LEGACY_ARRAY = True): they get the page as a
+    plain list, with the next/previous page URLs in a `Link` header.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    legacy_query_param = 'legacy'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = PAGE_SIZE.value
+        self.max_page_size = MAX_PAGE_SIZE.value
+        flag = request.query_params.get(self.legacy_query_param)
+        if flag is None:
+            self.legacy = LEGACY_ARRAY.value
+        else:
+            self.legacy = flag.lower() in ('1', 'true', 'yes')
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if not self.legacy:
+            return super().get_paginated_response(data)
+        links = []
+        next_link, previous_link = self.get_next_link(), self.get_previous_link()
+        if next_link:
+            links.append(f'<{next_link}>; rel="next"')
+        if previous_link:
+            links.append(f'<{previous_link}>; rel="prev"')
+        headers = {'Link': ', '.join(links)} if links else None
+        return Response(data, headers=headers)
@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def query_budget(max_queries, using=DEFAULT_DB_ALIAS):
+    """Fail if the wrapped block issues more than `max_queries` SQL queries.
+
+    Use it in tests to pin list endpoints to a fixed number of queries, so an
+    N+1 regression fails loudly instead of slowing down in production:
+
+        with query_budget(4):
+            client.get('/api/requests/')
+
+    The captured queries are listed in the assertion message.
+    """
+    with CaptureQueriesContext(connections[using]) as captured:
+        yield captured
+    executed = len(captured.captured_queries)
+    if executed > max_queries:
+        statements = '\n'.join(
+            f'{i}. {query["sql"]}' for i, query in enumerate(captured.captured_queries, start=1)
+        )
+        raise AssertionError(
+            f'{executed} queries executed, budget was {max_queries}:\n{statements}'
+        )